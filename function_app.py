@@ -10,10 +10,48 @@ import logging
 import os
 import json
 import asyncio
-from openai import AsyncAzureOpenAI
+import hashlib
+import hmac
+import math
+import random
+import time
+from urllib.parse import urlsplit
+from azurefunctions.extensions.http.fastapi import (
+    Request,
+    Response,
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
+import httpx
+from openai import AsyncAzureOpenAI, APIConnectionError, InternalServerError, RateLimitError
 from azure.identity.aio import DefaultAzureCredential
 from azure.search.documents.aio import SearchClient
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+from rag.cache import AnswerCache, make_cache_key
+from rag.singleflight import SingleFlight
+from rag.token_cache import CachedTokenCredential
+from rag.transport import HttpPoolSettings, SearchHttpPool, create_openai_http_client
+from rag.context import pack_context
+from rag.static_files import StaticFiles, negotiate_encoding
+from rag.sessions import SessionStore, create_backend, is_follow_up
+from rag.jobs import JobError, JobQueueFull, JobStore, JobWorkerPool, create_job_queue
+from rag.query_filters import analyze_query, format_facets
+from rag.multi_query import build_query_variants, reciprocal_rank_fusion
+from azure.search.documents.models import VectorizedQuery
+from rag.rate_limit import AdmissionScheduler, OverloadedError, estimate_tokens, parse_retry_after
+from rag.deadline import (
+    DeadlineExceeded,
+    HedgedCall,
+    current_deadline,
+    retry_with_jitter,
+    run_with_budget,
+    start_deadline,
+)
+from rag.log_pipeline import install_log_pipeline, start_request_log
+from rag import metrics
+from rag.metrics import timed
 
 # Azure Functions アプリケーション初期化
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
@@ -21,14 +59,265 @@ app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 # 環境変数から設定を取得
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4")
+AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
 AZURE_SEARCH_ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT")
 AZURE_SEARCH_INDEX = os.getenv("AZURE_SEARCH_INDEX", "redlist-index")
 AZURE_SEARCH_KEY = os.getenv("AZURE_SEARCH_KEY")
 
+# ローカル検索インデックス（指定時はAzure AI Searchの代わりにインプロセスで検索）
+# 保存済みインデックスのディレクトリ、またはJSONLファイルを指定する
+LOCAL_SEARCH_INDEX_PATH = os.getenv("LOCAL_SEARCH_INDEX_PATH")
+
+# 種名の直接参照に使う処理済みJSONL（指定時は質問中の和名・学名から検索を経由せずにドキュメントを取得）
+SPECIES_LOOKUP_PATH = os.getenv("SPECIES_LOOKUP_PATH")
+
+# 検索件数と、プロンプトに含めるコンテキストのトークン数の上限（0 の場合は制限しない）
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", "3"))
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+
+# 質問中の分類・ランクの語を検索の filter に変換するか（集計を尋ねる質問ではファセットも取得）
+SEARCH_FILTER_ROUTING = os.getenv("SEARCH_FILTER_ROUTING", "true").lower() == "true"
+SEARCH_FACET_COUNT = int(os.getenv("SEARCH_FACET_COUNT", "20"))
+
+# 質問から複数の検索クエリを作成して並行して検索し、順位で統合するか（Reciprocal Rank Fusion）
+# 期限までに返らないクエリの結果は使わない
+SEARCH_MULTI_QUERY = os.getenv("SEARCH_MULTI_QUERY", "false").lower() == "true"
+SEARCH_MULTI_QUERY_DEADLINE_SECONDS = float(os.getenv("SEARCH_MULTI_QUERY_DEADLINE_SECONDS", "1.0"))
+
+# キーワード検索とベクトル検索を組み合わせるか（コーパスの埋め込みは scripts/embed-documents.py で作成）
+# 質問の埋め込みに失敗した場合はキーワード検索のみで検索する
+SEARCH_HYBRID = os.getenv("SEARCH_HYBRID", "false").lower() == "true"
+SEARCH_VECTOR_FIELD = os.getenv("SEARCH_VECTOR_FIELD", "content_vector")
+AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
+
+# 検索の候補を RERANK_CANDIDATES 件取得し、ローカルで再ランキングして上位 top_k 件を選ぶか
+# 重みは RERANK_WEIGHTS_PATH のJSONで変更できる（rag/rerank.py を参照）
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "40"))
+RERANK_WEIGHTS_PATH = os.getenv("RERANK_WEIGHTS_PATH")
+
+# 複数ターンの会話（リクエストに conversation_id を含めた場合のみ、サーバー側で履歴を保持する）
+# SESSION_STORE: memory（ワーカー内のみ） / file（1会話1ファイル） / sqlite（ワーカー間で共有）
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH")
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+# 履歴のトークン数の上限（超えた場合は古いターンを要約に畳み込む）と要約のトークン数の上限
+SESSION_HISTORY_MAX_TOKENS = int(os.getenv("SESSION_HISTORY_MAX_TOKENS", "1000"))
+SESSION_SUMMARY_MAX_TOKENS = int(os.getenv("SESSION_SUMMARY_MAX_TOKENS", "300"))
+
+# 非同期ジョブ（POST /api/chat/jobs で受け付けてすぐに返し、上限付きのワーカーが順に処理する）
+# JOB_QUEUE: memory（ワーカープロセス内、上限 JOB_QUEUE_MAX_SIZE 件） / storage（Azure Storage Queue）
+JOB_QUEUE = os.getenv("JOB_QUEUE", "memory")
+JOB_QUEUE_MAX_SIZE = int(os.getenv("JOB_QUEUE_MAX_SIZE", "1000"))
+JOB_QUEUE_NAME = os.getenv("JOB_QUEUE_NAME", "chat-jobs")
+# storage の接続先（接続文字列、または Managed Identity で接続するアカウントのURL）
+JOB_QUEUE_CONNECTION_STRING = os.getenv("JOB_QUEUE_CONNECTION_STRING")
+JOB_QUEUE_ACCOUNT_URL = os.getenv("JOB_QUEUE_ACCOUNT_URL")
+# 取り出したメッセージをほかのワーカーから隠す秒数（CHAT_DEADLINE_SECONDS より長くする）と、処理を試す回数の上限
+JOB_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# 同時に処理するジョブの数
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# ジョブの状態の保存先（JOB_STORE: memory / file / sqlite）と、終了後に結果を保持する秒数
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH")
+JOB_MAX_ENTRIES = int(os.getenv("JOB_MAX_ENTRIES", "10000"))
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "3600"))
+# Webhook（callback_url）の送信先として許可するホスト（カンマ区切り、未設定の場合は callback_url を受け付けない）
+JOB_CALLBACK_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+}
+# 指定時は本文の HMAC-SHA256 を X-Job-Signature ヘッダーに付ける
+JOB_CALLBACK_SECRET = os.getenv("JOB_CALLBACK_SECRET")
+JOB_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", "10"))
+JOB_CALLBACK_MAX_RETRIES = int(os.getenv("JOB_CALLBACK_MAX_RETRIES", "2"))
+
+# /api/chat の1リクエストの期限（検索・生成の各段階はこの残り時間の範囲で実行、0 の場合は期限なし）
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "20"))
+# 検索1回あたりの持ち時間と、一時的な失敗・タイムアウト時の再送回数・バックオフの基準秒数
+SEARCH_TIMEOUT_SECONDS = float(os.getenv("SEARCH_TIMEOUT_SECONDS", "3"))
+SEARCH_MAX_RETRIES = int(os.getenv("SEARCH_MAX_RETRIES", "2"))
+SEARCH_RETRY_BASE_DELAY_SECONDS = float(os.getenv("SEARCH_RETRY_BASE_DELAY_SECONDS", "0.2"))
+# 直近の検索の所要時間の分位点を超えても返らない検索は、同じ検索をもう1つ送って先に返ったほうを使う
+SEARCH_HEDGE_ENABLED = os.getenv("SEARCH_HEDGE_ENABLED", "true").lower() == "true"
+SEARCH_HEDGE_QUANTILE = float(os.getenv("SEARCH_HEDGE_QUANTILE", "0.95"))
+SEARCH_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("SEARCH_HEDGE_MIN_DELAY_SECONDS", "0.05"))
+
+# static/ 以下のHTML以外のファイルをブラウザにキャッシュさせる秒数（HTMLは毎回 ETag で再検証）
+STATIC_MAX_AGE_SECONDS = int(os.getenv("STATIC_MAX_AGE_SECONDS", "3600"))
+
+# /api/chat のレスポンスに Server-Timing ヘッダーを付与するか
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+# ログの書き込みをバックグラウンドのスレッドで行うか（キューが満杯の場合は捨てる）と、キューの件数
+# 別スレッドで書き込んだログは Application Insights で関数の呼び出しに紐づかなくなるため、既定では使わない
+LOG_QUEUE_ENABLED = os.getenv("LOG_QUEUE_ENABLED", "false").lower() == "true"
+LOG_QUEUE_MAX_SIZE = int(os.getenv("LOG_QUEUE_MAX_SIZE", "10000"))
+# ログの形式（json: リクエストIDなどを含む1行のJSON / text: ホストの既定の形式のまま）
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# INFO 以下のログを出力するリクエストの割合（リクエストごとに判定し、WARNING 以上は常に出力）
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+# Azure ADトークンを有効期限の何秒前にバックグラウンドで更新するか
+TOKEN_REFRESH_MARGIN_SECONDS = float(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+# OpenAI / AI Search への接続プールとタイムアウト
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "60"))
+OPENAI_HTTP2_ENABLED = os.getenv("OPENAI_HTTP2_ENABLED", "false").lower() == "true"
+
+# Azure OpenAI のクォータに合わせた流量制御（0 の場合は制限しない）
+# クォータはデプロイメント単位のため、複数インスタンスで実行する場合はインスタンス数で割った値を設定する
+OPENAI_RPM_LIMIT = float(os.getenv("OPENAI_RPM_LIMIT", "0"))
+OPENAI_TPM_LIMIT = float(os.getenv("OPENAI_TPM_LIMIT", "0"))
+OPENAI_QUEUE_MAX_SIZE = int(os.getenv("OPENAI_QUEUE_MAX_SIZE", "100"))
+OPENAI_QUEUE_MAX_WAIT_SECONDS = float(os.getenv("OPENAI_QUEUE_MAX_WAIT_SECONDS", "10"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+# 回答キャッシュ設定（ANSWER_CACHE_MAX_ENTRIES=0 で無効化）
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# 期限切れの回答を保持する秒数（検索・生成が失敗した場合に古い回答として返す、0 の場合は返さない）
+ANSWER_CACHE_STALE_SECONDS = float(os.getenv("ANSWER_CACHE_STALE_SECONDS", "86400"))
+
+# ログの書き込みをリクエストの処理から切り離す（ワーカープロセス内で共有）
+log_pipeline = install_log_pipeline(
+    max_queue_size=LOG_QUEUE_MAX_SIZE,
+    json_format=LOG_FORMAT == "json",
+    use_queue=LOG_QUEUE_ENABLED
+)
+# Azure SDK は HTTP リクエストごとにURL・ヘッダーを INFO で出力するため、WARNING 以上のみにする
+logging.getLogger("azure.core.pipeline.policies.http_logging_policy").setLevel(logging.WARNING)
+
 # Azure認証情報とクライアント（グローバルスコープで再利用）
 credential = DefaultAzureCredential()
+# トークンはキャッシュし、期限前にバックグラウンドで更新する（OpenAIとSearchで共有）
+token_credential = CachedTokenCredential(credential, refresh_margin=TOKEN_REFRESH_MARGIN_SECONDS)
 openai_client = None
 search_client = None
+openai_transport = None
+search_http_pool = None
+local_search_index = None
+species_lookup = None
+reranker = None
+callback_client = None
+warmup_task = None
+
+# 接続プールの設定（OpenAIとSearchで共通、HTTP/2はOpenAIのみ）
+http_pool_settings = HttpPoolSettings(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    connect_timeout=HTTP_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=HTTP_READ_TIMEOUT_SECONDS,
+    http2=OPENAI_HTTP2_ENABLED
+)
+
+# チャット補完の送信を RPM / TPM のペースに合わせる（ワーカープロセス内で共有）
+openai_scheduler = AdmissionScheduler(
+    rpm=OPENAI_RPM_LIMIT,
+    tpm=OPENAI_TPM_LIMIT,
+    max_queue=OPENAI_QUEUE_MAX_SIZE,
+    max_wait=OPENAI_QUEUE_MAX_WAIT_SECONDS
+)
+
+# 回答キャッシュ（ワーカープロセス内で共有）
+answer_cache = AnswerCache(
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    max_bytes=ANSWER_CACHE_MAX_BYTES,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    stale_seconds=ANSWER_CACHE_STALE_SECONDS
+)
+
+# 質問の埋め込みキャッシュ（同じ質問で埋め込みAPIを呼び直さない）
+embedding_cache = AnswerCache(
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    max_bytes=ANSWER_CACHE_MAX_BYTES,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS
+)
+
+# 会話のセッション（ワーカープロセス内で共有）
+session_store = SessionStore(
+    create_backend(SESSION_STORE, SESSION_STORE_PATH),
+    max_entries=SESSION_MAX_ENTRIES,
+    ttl_seconds=SESSION_TTL_SECONDS,
+    history_max_tokens=SESSION_HISTORY_MAX_TOKENS,
+    summary_max_tokens=SESSION_SUMMARY_MAX_TOKENS
+)
+
+# 検索のヘッジ（所要時間の分布はワーカープロセス内で共有）
+search_hedger = HedgedCall(
+    quantile=SEARCH_HEDGE_QUANTILE,
+    initial_delay=SEARCH_TIMEOUT_SECONDS / 2,
+    min_delay=SEARCH_HEDGE_MIN_DELAY_SECONDS
+)
+
+# 静的ファイル（起動時に読み込んで圧縮しておき、リクエストごとのディスク読み込みをなくす）
+static_files = StaticFiles.load(os.path.join(os.path.dirname(__file__), 'static'))
+
+# 同一質問の同時実行を1つにまとめる（キーはキャッシュキーと共通）
+inflight_requests = SingleFlight()
+
+# キャッシュ・合流の統計を /api/metrics に出力する
+metrics.registry.callback("rag_answer_cache_hits_total", "Answer cache hits.",
+                          lambda: answer_cache.hits, "counter")
+metrics.registry.callback("rag_answer_cache_misses_total", "Answer cache misses.",
+                          lambda: answer_cache.misses, "counter")
+metrics.registry.callback("rag_answer_cache_evictions_total", "Answer cache LRU evictions.",
+                          lambda: answer_cache.evictions, "counter")
+metrics.registry.callback("rag_answer_cache_entries", "Answer cache entries.",
+                          lambda: len(answer_cache))
+metrics.registry.callback("rag_embedding_cache_hits_total", "Query embedding cache hits.",
+                          lambda: embedding_cache.hits, "counter")
+metrics.registry.callback("rag_singleflight_collapsed_total",
+                          "Chat requests that joined an identical in-flight request.",
+                          lambda: inflight_requests.collapsed, "counter")
+metrics.registry.callback("rag_sessions", "Conversation sessions held in memory.",
+                          lambda: len(session_store))
+metrics.registry.callback("rag_session_compactions_total",
+                          "Conversation histories compacted into a summary.",
+                          lambda: session_store.compactions, "counter")
+metrics.registry.callback("rag_answer_cache_stale_hits_total",
+                          "Expired answers served because retrieval or generation failed.",
+                          lambda: answer_cache.stale_hits, "counter")
+metrics.registry.callback("rag_search_hedged_total", "Search requests duplicated after the hedge delay.",
+                          lambda: search_hedger.hedged, "counter")
+metrics.registry.callback("rag_search_hedge_wins_total", "Hedged search requests that returned first.",
+                          lambda: search_hedger.hedge_wins, "counter")
+metrics.registry.callback("rag_search_hedge_delay_seconds", "Current delay before a search request is hedged.",
+                          lambda: search_hedger.delay)
+metrics.registry.callback("rag_token_fetches_total", "Azure AD token acquisitions.",
+                          lambda: token_credential.fetches, "counter")
+metrics.registry.callback("rag_token_refresh_failures_total", "Azure AD token acquisition failures.",
+                          lambda: token_credential.failures, "counter")
+metrics.registry.callback("rag_openai_http_connections_in_use", "OpenAI HTTP connections in use.",
+                          lambda: openai_transport.stats()["in_use"] if openai_transport else 0)
+metrics.registry.callback("rag_openai_http_pool_waits_total",
+                          "OpenAI requests that had to wait for a pooled connection.",
+                          lambda: openai_transport.waits if openai_transport else 0, "counter")
+metrics.registry.callback("rag_search_http_connections_in_use", "Search HTTP connections in use.",
+                          lambda: search_http_pool.stats()["in_use"] if search_http_pool else 0)
+metrics.registry.callback("rag_search_http_pool_waits_total",
+                          "Search requests that had to wait for a pooled connection.",
+                          lambda: search_http_pool.waits if search_http_pool else 0, "counter")
+metrics.registry.callback("rag_openai_admission_waiting",
+                          "Chat completions waiting for RPM/TPM admission.",
+                          lambda: openai_scheduler.waiting)
+metrics.registry.callback("rag_openai_admission_rejected_total",
+                          "Chat completions rejected because the admission queue was full or timed out.",
+                          lambda: openai_scheduler.rejected_queue_full + openai_scheduler.rejected_timeout,
+                          "counter")
+metrics.registry.callback("rag_openai_throttled_total", "429 responses received from Azure OpenAI.",
+                          lambda: openai_scheduler.throttled, "counter")
+metrics.registry.callback("rag_log_records_queued", "Log records waiting to be written.",
+                          lambda: log_pipeline.queued if log_pipeline else 0)
+metrics.registry.callback("rag_log_records_dropped_total", "Log records dropped because the log queue was full.",
+                          lambda: log_pipeline.dropped if log_pipeline else 0, "counter")
 
 
 async def get_openai_client():
@@ -36,17 +325,35 @@ async def get_openai_client():
     OpenAIクライアントをシングルトンで取得（非同期版）
     初回呼び出し時のみクライアントを作成し、以降は再利用
     """
-    global openai_client
+    global openai_client, openai_transport
     if openai_client is None:
-        # Azure AD認証トークンを取得する関数
+        # 接続プールの設定を反映したHTTPクライアントを使用
+        # 再送は流量制御と合わせて create_chat_completion で行うため、SDKの自動リトライは無効化する
+        http_client, openai_transport = create_openai_http_client(http_pool_settings)
+        
+        if AZURE_OPENAI_API_KEY:
+            # キーが設定されている場合はキー認証（ローカルのスタブやベンチマーク向け）
+            openai_client = AsyncAzureOpenAI(
+                azure_endpoint=AZURE_OPENAI_ENDPOINT,
+                api_key=AZURE_OPENAI_API_KEY,
+                api_version="2024-02-01",
+                http_client=http_client,
+                max_retries=0
+            )
+            return openai_client
+        
+        # Azure AD認証トークンを取得する関数（キャッシュ済みのトークンを返し、更新はバックグラウンドで行う）
         async def get_azure_ad_token():
-            token = await credential.get_token("https://cognitiveservices.azure.com/.default")
+            with timed("token"):
+                token = await token_credential.get_token("https://cognitiveservices.azure.com/.default")
             return token.token
         
         openai_client = AsyncAzureOpenAI(
             azure_endpoint=AZURE_OPENAI_ENDPOINT,
             azure_ad_token_provider=get_azure_ad_token,
-            api_version="2024-02-01"
+            api_version="2024-02-01",
+            http_client=http_client,
+            max_retries=0
         )
     return openai_client
 
@@ -56,213 +363,1401 @@ async def get_search_client():
     AI Searchクライアントをシングルトンで取得（非同期版）
     初回呼び出し時のみクライアントを作成し、以降は再利用
     """
-    global search_client
+    global search_client, search_http_pool
     if search_client is None:
         # Key認証またはManaged Identity認証を選択
-        search_credential = AzureKeyCredential(AZURE_SEARCH_KEY) if AZURE_SEARCH_KEY else credential
+        search_credential = AzureKeyCredential(AZURE_SEARCH_KEY) if AZURE_SEARCH_KEY else token_credential
+        # aiohttpのセッションはイベントループ上で作成する必要があるため、ここで作成する
+        search_http_pool = SearchHttpPool(http_pool_settings)
+        # 再送は期限に合わせて call_search で行うため、SDKの自動リトライは無効化する
         search_client = SearchClient(
             endpoint=AZURE_SEARCH_ENDPOINT,
             index_name=AZURE_SEARCH_INDEX,
-            credential=search_credential
+            credential=search_credential,
+            transport=search_http_pool.transport,
+            retry_total=0
         )
     return search_client
 
 
-async def search_documents(query: str, top_k: int = 3) -> list:
+async def close_clients() -> None:
     """
-    Azure AI Searchでドキュメントを検索（非同期版）
+    クライアントと接続プールを閉じる（ベンチマークなどプロセス内で再利用する場合の後始末）
+    """
+    global openai_client, search_client, openai_transport, search_http_pool, callback_client
+    await job_workers.stop()
+    if callback_client is not None:
+        await callback_client.aclose()
+    if openai_client is not None:
+        await openai_client.close()
+    if search_client is not None:
+        await search_client.close()
+    if search_http_pool is not None:
+        await search_http_pool.close()
+    await token_credential.close()
+    openai_client = search_client = openai_transport = search_http_pool = callback_client = None
+
+
+def http_pool_stats() -> dict:
+    """
+    OpenAI / Search の接続プールの統計（未作成の場合はNone）
+    """
+    return {
+        'openai': openai_transport.stats() if openai_transport is not None else None,
+        'search': search_http_pool.stats() if search_http_pool is not None else None
+    }
+
+
+async def get_local_search_index():
+    """
+    ローカル検索インデックスをシングルトンで取得
+    初回のみファイルから読み込み（JSONL指定時は構築）、以降は再利用
+    """
+    global local_search_index
+    if local_search_index is None:
+        # NumPyの読み込みを避けるため、ローカル検索を使う場合のみインポートする
+        from rag.local_search import LocalSearchIndex
+        # 読み込みはファイルI/OとCPU処理のため、イベントループを塞がないようスレッドで実行
+        local_search_index = await asyncio.to_thread(LocalSearchIndex.open, LOCAL_SEARCH_INDEX_PATH)
+        logging.info("Local search index loaded: %d documents", len(local_search_index))
+    return local_search_index
+
+
+async def get_species_lookup():
+    """
+    種名の辞書とドキュメントストアをシングルトンで取得
+    初回のみJSONLから構築し、以降は再利用
+    """
+    global species_lookup
+    if species_lookup is None:
+        from rag.species_lookup import SpeciesLookup
+        # 構築はファイルI/OとCPU処理のため、イベントループを塞がないようスレッドで実行
+        species_lookup = await asyncio.to_thread(SpeciesLookup.from_jsonl, SPECIES_LOOKUP_PATH)
+        logging.info("Species lookup loaded: %d names / %d documents",
+                     len(species_lookup.automaton), len(species_lookup))
+    return species_lookup
+
+
+async def get_reranker():
+    """
+    再ランキングのモデルをシングルトンで取得
+    初回のみ重みのファイルを読み込み、文字の正規化の表を作成する
+    """
+    global reranker
+    if reranker is None:
+        # NumPyの読み込みを避けるため、再ランキングを使う場合のみインポートする
+        from rag.rerank import Reranker
+        # 正規化の表の作成はCPU処理のため、イベントループを塞がないようスレッドで実行
+        if RERANK_WEIGHTS_PATH:
+            reranker = await asyncio.to_thread(Reranker.from_file, RERANK_WEIGHTS_PATH)
+        else:
+            reranker = await asyncio.to_thread(Reranker)
+        logging.info("Reranker loaded: %s", reranker.weights)
+    return reranker
+
+
+async def warm_up_openai() -> None:
+    """
+    OpenAIクライアントを作成し、トークン取得と接続確立を済ませる
+    """
+    if not AZURE_OPENAI_API_KEY:
+        await token_credential.prefetch("https://cognitiveservices.azure.com/.default")
+    client = await get_openai_client()
+    try:
+        # 軽量なAPIを1回呼び出してTLS接続をプールに確保する（応答の内容は使わない）
+        await client.models.list()
+    except Exception as e:
+        logging.info("OpenAI warmup request failed (connection is still pooled): %s", e)
+
+
+async def warm_up_search() -> None:
+    """
+    検索クライアント（またはローカルインデックス）を準備し、接続確立を済ませる
+    """
+    if LOCAL_SEARCH_INDEX_PATH:
+        await get_local_search_index()
+        return
+    client = await get_search_client()
+    # ドキュメント数の取得でトークン取得（Managed Identity時）とTLS接続を済ませる
+    await client.get_document_count()
+
+
+async def warm_up() -> dict:
+    """
+    コールドスタート対策の事前準備を実行
+    
+    クライアント生成・トークン取得・接続確立をOpenAIと検索で並行して行い、
+    最初のユーザーのリクエストがこれらを待たないようにします。
+    失敗してもリクエスト処理は通常通り行えるため、ログに記録するだけにします。
     
-    Args:
-        query: 検索クエリ
-        top_k: 取得する上位k件
-        
     Returns:
-        検索結果のリスト
+        段階ごとの所要時間（ミリ秒）またはエラー内容
     """
-    try:
-        # 検索クライアントを取得
-        client = await get_search_client()
-        
-        # 検索を実行（非同期）
-        results = client.search(
+    results = {}
+    
+    async def run(name: str, func) -> None:
+        start = time.perf_counter()
+        try:
+            await func()
+            results[name] = round((time.perf_counter() - start) * 1000, 1)
+        except Exception as e:
+            logging.warning("Warmup %s failed: %s", name, e)
+            results[name] = f"error: {e}"
+    
+    steps = []
+    if AZURE_OPENAI_ENDPOINT:
+        steps.append(run("openai", warm_up_openai))
+    if LOCAL_SEARCH_INDEX_PATH or AZURE_SEARCH_ENDPOINT:
+        steps.append(run("search", warm_up_search))
+    if SPECIES_LOOKUP_PATH:
+        steps.append(run("species_lookup", get_species_lookup))
+    if RERANK_ENABLED:
+        steps.append(run("reranker", get_reranker))
+    await asyncio.gather(*steps)
+    
+    # 共有のキューでは、このインスタンスが受け付けていないジョブも処理する
+    if JOB_QUEUE.lower() != "memory":
+        job_workers.start()
+    
+    logging.info("Warmup completed: %s", results)
+    return results
+
+
+def schedule_warm_up() -> asyncio.Task:
+    """
+    事前準備をバックグラウンドで1回だけ開始（実行中・完了済みであれば同じタスクを返す）
+    """
+    global warmup_task
+    if warmup_task is None:
+        warmup_task = asyncio.ensure_future(warm_up())
+    return warmup_task
+
+
+async def embed_query(query: str) -> list:
+    """
+    質問の埋め込みベクトルを取得（同じ質問はキャッシュから返す）
+    """
+    key = make_cache_key(query, AZURE_OPENAI_EMBEDDING_DEPLOYMENT, SEARCH_VECTOR_FIELD)
+    vector = embedding_cache.get(key)
+    if vector is not None:
+        return vector
+    
+    client = await get_openai_client()
+    with timed("embedding"):
+        response = await run_with_budget(
+            client.embeddings.create(model=AZURE_OPENAI_EMBEDDING_DEPLOYMENT, input=query),
+            current_deadline().budget(SEARCH_TIMEOUT_SECONDS),
+            "embedding"
+        )
+    vector = list(response.data[0].embedding)
+    embedding_cache.set(key, vector)
+    return vector
+
+
+def is_retryable_search_error(error: Exception) -> bool:
+    """
+    再送すれば成功する可能性のある検索の失敗か（接続エラー・429・5xx・1回分の持ち時間の超過）
+    """
+    if isinstance(error, (DeadlineExceeded, ServiceRequestError, ServiceResponseError)):
+        return True
+    return isinstance(error, HttpResponseError) and error.status_code in (429, 500, 502, 503, 504)
+
+
+async def call_search(factory):
+    """
+    検索を1回分の持ち時間（SEARCH_TIMEOUT_SECONDS とリクエストの期限の残りの小さいほう）の範囲で実行する
+    
+    - 直近の所要時間の分位点を超えても返らない場合は、同じ検索をもう1つ送り先に返ったほうを使う（ヘッジ）
+    - 一時的な失敗・持ち時間の超過は、期限内に収まる範囲でジッター付きの指数バックオフで再送する
+    検索は冪等なため、重複して送っても結果は変わらない。
+    
+    Args:
+        factory: 呼び出すたびに検索を実行する新しいコルーチンを返す関数
+    """
+    deadline = current_deadline()
+    
+    async def attempt():
+        call = search_hedger.call(factory) if SEARCH_HEDGE_ENABLED else factory()
+        return await run_with_budget(call, deadline.budget(SEARCH_TIMEOUT_SECONDS), "search")
+    
+    return await retry_with_jitter(
+        attempt,
+        max_retries=SEARCH_MAX_RETRIES,
+        base_delay=SEARCH_RETRY_BASE_DELAY_SECONDS,
+        is_retryable=is_retryable_search_error,
+        deadline=deadline,
+        on_retry=lambda: metrics.retries.inc(stage="search")
+    )
+
+
+async def run_search(client, query: str, top_k: int, search_filter: str = None, vector: list = None) -> list:
+    """
+    AI Searchで検索し、結果を {id, content, title, url, score} のリストで返す
+    
+    vector を指定した場合はキーワード検索とベクトル検索のハイブリッド検索になり、
+    score は AI Search が RRF で統合したスコアになります。
+    """
+    vector_queries = None
+    if vector is not None:
+        vector_queries = [VectorizedQuery(vector=vector, k_nearest_neighbors=top_k, fields=SEARCH_VECTOR_FIELD)]
+    
+    async def fetch():
+        results = await client.search(
             search_text=query,
             top=top_k,
-            select=["content", "title", "url"]
+            filter=search_filter,
+            vector_queries=vector_queries,
+            select=["id", "content", "title", "url"]
         )
         
-        # 検索結果を収集
         documents = []
         async for result in results:
             documents.append({
+                "id": result.get("id", ""),
                 "content": result.get("content", ""),
                 "title": result.get("title", ""),
                 "url": result.get("url", ""),
                 "score": result.get("@search.score", 0)
             })
+        return documents
+    
+    return await call_search(fetch)
+
+
+async def run_multi_search(client, query: str, top_k: int, search_filter: str = None,
+                           vector: list = None) -> list:
+    """
+    質問から作成した複数の検索クエリを並行して実行し、Reciprocal Rank Fusion で統合する
+    
+    SEARCH_MULTI_QUERY_DEADLINE_SECONDS までに返らないクエリは取り消し、返った結果だけで統合します。
+    期限までに成功した結果が1つもない場合は、最初に成功した結果を待ちます。
+    ベクトルは元の質問文のクエリにだけ付ける（言い換えのクエリは語の一致を補うためのもの）。
+    """
+    variants = build_query_variants(query)
+    if len(variants) == 1:
+        return await run_search(client, query, top_k, search_filter, vector)
+    
+    # 統合で順位が入れ替わるため、各クエリでは多めに取得する
+    tasks = [
+        asyncio.ensure_future(run_search(client, variant, top_k * 2, search_filter,
+                                         vector if i == 0 else None))
+        for i, variant in enumerate(variants)
+    ]
+    done, pending = await asyncio.wait(tasks, timeout=SEARCH_MULTI_QUERY_DEADLINE_SECONDS)
+    while pending and not any(task.exception() is None for task in done):
+        finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        done |= finished
+    for task in pending:
+        task.cancel()
+    metrics.search_variants.inc(len(pending), result="dropped")
+    
+    ranked_lists = []
+    error = None
+    for task in tasks:
+        if task not in done:
+            continue
+        if task.exception() is not None:
+            error = task.exception()
+            metrics.search_variants.inc(result="error")
+            continue
+        metrics.search_variants.inc(result="ok")
+        ranked_lists.append(task.result())
+    if not ranked_lists:
+        raise error
+    
+    return reciprocal_rank_fusion(ranked_lists, top_k)
+
+
+async def search_facets(client, analysis) -> dict:
+    """
+    条件に一致するドキュメント数と分類別・ランク別の件数を集計結果のドキュメントとして返す
+    """
+    async def fetch():
+        results = await client.search(
+            search_text="*",
+            filter=analysis.filter,
+            top=0,
+            include_total_count=True,
+            facets=[f"{field},count:{SEARCH_FACET_COUNT}" for field in ("category", "rank")]
+        )
+        return await results.get_count(), await results.get_facets() or {}
+    
+    total, facets = await call_search(fetch)
+    return {
+        "content": format_facets(analysis, total, facets),
+        "title": "検索結果の集計",
+        # 出典のURLはなく、スコアに関係なく先頭に置く
+        "url": "",
+        "score": math.inf
+    }
+
+
+async def rerank_documents(query: str, documents: list, top_k: int) -> list:
+    """
+    検索の候補を再ランキングして上位 top_k 件を返す（RERANK_ENABLED が無効な場合はそのまま返す）
+    
+    再ランキングに失敗した場合は、検索の順位のまま上位 top_k 件を返します。
+    """
+    if not RERANK_ENABLED or not documents:
+        return documents[:top_k]
+    try:
+        model = await get_reranker()
+        with timed("rerank"):
+            return model.rerank(query, documents, top_k)
+    except Exception as e:
+        # 検索の順位でも回答できるため、記録してフォールバックする
+        metrics.errors.inc(stage="rerank")
+        logging.error("Rerank error: %s", e)
+        return documents[:top_k]
+
+
+async def search_documents(query: str, top_k: int = SEARCH_TOP_K) -> list:
+    """
+    Azure AI Searchでドキュメントを検索（非同期版）
+    
+    LOCAL_SEARCH_INDEX_PATH が設定されている場合は、ローカルインデックスで検索します。
+    
+    SEARCH_HYBRID が有効な場合は、質問の埋め込みベクトルを加えてハイブリッド検索を行います。
+    SEARCH_MULTI_QUERY が有効な場合は、質問から作成した複数のクエリで並行して検索し、順位で統合します。
+    SEARCH_FILTER_ROUTING が有効な場合は、質問中の分類・ランクの語を filter に変換して
+    候補を絞り込みます（一致が0件の場合はフィルターなしで検索し直す）。
+    RERANK_ENABLED が有効な場合は、RERANK_CANDIDATES 件の候補を取得し、
+    再ランキングで選び直した上位 top_k 件を返します。
+    件数・内訳を尋ねる質問では、ファセットによる集計結果を先頭のドキュメントとして加えます。
+    
+    Args:
+        query: 検索クエリ
+        top_k: 取得する上位k件
+        
+    Returns:
+        検索結果のリスト
+        
+    Raises:
+        DeadlineExceeded: 再送を含めてリクエストの期限内に検索できなかった場合
+        （失敗を0件として扱うと、コンテキストなしで回答が生成されてしまうため送出する）
+    """
+    try:
+        vector = None
+        if SEARCH_HYBRID and not LOCAL_SEARCH_INDEX_PATH:
+            try:
+                vector = await embed_query(query)
+            except Exception as e:
+                # 埋め込みが使えない場合もキーワード検索で回答できるため、記録してフォールバックする
+                metrics.errors.inc(stage="embedding")
+                logging.error("Embedding error: %s", e)
         
-        logging.info(f"Found {len(documents)} documents for query: {query[:50]}...")
+        # 再ランキングする場合は候補を多めに取得する
+        fetch_k = max(top_k, RERANK_CANDIDATES) if RERANK_ENABLED else top_k
+        
+        with timed("search"):
+            # ローカルインデックスで検索（ネットワーク往復なし、フィルターは使用しない）
+            if LOCAL_SEARCH_INDEX_PATH:
+                index = await get_local_search_index()
+                documents = await rerank_documents(query, index.search(query, fetch_k), top_k)
+                logging.info("Found %d documents (local) for query: %.50s...", len(documents), query)
+                return documents
+            
+            # 検索クライアントを取得
+            client = await get_search_client()
+            
+            analysis = analyze_query(query) if SEARCH_FILTER_ROUTING else None
+            search_filter = analysis.filter if analysis else None
+            
+            search = run_multi_search if SEARCH_MULTI_QUERY else run_search
+            
+            # 検索と集計を並行して実行（非同期）
+            if analysis and analysis.aggregate:
+                documents, summary = await asyncio.gather(
+                    search(client, query, fetch_k, search_filter, vector),
+                    search_facets(client, analysis)
+                )
+            else:
+                documents = await search(client, query, fetch_k, search_filter, vector)
+                summary = None
+            
+            if search_filter:
+                if documents:
+                    metrics.search_filters.inc(result="applied")
+                else:
+                    # 条件の読み取り違いで候補がなくならないよう、フィルターなしで検索し直す
+                    metrics.search_filters.inc(result="fallback")
+                    logging.info("No documents matched filter (%s), searching without it", search_filter)
+                    documents = await search(client, query, fetch_k, vector=vector)
+            
+            documents = await rerank_documents(query, documents, top_k)
+            if summary is not None:
+                documents.insert(0, summary)
+        
+        logging.info("Found %d documents for query: %.50s...", len(documents), query)
         return documents
         
     except Exception as e:
-        logging.error(f"Search error: {e}")
+        metrics.errors.inc(stage="search")
+        logging.error("Search error: %s", e)
+        raise
+
+
+async def lookup_documents(query: str) -> list:
+    """
+    質問中の種名（和名・学名）のドキュメントを辞書から取得（SPECIES_LOOKUP_PATH 未設定・見つからない場合は空のリスト）
+    """
+    if not SPECIES_LOOKUP_PATH:
+        return []
+    try:
+        lookup = await get_species_lookup()
+        with timed("lookup"):
+            documents = lookup.find(query, max_documents=SEARCH_TOP_K)
+        if documents:
+            metrics.retrievals.inc(source="lookup")
+            logging.info("Found %d documents (species lookup) for query: %.50s...", len(documents), query)
+        return documents
+    except Exception as e:
+        # 辞書が使えない場合も検索で回答できるため、記録して検索にフォールバックする
+        metrics.errors.inc(stage="lookup")
+        logging.error("Species lookup error: %s", e)
         return []
 
 
-async def generate_response(user_message: str, context_documents: list) -> str:
+async def retrieve_documents(query: str, previous: str = "") -> list:
     """
-    RAGを使用してレスポンスを生成（非同期版）
+    質問に対するコンテキストのドキュメントを取得
+    
+    SPECIES_LOOKUP_PATH が設定されていて、質問中に種名（和名・学名）が見つかった場合は
+    検索を経由せずにそのドキュメントを返します。見つからない場合は search_documents で検索します。
+    
+    続きの質問では直前の質問（previous）が渡されます。種名の照合と分類・ランクの読み取りは
+    まず今回の質問だけで行い、どちらも見つからない場合（「その生息地は?」）に限って
+    直前の質問を加えて照合・検索します。「では鳥類は?」のように対象を変えた質問で、
+    前の質問の種が返らないようにするためです。
     
     Args:
-        user_message: ユーザーのメッセージ
-        context_documents: コンテキストとなるドキュメント
+        query: ユーザーの質問
+        previous: 続きの質問の場合、直前の質問
         
     Returns:
-        生成されたレスポンス
+        search_documents と同じ形式のドキュメントのリスト
     """
-    # コンテキストを構築
-    context = "\n\n".join([
-        f"【{doc['title']}】\n{doc['content']}\n出典: {doc['url']}"
-        for doc in context_documents
-    ])
+    documents = await lookup_documents(query)
+    if documents:
+        return documents
     
-    # プロンプト構築
-    system_message = """あなたは親切なアシスタントです。
+    if previous and not analyze_query(query).has_conditions:
+        query = f"{previous} {query}"
+        documents = await lookup_documents(query)
+        if documents:
+            return documents
+    
+    metrics.retrievals.inc(source="search")
+    return await search_documents(query)
+
+
+SYSTEM_MESSAGE = """あなたは親切なアシスタントです。
 提供されたコンテキスト情報を基に、ユーザーの質問に正確に答えてください。
 コンテキストに情報がない場合は、その旨を伝えてください。
 回答の際は、参照した情報の出典も明記してください。"""
+
+
+def build_messages(user_message: str, context_documents: list, history: list = None) -> list:
+    """
+    チャット補完に渡すメッセージ列を構築
+    
+    Args:
+        user_message: ユーザーのメッセージ
+        context_documents: コンテキストとなるドキュメント
+        history: 会話の履歴（要約と直近のターン。コンテキストは含めない）
+        
+    Returns:
+        system / (履歴) / user ロールのメッセージリスト
+    """
+    # コンテキストを構築（定型文の除去・出典の統合を行い、トークン数の上限まで詰める）
+    context = pack_context(context_documents, CONTEXT_MAX_TOKENS)
+    metrics.context_tokens.observe(context.tokens)
+    metrics.context_passages.inc(len(context.documents) - context.truncated, result="full")
+    metrics.context_passages.inc(context.truncated, result="truncated")
+    metrics.context_passages.inc(context.dropped, result="dropped")
     
     user_prompt = f"""コンテキスト:
-{context}
+{context.text}
 
 質問: {user_message}
 
 上記のコンテキストを参考に、質問に答えてください。"""
     
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        *(history or []),
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+async def create_chat_completion(client, messages: list, **kwargs):
+    """
+    流量制御を通してチャット補完APIを呼び出す
+    
+    - 送信前に推定トークン数（プロンプト + max_tokens）で RPM / TPM の許可を待つ
+    - 429の場合は Retry-After の間すべての送信を止めてから、許可を取り直して再送する
+    - 接続エラー・5xxはジッター付きの指数バックオフで再送する
+    
+    Raises:
+        OverloadedError: 待ち行列が満杯・待ち時間超過、または再送しても429が続く場合
+    """
+    tokens = estimate_tokens(messages, kwargs.get('max_tokens', 0))
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        with timed("admission"):
+            await openai_scheduler.acquire(tokens)
+        try:
+            return await client.chat.completions.create(
+                model=AZURE_OPENAI_DEPLOYMENT,
+                messages=messages,
+                **kwargs
+            )
+        except RateLimitError as e:
+            retry_after = parse_retry_after(e.response.headers)
+            openai_scheduler.penalize(retry_after)
+            logging.warning("Azure OpenAI rate limited (retry after %ss)", retry_after)
+            if attempt == OPENAI_MAX_RETRIES:
+                raise OverloadedError("Azure OpenAI rate limit exceeded",
+                                      status_code=429, retry_after=retry_after) from e
+        except (APIConnectionError, InternalServerError):
+            if attempt == OPENAI_MAX_RETRIES:
+                raise
+            await asyncio.sleep(0.5 * (2 ** attempt) * (0.5 + random.random()))
+
+
+async def create_completion(user_message: str, context_documents: list, history: list = None) -> str:
+    """
+    チャット補完を実行して回答テキストを返す（失敗時は例外を送出）
+    
+    Args:
+        user_message: ユーザーのメッセージ
+        context_documents: コンテキストとなるドキュメント
+        history: 会話の履歴
+        
+    Returns:
+        生成されたレスポンス
+    """
+    # OpenAIクライアントを取得
+    client = await get_openai_client()
+    
+    # チャット補完を生成（非同期、流量制御の待ち・再送を含めてリクエストの期限の残りまで）
     try:
-        # OpenAIクライアントを取得
-        client = await get_openai_client()
+        with timed("completion"):
+            response = await run_with_budget(
+                create_chat_completion(
+                    client,
+                    build_messages(user_message, context_documents, history),
+                    temperature=0.7,
+                    max_tokens=800
+                ),
+                current_deadline().budget(),
+                "completion"
+            )
+    except Exception:
+        metrics.errors.inc(stage="completion")
+        raise
+    
+    # トークン使用量を記録
+    if response.usage is not None:
+        metrics.openai_tokens.inc(response.usage.prompt_tokens, type="prompt")
+        metrics.openai_tokens.inc(response.usage.completion_tokens, type="completion")
+    
+    return response.choices[0].message.content
+
+
+async def create_completion_stream(user_message: str, context_documents: list, history: list = None):
+    """
+    チャット補完をストリーミングで実行し、差分テキストを順に返す（失敗時は例外を送出）
+    
+    Args:
+        user_message: ユーザーのメッセージ
+        context_documents: コンテキストとなるドキュメント
+        history: 会話の履歴
         
-        # チャット補完を生成（非同期）
-        response = await client.chat.completions.create(
-            model=AZURE_OPENAI_DEPLOYMENT,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=800
-        )
+    Yields:
+        生成されたテキストの差分（delta）
+    """
+    client = await get_openai_client()
+    
+    deadline = current_deadline()
+    try:
+        # stream=True で差分チャンクを逐次受信
+        # 期限は最初の差分までに適用する（受信が始まった後は利用者に進捗が見えるため打ち切らない）
+        with timed("completion_first_token"):
+            stream = await run_with_budget(
+                create_chat_completion(
+                    client,
+                    build_messages(user_message, context_documents, history),
+                    temperature=0.7,
+                    max_tokens=800,
+                    stream=True
+                ),
+                deadline.budget(),
+                "completion"
+            )
+            deltas = iterate_deltas(stream)
+            try:
+                first = await run_with_budget(anext(deltas, None), deadline.budget(), "completion")
+            except DeadlineExceeded:
+                await stream.close()
+                raise
         
-        return response.choices[0].message.content
+        if first is None:
+            return
+        yield first
+        async for delta in deltas:
+            yield delta
+    except Exception:
+        metrics.errors.inc(stage="completion")
+        raise
+
+
+async def iterate_deltas(stream):
+    """
+    ストリーミング応答のチャンクから差分テキストを順に返す
+    """
+    async for chunk in stream:
+        # Azure OpenAIは先頭にchoicesが空のチャンク（フィルタ結果）を返すことがある
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+# 混雑時（429 / 503）にユーザーへ返すメッセージ
+OVERLOADED_MESSAGE = "ただいま混み合っています。しばらく待ってから再度お試しください。"
+
+# 期限切れ（504）・検索や生成の失敗（503）時にユーザーへ返すメッセージ
+DEADLINE_MESSAGE = "回答の作成が時間内に完了しませんでした。しばらく待ってから再度お試しください。"
+UNAVAILABLE_MESSAGE = "検索または回答の生成に失敗しました。しばらく待ってから再度お試しください。"
+
+
+def record_failure(error: Exception) -> tuple:
+    """
+    検索・生成の失敗を記録し、ユーザーへ返すステータスコードとメッセージを返す（期限切れは504、それ以外は503）
+    """
+    if isinstance(error, DeadlineExceeded):
+        metrics.deadline_exceeded.inc(stage=error.stage)
+        return 504, DEADLINE_MESSAGE
+    return 503, UNAVAILABLE_MESSAGE
+
+
+async def generate_response(user_message: str, context_documents: list) -> str:
+    """
+    RAGを使用してレスポンスを生成（非同期版、失敗時は例外を送出）
+    
+    Args:
+        user_message: ユーザーのメッセージ
+        context_documents: コンテキストとなるドキュメント
         
+    Returns:
+        生成されたレスポンス
+    """
+    return await create_completion(user_message, context_documents)
+
+
+def build_sources(documents: list) -> list:
+    """
+    レスポンスに含める参照ソース一覧を構築
+    """
+    # 集計結果など、出典のURLがないものは含めない
+    return [
+        {'title': doc['title'], 'url': doc['url']}
+        for doc in documents
+        if doc.get('url')
+    ]
+
+
+def uses_history(session, user_message: str) -> bool:
+    """
+    会話の履歴を検索・生成に使うか
+    
+    履歴を使うのは続きの質問（「その生息地は?」のように対象を省略した質問）だけ。
+    種名などを含む自己完結した質問は、会話の途中でも履歴なしで回答し、
+    回答キャッシュ・同じ質問の合流の対象にする（回答が質問だけで決まるため）。
+    """
+    return session is not None and not session.is_empty and is_follow_up(user_message)
+
+
+def previous_question(user_message: str, session=None) -> str:
+    """
+    検索の補いに使う直前の質問（続きの質問でない場合は空文字）
+    
+    「その生息地は?」のように対象を省略した質問でも、前の質問の種・分類で
+    検索できるようにする（使い方は retrieve_documents を参照）。
+    """
+    previous = session.last_user_message() if uses_history(session, user_message) else ""
+    return previous[:200]
+
+
+async def load_session(conversation_id):
+    """
+    会話のセッションを取得（存在しない・期限切れの場合は新しいセッション）
+    """
+    try:
+        session = await session_store.get(conversation_id)
     except Exception as e:
-        logging.error(f"OpenAI error: {e}")
-        return f"申し訳ございません。エラーが発生しました: {str(e)}"
+        # 履歴が読めない場合も新しい会話として回答できるため、記録して続行する
+        metrics.errors.inc(stage="session")
+        logging.error("Session load error: %s", e)
+        session = None
+    return session if session is not None else session_store.create()
 
 
-@app.route(route="", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
-def index(req: func.HttpRequest) -> func.HttpResponse:
+async def record_turn(session, user_message: str, response: str) -> None:
     """
-    静的HTMLページを返す（ルートパス）
+    会話の1往復をセッションに追加して保存（履歴が上限を超えた場合は要約される）
     """
-    logging.info('Index page requested')
+    session.append("user", user_message)
+    session.append("assistant", response)
+    try:
+        await session_store.save(session)
+    except Exception as e:
+        metrics.errors.inc(stage="session")
+        logging.error("Session save error: %s", e)
+
+
+async def answer_question(user_message: str, session=None) -> tuple:
+    """
+    検索とレスポンス生成を実行し、チャットの結果を構築
     
+    Args:
+        user_message: ユーザーのメッセージ
+        session: 会話のセッション（指定時は回答後に履歴へ追加し、続きの質問では履歴をプロンプトに含める）
+        
+    Returns:
+        (結果dict, キャッシュ可能かどうか) のタプル
+        検索結果が0件の場合はキャッシュしない
+        履歴を含めて生成した回答も、質問だけでは決まらないためキャッシュしない
+        
+    Raises:
+        検索・生成に失敗した場合（期限切れは DeadlineExceeded、混雑時は OverloadedError）
+    """
+    history = session.messages() if uses_history(session, user_message) else None
+    
+    # ステップ1: ドキュメント検索（種名が分かる場合は直接参照、非同期）
+    documents = await retrieve_documents(user_message, previous_question(user_message, session))
+    
+    # ステップ2: レスポンス生成（非同期）
     try:
-        # index.htmlファイルを読み込み
-        html_path = os.path.join(os.path.dirname(__file__), 'static', 'index.html')
-        with open(html_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
+        response = await create_completion(user_message, documents, history)
+    except Exception as e:
+        logging.error("OpenAI error: %s", e)
+        raise
+    cacheable = bool(documents) and not history
+    if session is not None:
+        await record_turn(session, user_message, response)
+    
+    result = {
+        'response': response,
+        'sources': build_sources(documents)
+    }
+    return result, cacheable
+
+
+async def answer_and_cache(user_message: str, cache_key: str) -> dict:
+    """
+    検索とレスポンス生成を実行し、キャッシュできる結果は回答キャッシュに保存する（会話の履歴なし）
+    """
+    result, cacheable = await answer_question(user_message)
+    if cacheable:
+        answer_cache.set(cache_key, result)
+    return result
+
+
+def build_json_response(content, timings: metrics.RequestTimings, status_code: int = 200,
+                        headers: dict = None) -> Response:
+    """
+    JSONレスポンスを作成（シリアライズ時間を計測し、有効時はServer-Timingヘッダーを付与）
+    """
+    with timed("serialize"):
+        response = JSONResponse(content, status_code=status_code, headers=headers)
+    if SERVER_TIMING_ENABLED:
+        response.headers['Server-Timing'] = timings.server_timing()
+    return response
+
+
+def is_cache_bypass(req: Request) -> bool:
+    """
+    リクエスト単位でキャッシュを迂回するか判定
+    
+    Cache-Control: no-cache またはX-Cache-Bypass: 1 が指定された場合は
+    キャッシュを参照せずに回答を生成し直す（生成結果でキャッシュは更新する）
+    """
+    cache_control = req.headers.get('cache-control', '').lower()
+    return 'no-cache' in cache_control or req.headers.get('x-cache-bypass', '') == '1'
+
+
+def format_sse(event: str, data) -> str:
+    """
+    Server-Sent Events形式の1イベントを組み立てる
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_cached_answer(user_message: str, answer: dict, cache_status: str, session=None):
+    """
+    キャッシュ済みの回答を sources / delta（回答全体）/ done のSSEイベント列として返す
+    """
+    yield format_sse('sources', answer['sources'])
+    yield format_sse('delta', {'content': answer['response']})
+    if session is not None:
+        await record_turn(session, user_message, answer['response'])
+    done = {'conversation_id': session.id} if session is not None else {}
+    yield format_sse('done', {'cache': cache_status, **done})
+
+
+async def stream_chat_events(user_message: str, cache_key: str = None, use_cache: bool = True,
+                             cached: dict = None, session=None, deadline=None):
+    """
+    チャット応答をSSEイベント列として生成
+    
+    イベント順序:
+    1. sources: 検索直後に参照ソースを送信
+    2. delta: 回答テキストの差分（複数回）
+    3. done: 完了通知（途中で失敗した場合は error）
+    
+    キャッシュにヒットした回答（cached）が渡された場合は検索・生成を行わず、回答全体を1つのdeltaで返す
+    会話のセッション（session）が渡された場合は、done に conversation_id を含める
+    検索・生成が最初の差分より前に失敗した場合は、期限切れのキャッシュ済み回答があればそれを返し
+    （done の cache は STALE）、なければ error イベントでステータス（504 / 503）を通知する
+    """
+    # 応答の生成はハンドラーから戻った後に行われるため、リクエストの期限をここで有効にする
+    if deadline is not None:
+        deadline.activate()
+    done = {'conversation_id': session.id} if session is not None else {}
+    try:
+        if cached is not None:
+            async for event in stream_cached_answer(user_message, cached, 'HIT', session):
+                yield event
+            return
         
-        return func.HttpResponse(
-            html_content,
-            mimetype="text/html",
-            status_code=200
-        )
-    except FileNotFoundError:
-        logging.error('index.html not found')
-        return func.HttpResponse(
-            "Page not found",
-            status_code=404
-        )
+        history = session.messages() if uses_history(session, user_message) else None
+        deltas = []
+        try:
+            documents = await retrieve_documents(user_message, previous_question(user_message, session))
+            sources = build_sources(documents)
+            yield format_sse('sources', sources)
+            
+            async for delta in create_completion_stream(user_message, documents, history):
+                deltas.append(delta)
+                yield format_sse('delta', {'content': delta})
+        except OverloadedError as e:
+            logging.warning("OpenAI stream rejected: %s", e)
+            yield format_sse('error', {
+                'error': OVERLOADED_MESSAGE,
+                'status': e.status_code,
+                'retry_after': e.retry_after
+            })
+            return
+        except Exception as e:
+            logging.error("OpenAI stream error: %s", e)
+            status_code, message = record_failure(e)
+            # 回答の途中まで送信した後は、古い回答に差し替えられない
+            stale = answer_cache.get_stale(cache_key) if cache_key and not deltas else None
+            if stale is None:
+                yield format_sse('error', {'error': message, 'status': status_code})
+                return
+            logging.warning('Chat stream served from stale cache')
+            async for event in stream_cached_answer(user_message, stale, 'STALE', session):
+                yield event
+            return
+        
+        if cache_key and documents and not history:
+            answer_cache.set(cache_key, {'response': ''.join(deltas), 'sources': sources})
+        if session is not None:
+            await record_turn(session, user_message, ''.join(deltas))
+        
+        yield format_sse('done', {'cache': 'MISS' if use_cache else 'BYPASS', **done})
+        logging.info('Chat stream completed successfully')
+    
+    except Exception as e:
+        # ヘッダー送信後のためステータスコードは変更できない。errorイベントで通知する
+        logging.error("Chat stream error: %s", e)
+        yield format_sse('error', {'error': str(e)})
 
 
-@app.route(route="api/chat", methods=["POST"], auth_level=func.AuthLevel.ANONYMOUS)
-async def chat(req: func.HttpRequest) -> func.HttpResponse:
+def build_static_response(req: Request, path: str) -> Response:
     """
-    チャットAPIエンドポイント（非同期版）
+    static/ 以下のファイルを返す（ETag が一致する場合は304、Accept-Encoding に応じて圧縮済みの表現）
+    """
+    asset = static_files.get(path)
+    if asset is None:
+        metrics.static_responses.inc(status="404", encoding="identity")
+        return PlainTextResponse("Page not found", status_code=404)
     
-    ユーザーのメッセージを受け取り、RAG（検索拡張生成）を使用して回答を生成します。
-    処理フロー:
-    1. ユーザーメッセージの検証
-    2. AI Searchでドキュメント検索（非同期）
-    3. OpenAIでレスポンス生成（非同期）
-    4. 結果を返却
+    encoding = negotiate_encoding(req.headers.get('accept-encoding'), asset.encodings)
+    body, etag = asset.representations[encoding]
+    if asset.content_type.startswith('text/html'):
+        cache_control = 'no-cache'
+    else:
+        cache_control = f'public, max-age={STATIC_MAX_AGE_SECONDS}'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': asset.last_modified,
+        'Cache-Control': cache_control,
+        'Vary': 'Accept-Encoding'
+    }
+    
+    if_none_match = req.headers.get('if-none-match')
+    if asset.is_not_modified(if_none_match) or (
+            not if_none_match and req.headers.get('if-modified-since') == asset.last_modified):
+        metrics.static_responses.inc(status="304", encoding=encoding)
+        return Response(status_code=304, headers=headers)
+    
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    metrics.static_responses.inc(status="200", encoding=encoding)
+    return Response(body, media_type=asset.content_type, headers=headers)
+
+
+@app.route(route="", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+def index(req: Request) -> Response:
+    """
+    静的HTMLページを返す（ルートパス）
+    """
+    logging.info('Index page requested')
+    return build_static_response(req, 'index.html')
+
+
+@app.route(route="static/{*path}", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+def static_file(req: Request) -> Response:
+    """
+    static/ 以下のファイルを返す（CSS・JavaScript・画像などをページから参照する場合）
+    """
+    return build_static_response(req, req.path_params.get('path', ''))
+
+
+async def process_chat(req: Request, timings: metrics.RequestTimings) -> Response:
     """
-    logging.info('Chat API invoked')
+    /api/chat の処理本体（リクエストの計測・ログの開始は chat で行う）
+    """
+    deadline = start_deadline(CHAT_DEADLINE_SECONDS)
     
     try:
         # リクエストボディを解析
-        req_body = req.get_json()
+        req_body = await req.json()
         user_message = req_body.get('message', '')
         
         # メッセージの検証
         if not user_message:
-            return func.HttpResponse(
-                json.dumps({'error': 'メッセージが空です'}, ensure_ascii=False),
-                mimetype="application/json",
+            return build_json_response(
+                {'error': 'メッセージが空です'},
+                timings,
                 status_code=400
             )
         
-        logging.info(f"Processing message: {user_message[:50]}...")
+        logging.info("Processing message: %.50s...", user_message)
+        
+        session = await load_session(req_body['conversation_id']) if 'conversation_id' in req_body else None
         
-        # ステップ1: ドキュメント検索（非同期）
-        documents = await search_documents(user_message)
+        # 続きの質問の回答は履歴によって変わり、質問だけでは決まらないため、キャッシュ・合流の対象にしない
+        follow_up = uses_history(session, user_message)
+        use_cache = not is_cache_bypass(req) and not follow_up
+        cache_key = make_cache_key(
+            user_message,
+            AZURE_OPENAI_DEPLOYMENT,
+            LOCAL_SEARCH_INDEX_PATH or AZURE_SEARCH_INDEX
+        ) if not follow_up else None
+        cached = answer_cache.get(cache_key) if use_cache else None
         
-        # ステップ2: レスポンス生成（非同期）
-        response = await generate_response(user_message, documents)
+        # 生成の待ち行列が満杯であれば、検索も行わずにすぐに429を返す（キャッシュ済みの回答は返す）
+        if cached is None:
+            openai_scheduler.check_capacity()
         
-        # 結果を構築
-        result = {
-            'response': response,
-            'sources': [
-                {'title': doc['title'], 'url': doc['url']}
-                for doc in documents
-            ]
-        }
+        # ストリーミングモード（SSE）
+        stream = req_body.get('stream') is True or \
+            'text/event-stream' in req.headers.get('accept', '')
+        if stream:
+            return StreamingResponse(
+                stream_chat_events(user_message, cache_key, use_cache, cached, session, deadline),
+                media_type="text/event-stream",
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'
+                }
+            )
+        
+        # キャッシュにヒットした場合は検索・生成を行わずに返却
+        if cached is not None:
+            logging.info('Chat response served from cache')
+            if session is not None:
+                await record_turn(session, user_message, cached['response'])
+                cached = dict(cached, conversation_id=session.id)
+            return build_json_response(
+                cached,
+                timings,
+                status_code=200,
+                headers={'X-Cache': 'HIT'}
+            )
         
-        logging.info('Chat response generated successfully')
+        # 検索とレスポンス生成（非同期）
+        # 同じ質問が実行中であれば新たに実行せず、その結果を待ち合わせる
+        try:
+            if not follow_up:
+                result = await inflight_requests.do(cache_key, lambda: answer_and_cache(user_message, cache_key))
+                if session is not None:
+                    await record_turn(session, user_message, result['response'])
+                    result = dict(result, conversation_id=session.id)
+            else:
+                # 会話ごとに履歴が異なるため、同じ質問でも合流しない
+                result, _ = await answer_question(user_message, session)
+                result = dict(result, conversation_id=session.id)
+        except OverloadedError:
+            raise
+        except Exception as e:
+            logging.error("Chat answer failed: %s", e)
+            status_code, message = record_failure(e)
+            stale = answer_cache.get_stale(cache_key) if cache_key else None
+            if stale is None:
+                return build_json_response({'error': message}, timings, status_code=status_code)
+            
+            # 障害時は期限切れでも同じ質問の回答を返す（回答がないよりも有用なため）
+            logging.warning('Chat response served from stale cache')
+            if session is not None:
+                await record_turn(session, user_message, stale['response'])
+                stale = dict(stale, conversation_id=session.id)
+            return build_json_response(stale, timings, status_code=200, headers={'X-Cache': 'STALE'})
         
-        return func.HttpResponse(
-            json.dumps(result, ensure_ascii=False),
-            mimetype="application/json",
-            status_code=200
+        return build_json_response(
+            result,
+            timings,
+            status_code=200,
+            headers={'X-Cache': 'MISS' if use_cache else 'BYPASS'}
         )
     
+    except OverloadedError as e:
+        metrics.errors.inc(stage="admission")
+        logging.warning("Chat rejected: %s", e)
+        return build_json_response(
+            {'error': OVERLOADED_MESSAGE, 'retry_after': e.retry_after},
+            timings,
+            status_code=e.status_code,
+            headers={'Retry-After': str(math.ceil(e.retry_after))}
+        )
     except ValueError as ve:
-        logging.error(f"Invalid JSON: {ve}")
-        return func.HttpResponse(
-            json.dumps({'error': 'Invalid JSON format'}, ensure_ascii=False),
-            mimetype="application/json",
+        metrics.errors.inc(stage="request")
+        logging.error("Invalid JSON: %s", ve)
+        return build_json_response(
+            {'error': 'Invalid JSON format'},
+            timings,
             status_code=400
         )
     except Exception as e:
-        logging.error(f"Chat error: {e}")
-        return func.HttpResponse(
-            json.dumps({'error': str(e)}, ensure_ascii=False),
-            mimetype="application/json",
+        metrics.errors.inc(stage="chat")
+        logging.error("Chat error: %s", e)
+        return build_json_response(
+            {'error': str(e)},
+            timings,
             status_code=500
         )
 
 
+@app.route(route="api/chat", methods=["POST"], auth_level=func.AuthLevel.ANONYMOUS)
+async def chat(req: Request) -> Response:
+    """
+    チャットAPIエンドポイント（非同期版）
+    
+    ユーザーのメッセージを受け取り、RAG（検索拡張生成）を使用して回答を生成します。
+    処理フロー:
+    1. ユーザーメッセージの検証
+    2. AI Searchでドキュメント検索（非同期）
+    3. OpenAIでレスポンス生成（非同期）
+    4. 結果を返却
+    
+    リクエストボディに "stream": true を指定するか、Acceptヘッダーに
+    text/event-stream を指定した場合はServer-Sent Eventsで逐次返却します。
+    それ以外は従来通り1つのJSONレスポンスを返します。
+    
+    リクエストボディに "conversation_id" を含めた場合は会話として扱い、サーバー側の履歴を
+    プロンプトに含めます（null・不明・期限切れのIDの場合は新しい会話を開始）。
+    レスポンスの conversation_id を次のリクエストに指定すると会話が続きます。
+    
+    検索・生成は CHAT_DEADLINE_SECONDS の期限内で行います。失敗した場合は、同じ質問の
+    期限切れのキャッシュ済み回答があればそれを返し（X-Cache: STALE）、なければ504（期限切れ）/
+    503を返します。
+
+    リクエストごとに1件、ステータス・キャッシュ・段階別の所要時間を含むログを出力します
+    （ストリーミングの場合は応答の開始まで）。X-Request-Id ヘッダーを指定した場合は
+    そのIDでログを出力し、レスポンスにも同じIDを返します。
+    """
+    timings = metrics.start_request()
+    request_log = start_request_log(req.headers.get('x-request-id'), LOG_SAMPLE_RATE)
+    response = None
+    try:
+        response = await process_chat(req, timings)
+        response.headers['X-Request-Id'] = request_log.request_id
+        return response
+    finally:
+        elapsed = timings.elapsed()
+        metrics.stage_latency.observe(elapsed, stage="total")
+        # メッセージの展開・JSONへの変換は書き込み側のスレッドで行われる
+        logging.info("Chat request completed in %.1fms", elapsed * 1000, extra={'fields': {
+            'status': response.status_code if response is not None else 500,
+            'cache': response.headers.get('x-cache') if response is not None else None,
+            'stream': isinstance(response, StreamingResponse),
+            'duration_ms': round(elapsed * 1000, 1),
+            'stages_ms': {stage: round(seconds * 1000, 1) for stage, seconds in timings.stages.items()},
+        }})
+
+
+async def run_chat_job(job) -> dict:
+    """
+    ジョブ1件の検索とレスポンス生成（ジョブのワーカーから呼び出す）
+    
+    /api/chat と同じく、回答キャッシュ・同じ質問の合流・期限（CHAT_DEADLINE_SECONDS）を使います。
+    失敗した場合は期限切れのキャッシュ済み回答を返し、それもなければ JobError を送出します。
+    """
+    timings = metrics.start_request()
+    start_request_log(job.id, LOG_SAMPLE_RATE)
+    start_deadline(CHAT_DEADLINE_SECONDS)
+    metrics.stage_latency.observe(job.queued_seconds, stage="job_queue")
+    
+    cache_key = make_cache_key(
+        job.message,
+        AZURE_OPENAI_DEPLOYMENT,
+        LOCAL_SEARCH_INDEX_PATH or AZURE_SEARCH_INDEX
+    )
+    cache_status = 'HIT'
+    try:
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        cache_status = 'MISS'
+        try:
+            return await inflight_requests.do(cache_key, lambda: answer_and_cache(job.message, cache_key))
+        except Exception as e:
+            logging.error("Chat job answer failed: %s", e)
+            status_code, message = record_failure(e)
+            stale = answer_cache.get_stale(cache_key)
+            if stale is None:
+                cache_status = None
+                raise JobError(message, status_code) from e
+            cache_status = 'STALE'
+            logging.warning('Chat job answered from stale cache')
+            return stale
+    finally:
+        elapsed = timings.elapsed()
+        metrics.stage_latency.observe(elapsed, stage="job")
+        logging.info("Chat job completed in %.1fms", elapsed * 1000, extra={'fields': {
+            'job_id': job.id,
+            'cache': cache_status,
+            'attempts': job.attempts,
+            'queued_ms': round(job.queued_seconds * 1000, 1),
+            'duration_ms': round(elapsed * 1000, 1),
+            'stages_ms': {stage: round(seconds * 1000, 1) for stage, seconds in timings.stages.items()},
+        }})
+
+
+def is_allowed_callback_url(url) -> bool:
+    """
+    callback_url が JOB_CALLBACK_ALLOWED_HOSTS のホストへの http(s) のURLか
+    """
+    if not isinstance(url, str) or not JOB_CALLBACK_ALLOWED_HOSTS:
+        return False
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    return parts.scheme in ('http', 'https') and (parts.hostname or '').lower() in JOB_CALLBACK_ALLOWED_HOSTS
+
+
+def is_retryable_callback_error(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+async def send_job_callback(job) -> None:
+    """
+    終了したジョブの結果を callback_url に POST する（一時的な失敗は再送）
+    """
+    global callback_client
+    if callback_client is None:
+        callback_client = httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT_SECONDS)
+    body = json.dumps(job.to_response(), ensure_ascii=False).encode('utf-8')
+    headers = {'Content-Type': 'application/json; charset=utf-8'}
+    if JOB_CALLBACK_SECRET:
+        signature = hmac.new(JOB_CALLBACK_SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        headers['X-Job-Signature'] = f'sha256={signature}'
+    
+    async def post():
+        response = await callback_client.post(job.callback_url, content=body, headers=headers)
+        response.raise_for_status()
+    
+    try:
+        await retry_with_jitter(
+            post,
+            max_retries=JOB_CALLBACK_MAX_RETRIES,
+            base_delay=1.0,
+            is_retryable=is_retryable_callback_error
+        )
+        metrics.job_callbacks.inc(result="ok")
+    except Exception:
+        metrics.job_callbacks.inc(result="error")
+        raise
+
+
+# チャットのジョブ（状態・キュー・ワーカーはワーカープロセス内で共有）
+job_store = JobStore(
+    create_backend(JOB_STORE, JOB_STORE_PATH, name="jobs"),
+    max_entries=JOB_MAX_ENTRIES,
+    ttl_seconds=JOB_TTL_SECONDS
+)
+job_workers = JobWorkerPool(
+    create_job_queue(
+        JOB_QUEUE,
+        max_size=JOB_QUEUE_MAX_SIZE,
+        queue_name=JOB_QUEUE_NAME,
+        connection_string=JOB_QUEUE_CONNECTION_STRING,
+        account_url=JOB_QUEUE_ACCOUNT_URL,
+        credential=token_credential,
+        visibility_timeout=JOB_VISIBILITY_TIMEOUT_SECONDS
+    ),
+    job_store,
+    handler=run_chat_job,
+    workers=JOB_WORKERS,
+    notify=send_job_callback,
+    max_attempts=JOB_MAX_ATTEMPTS
+)
+metrics.registry.callback("rag_jobs_running", "Chat jobs being processed by workers.",
+                          lambda: job_workers.running)
+metrics.registry.callback("rag_jobs_accepted_total", "Chat jobs accepted into the queue.",
+                          lambda: job_workers.accepted, "counter")
+metrics.registry.callback("rag_jobs_rejected_total", "Chat jobs rejected because the queue was full.",
+                          lambda: job_workers.rejected, "counter")
+metrics.registry.callback("rag_jobs_succeeded_total", "Chat jobs that finished with an answer.",
+                          lambda: job_workers.succeeded, "counter")
+metrics.registry.callback("rag_jobs_failed_total", "Chat jobs that finished with an error.",
+                          lambda: job_workers.failed, "counter")
+
+
+def build_job_response(job, timings: metrics.RequestTimings, status_code: int = 200) -> Response:
+    """
+    ジョブの状態のレスポンス（終了していない場合は Retry-After で参照の間隔を示す）
+    """
+    headers = {'Location': f'/api/chat/jobs/{job.id}'}
+    if not job.finished:
+        headers['Retry-After'] = '1'
+    return build_json_response(job.to_response(), timings, status_code=status_code, headers=headers)
+
+
+@app.route(route="api/chat/jobs", methods=["POST"], auth_level=func.AuthLevel.ANONYMOUS)
+async def create_chat_job(req: Request) -> Response:
+    """
+    チャットのジョブを受け付けるエンドポイント
+    
+    リクエストボディは {"message": "...", "callback_url": "..."}（callback_url は省略可）。
+    検索と生成を待たずに 202 とジョブIDを返します。結果は Location の
+    GET /api/chat/jobs/{job_id} で参照するか、callback_url への POST で受け取ります
+    （callback_url のホストは JOB_CALLBACK_ALLOWED_HOSTS に含まれている必要があります）。
+    キューが満杯の場合は 429 を返します。会話（conversation_id）とストリーミングには対応しません。
+    """
+    timings = metrics.start_request()
+    try:
+        req_body = await req.json()
+        user_message = req_body.get('message', '')
+        callback_url = req_body.get('callback_url')
+    except ValueError as ve:
+        metrics.errors.inc(stage="request")
+        logging.error("Invalid JSON: %s", ve)
+        return build_json_response({'error': 'Invalid JSON format'}, timings, status_code=400)
+    
+    if not user_message:
+        return build_json_response({'error': 'メッセージが空です'}, timings, status_code=400)
+    if callback_url is not None and not is_allowed_callback_url(callback_url):
+        return build_json_response({'error': 'callback_url は許可されていません'}, timings, status_code=400)
+    
+    try:
+        job = await job_workers.submit(user_message, callback_url)
+    except JobQueueFull as e:
+        logging.warning("Chat job rejected: %s", e)
+        return build_json_response(
+            {'error': OVERLOADED_MESSAGE, 'retry_after': e.retry_after},
+            timings,
+            status_code=429,
+            headers={'Retry-After': str(math.ceil(e.retry_after))}
+        )
+    except Exception as e:
+        metrics.errors.inc(stage="job")
+        logging.error("Chat job submit error: %s", e)
+        return build_json_response({'error': UNAVAILABLE_MESSAGE}, timings, status_code=503)
+    
+    logging.info("Chat job accepted: %s", job.id)
+    return build_job_response(job, timings, status_code=202)
+
+
+@app.route(route="api/chat/jobs/{job_id}", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def get_chat_job(req: Request) -> Response:
+    """
+    チャットのジョブの状態と結果を返すエンドポイント
+    
+    status は queued / running / succeeded（result に /api/chat と同じ回答）/
+    failed（error と status_code）。存在しない・期限切れ（JOB_TTL_SECONDS）のジョブは 404 を返します。
+    """
+    timings = metrics.start_request()
+    # 共有のキューでは、受け付けたインスタンス以外のワーカーも処理する
+    if JOB_QUEUE.lower() != "memory":
+        job_workers.start()
+    try:
+        job = await job_store.get(req.path_params.get('job_id', ''))
+    except Exception as e:
+        metrics.errors.inc(stage="job")
+        logging.error("Chat job load error: %s", e)
+        return build_json_response({'error': UNAVAILABLE_MESSAGE}, timings, status_code=503)
+    if job is None:
+        return build_json_response({'error': 'ジョブが見つかりません'}, timings, status_code=404)
+    return build_job_response(job, timings)
+
+
+@app.warm_up_trigger('warmup')
+async def warmup(warmup) -> None:
+    """
+    ウォームアップトリガー（Premiumプランのスケールアウト時、インスタンスの追加前に実行）
+    """
+    await schedule_warm_up()
+
+
 @app.route(route="health", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
-def health(req: func.HttpRequest) -> func.HttpResponse:
+async def health(req: Request) -> Response:
     """
     ヘルスチェックエンドポイント
+    
+    ウォームアップトリガーのないプラン向けに、初回呼び出し時に事前準備をバックグラウンドで開始する
+    （App Serviceの正常性チェックのパスに /health を指定すると起動直後に実行される）
     """
     logging.info('Health check invoked')
     
-    return func.HttpResponse(
-        json.dumps({'status': 'healthy'}, ensure_ascii=False),
-        mimetype="application/json",
+    task = schedule_warm_up()
+    
+    return JSONResponse(
+        {
+            'status': 'healthy',
+            'warmup': task.result() if task.done() and not task.cancelled() else 'running',
+            'cache': answer_cache.stats(),
+            'singleflight': inflight_requests.stats(),
+            'token': token_credential.stats(),
+            'http': http_pool_stats(),
+            'admission': openai_scheduler.stats(),
+            'search_hedge': search_hedger.stats(),
+            'sessions': session_store.stats(),
+            'jobs': job_workers.stats(),
+            'logging': log_pipeline.stats() if log_pipeline else None
+        },
+        status_code=200
+    )
+
+
+@app.route(route="api/metrics", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+def metrics_endpoint(req: Request) -> Response:
+    """
+    メトリクスエンドポイント（Prometheusテキスト形式）
+    
+    段階別レイテンシのヒストグラム、トークン使用量、エラー数、キャッシュ統計を返します。
+    """
+    return PlainTextResponse(
+        metrics.registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
         status_code=200
     )
@@ -0,0 +1,5 @@
+"""
+RAGチャットアプリケーションの共通モジュール
+
+function_app.py から利用するキャッシュ・検索などの部品をまとめたパッケージ
+"""
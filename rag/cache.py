@@ -0,0 +1,142 @@
+"""
+インプロセス回答キャッシュ
+
+正規化したメッセージをキーに、チャットの回答（response / sources）を保持します。
+TTLによる期限切れと、エントリ数・バイトサイズ上限によるLRU追い出しを行います。
+
+stale_seconds を指定すると、期限切れのエントリをさらにその秒数だけ保持します。
+get() では返しませんが、検索やモデルの呼び出しが失敗した場合に get_stale() で
+古い回答として返すことができます。
+"""
+import json
+import time
+from collections import OrderedDict
+
+from .normalize import normalize_query
+
+# キーの各要素を区切る文字（通常の入力には現れないUnit Separator）
+_KEY_SEPARATOR = "\x1f"
+
+
+def make_cache_key(message: str, deployment: str, index_name: str) -> str:
+    """
+    キャッシュキーを生成
+
+    デプロイメント名・インデックス名を含めることで、
+    モデルや検索対象を切り替えた際に古い回答が返らないようにします。
+    """
+    return _KEY_SEPARATOR.join([deployment or "", index_name or "", normalize_query(message)])
+
+
+class AnswerCache:
+    """
+    TTL + LRU の回答キャッシュ
+
+    asyncioの単一イベントループ上で使用する前提のため、ロックは持ちません。
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024,
+                 ttl_seconds: float = 3600.0, stale_seconds: float = 0.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = max(0.0, stale_seconds)
+        # key -> (value, size_bytes, expires_at)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0 and self.ttl_seconds > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str):
+        """
+        キャッシュから値を取得（見つからない・期限切れの場合はNone）
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, size, expires_at = entry
+        now = time.monotonic()
+        if expires_at <= now:
+            # 古い回答として返せる間は保持する
+            if expires_at + self.stale_seconds <= now:
+                self._remove(key)
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+        # 最近使用したエントリを末尾へ移動
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: str):
+        """
+        期限切れ後 stale_seconds 以内のエントリも含めて値を取得（障害時のフォールバック用）
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, _, expires_at = entry
+        if expires_at + self.stale_seconds <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self.stale_hits += 1
+        return value
+
+    def set(self, key: str, value) -> None:
+        """
+        値をキャッシュに保存し、上限を超えた分を古い順に追い出す
+        """
+        if not self.enabled:
+            return
+
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (value, size, time.monotonic() + self.ttl_seconds)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        ヒット/ミス数などの統計情報を返す
+        """
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_hits": self.stale_hits,
+        }
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
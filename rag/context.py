@@ -0,0 +1,146 @@
+"""
+プロンプトに含めるコンテキストの組み立て（トークン予算内に収める）
+
+検索結果をそのまま連結すると、件数（top_k）に比例してプロンプトが長くなり、
+生成の待ち時間と料金が増えます。ここでは次の順でコンテキストを組み立てます。
+
+1. 全文書に共通する定型文（レッドリストの分類に関する一文など）を除去する
+2. 内容が同じ文書を除外し、スコアの高い順に予算（トークン数）まで詰める
+3. 予算を超える文書は文の境界で切り詰める
+4. 出典は同じURLをまとめて番号を振り、末尾に1回だけ記載する
+
+トークン数は文字種から概算します（tiktoken などの語彙ファイルを実行時に取得できない
+閉域環境でも動作するように、外部ファイルを使用しない）。
+"""
+import re
+
+# 本文から除去する定型文（他の項目と重複する情報のみ）
+# 「この種は環境省のレッドリスト(第4次)において○○に分類されています。」は「絶滅危惧ランク:」と同じ内容
+BOILERPLATE_PATTERNS = (
+    re.compile(r"この種は環境省のレッドリスト\(第\d+次\)において[^。\n]*に分類されています。"),
+)
+
+# 文の区切り（句点・感嘆符・疑問符・改行の直後）
+_SENTENCE_RE = re.compile(r"[^。！？!?\n]*(?:[。！？!?]+|\n|$)")
+
+# 連続する空行
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+# 出典一覧の見出し
+CITATIONS_HEADER = "\n\n出典:\n"
+
+# 切り詰めた本文がこのトークン数未満になる場合は、その文書を含めない
+MIN_PASSAGE_TOKENS = 20
+
+
+def count_tokens(text: str) -> int:
+    """
+    テキストのトークン数を概算
+
+    日本語は1文字≒1トークン、ASCIIは4文字≒1トークンとして多めに見積もる。
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def strip_boilerplate(text: str) -> str:
+    """
+    定型文を除去し、前後の空白と連続する空行を整理する
+    """
+    for pattern in BOILERPLATE_PATTERNS:
+        text = pattern.sub("", text)
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def truncate_sentences(text: str, max_tokens: int) -> str:
+    """
+    max_tokens に収まる範囲で、文の境界までのテキストを返す（1文も収まらない場合は空文字列）
+    """
+    result = []
+    used = 0
+    for sentence in _SENTENCE_RE.findall(text):
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence)
+        if used + tokens > max_tokens:
+            break
+        result.append(sentence)
+        used += tokens
+    return "".join(result).strip()
+
+
+class PackedContext:
+    """
+    組み立てたコンテキストと、その内訳
+    """
+
+    def __init__(self, text: str, documents: list, tokens: int, truncated: int, dropped: int):
+        self.text = text
+        # コンテキストに含めた文書（スコア順）
+        self.documents = documents
+        self.tokens = tokens
+        self.truncated = truncated
+        self.dropped = dropped
+
+
+def pack_context(documents: list, max_tokens: int) -> PackedContext:
+    """
+    検索結果をトークン予算内のコンテキスト文字列にまとめる
+
+    Args:
+        documents: 検索結果（title / content / url / score）
+        max_tokens: コンテキストに使用するトークン数の上限（0以下の場合は制限しない）
+
+    Returns:
+        PackedContext
+    """
+    # スコアの高い順（スコアがない場合は検索結果の順序のまま）
+    ranked = sorted(documents, key=lambda doc: -(doc.get("score") or 0))
+
+    passages = []
+    used_documents = []
+    citations = {}
+    seen_contents = set()
+    used = 0
+    truncated = 0
+    dropped = 0
+
+    for doc in ranked:
+        content = strip_boilerplate(doc.get("content") or "")
+        if content in seen_contents:
+            dropped += 1
+            continue
+        seen_contents.add(content)
+
+        # 出典のURLがないもの（検索結果の集計など）は番号を振らない
+        url = doc.get("url") or ""
+        number = citations.get(url)
+        citation_tokens = 0
+        if url and number is None:
+            number = len(citations) + 1
+            citation_tokens = count_tokens(f"[{number}] {url}\n")
+            if not citations:
+                citation_tokens += count_tokens(CITATIONS_HEADER)
+        header = f"【{doc.get('title', '')}】[{number}]\n" if url else f"【{doc.get('title', '')}】\n"
+        overhead = count_tokens(header) + citation_tokens + 1
+
+        content_tokens = count_tokens(content)
+        if max_tokens > 0 and used + overhead + content_tokens > max_tokens:
+            remaining = max_tokens - used - overhead
+            content = truncate_sentences(content, remaining) if remaining >= MIN_PASSAGE_TOKENS else ""
+            if count_tokens(content) < MIN_PASSAGE_TOKENS:
+                dropped += 1
+                continue
+            content_tokens = count_tokens(content)
+            truncated += 1
+
+        if url:
+            citations[url] = number
+        passages.append(header + content)
+        used_documents.append(doc)
+        used += overhead + content_tokens
+
+    text = "\n\n".join(passages)
+    if citations:
+        text += CITATIONS_HEADER + "\n".join(f"[{number}] {url}" for url, number in citations.items())
+    return PackedContext(text, used_documents, used, truncated, dropped)
@@ -0,0 +1,325 @@
+"""
+コーパスの読み込みとパック形式（mmapで参照するバイナリ形式）
+
+JSON Lines はレコードごとにフィールド名と値を繰り返すため、url や category のように
+全レコードでほぼ同じ値も毎回書き込まれ、1件を取り出すにもファイル全体の解析が必要です。
+パック形式では次のようにまとめ、mmap でファイル全体を解析せずに参照します。
+
+- 値の種類が少ない文字列フィールド（category / url など）は文字列表に1回だけ格納し、レコードには番号を置く
+- 本文などの値はUTF-8のバイト列を長さ付きで格納する（文字列以外の値はJSONで格納する）
+- レコードの位置を固定長のオフセット表に、id をハッシュ表に格納し、番号・id で O(1) で取り出す
+
+ファイルの構成（数値はすべてリトルエンディアン）:
+    ヘッダー        マジック・バージョン・件数・各セクションの位置
+    フィールド表    フィールドごとに 種類(u8) / 名前の長さ(u16) / 名前
+    文字列表        件数(u32) / 終端位置(u32 x 件数) / UTF-8 を連結したもの
+    レコード        フィールドの順に、文字列表の番号(u32) または 長さ(u32) + バイト列
+    オフセット表    レコードの先頭位置(u64 x 件数)
+    ハッシュ表      id のCRC32で引くオープンアドレス法の表（レコード番号 + 1 (u32)、0 は空き）
+
+    write_corpus(load_jsonl("data/processed/redlist-documents.jsonl"), "data/processed/redlist-documents.corpus")
+    corpus = PackedCorpus.open("data/processed/redlist-documents.corpus")
+    doc = corpus.get("1234")
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+
+MAGIC = b"RLCORPUS"
+CORPUS_FORMAT_VERSION = 1
+
+# マジック / バージョン / 件数 / フィールド数 / ハッシュ表の大きさ / 文字列表・レコード・オフセット表・ハッシュ表の位置
+_HEADER = struct.Struct("<8sIIIIQQQQ")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+_FIELD = struct.Struct("<BH")
+
+# フィールドの種類
+KIND_INTERNED = 1  # 文字列表の番号
+KIND_TEXT = 2      # UTF-8 の文字列
+KIND_JSON = 3      # JSON（文字列以外の値を含むフィールド）
+
+# 値がないことを表す番号・長さ
+_MISSING = 0xFFFFFFFF
+
+# 1つの値あたりの平均の出現回数がこれ以上の文字列フィールドは文字列表に格納する
+INTERN_MIN_REPEATS = 2
+
+
+def load_jsonl(path) -> list:
+    """
+    JSON Lines形式のドキュメントを読み込む
+    """
+    documents = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                documents.append(json.loads(line))
+    return documents
+
+
+def is_packed_corpus(path) -> bool:
+    """
+    パック形式のファイルか（先頭のマジックで判定）
+    """
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def iter_documents(path):
+    """
+    JSONL・パック形式のどちらのファイルからも、ドキュメントを先頭から順に返す
+    """
+    if is_packed_corpus(path):
+        with PackedCorpus.open(path) as corpus:
+            yield from corpus
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def load_documents(path) -> list:
+    """
+    JSONL・パック形式のどちらのファイルからも、全ドキュメントをリストで読み込む
+    """
+    if is_packed_corpus(path):
+        with PackedCorpus.open(path) as corpus:
+            return list(corpus)
+    return load_jsonl(path)
+
+
+def _hash_id(doc_id: str) -> int:
+    return zlib.crc32(doc_id.encode("utf-8"))
+
+
+def _hash_slots(count: int) -> int:
+    # 使用率を 50% 以下にして探索を短く保つ（2のべき乗にしてビット演算で剰余を取る）
+    slots = 1
+    while slots < count * 2:
+        slots *= 2
+    return slots
+
+
+def _field_kinds(documents: list, fields: list) -> dict:
+    kinds = {}
+    for field in fields:
+        values = [doc[field] for doc in documents if field in doc]
+        if not all(isinstance(value, str) for value in values):
+            kinds[field] = KIND_JSON
+        elif len(set(values)) * INTERN_MIN_REPEATS <= len(values):
+            kinds[field] = KIND_INTERNED
+        else:
+            kinds[field] = KIND_TEXT
+    return kinds
+
+
+def write_corpus(documents, path, id_field: str = "id") -> dict:
+    """
+    ドキュメントをパック形式で書き出す（一時ファイルに書き込んでから置き換える）
+
+    フィールドの順序は最初に現れた順（id_field は先頭）。値の種類が少ない文字列フィールドは
+    文字列表に、文字列以外の値を含むフィールドはJSONで格納する。
+    id が重複する場合は、id による参照では後のレコードを返す（AI Search の mergeOrUpload と同じ）。
+
+    Returns:
+        フィールド名 -> 種類（"interned" / "text" / "json"）
+    """
+    documents = list(documents)
+    fields = list(dict.fromkeys(key for doc in documents for key in doc))
+    if id_field in fields:
+        fields.remove(id_field)
+        fields.insert(0, id_field)
+    kinds = _field_kinds(documents, fields)
+
+    strings = {}
+    for field in fields:
+        if kinds[field] == KIND_INTERNED:
+            for doc in documents:
+                if field in doc:
+                    strings.setdefault(doc[field], len(strings))
+
+    field_table = bytearray()
+    for field in fields:
+        name = field.encode("utf-8")
+        field_table += _FIELD.pack(kinds[field], len(name)) + name
+
+    encoded_strings = [value.encode("utf-8") for value in strings]
+    string_table = bytearray(_U32.pack(len(encoded_strings)))
+    end = 0
+    for value in encoded_strings:
+        end += len(value)
+        string_table += _U32.pack(end)
+    string_table += b"".join(encoded_strings)
+
+    strings_offset = _HEADER.size + len(field_table)
+    records_offset = strings_offset + len(string_table)
+
+    records = bytearray()
+    offsets = []
+    for doc in documents:
+        offsets.append(records_offset + len(records))
+        for field in fields:
+            if field not in doc:
+                records += _U32.pack(_MISSING)
+            elif kinds[field] == KIND_INTERNED:
+                records += _U32.pack(strings[doc[field]])
+            else:
+                value = doc[field]
+                if kinds[field] == KIND_JSON:
+                    value = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+                data = value.encode("utf-8")
+                records += _U32.pack(len(data)) + data
+
+    # オフセット表を8バイト境界に揃える
+    records += b"\0" * (-(records_offset + len(records)) % 8)
+    offsets_offset = records_offset + len(records)
+
+    slots = _hash_slots(len(documents)) if id_field in fields else 0
+    table = [0] * slots
+    if slots:
+        ids = [str(doc.get(id_field, "")) for doc in documents]
+        for index, doc_id in enumerate(ids):
+            if id_field not in documents[index]:
+                continue
+            slot = _hash_id(doc_id) & (slots - 1)
+            while table[slot] and ids[table[slot] - 1] != doc_id:
+                slot = (slot + 1) & (slots - 1)
+            table[slot] = index + 1
+    hash_offset = offsets_offset + len(offsets) * _U64.size
+
+    header = _HEADER.pack(MAGIC, CORPUS_FORMAT_VERSION, len(documents), len(fields), slots,
+                          strings_offset, records_offset, offsets_offset, hash_offset)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(field_table)
+        f.write(string_table)
+        f.write(records)
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.write(struct.pack(f"<{slots}I", *table))
+    os.replace(tmp_path, path)
+
+    names = {KIND_INTERNED: "interned", KIND_TEXT: "text", KIND_JSON: "json"}
+    return {field: names[kinds[field]] for field in fields}
+
+
+class PackedCorpus:
+    """
+    パック形式のコーパス（mmapで参照し、取り出したレコードだけを復元する）
+
+    文字列表だけは開いた時に読み込む（値の種類が少ないフィールドのみのため小さい）。
+    """
+
+    def __init__(self, buffer: mmap.mmap):
+        self._buffer = buffer
+        (magic, version, self._count, field_count, self._slots, strings_offset,
+         self._records_offset, self._offsets_offset, self._hash_offset) = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a packed corpus file")
+        if version != CORPUS_FORMAT_VERSION:
+            raise ValueError(f"Unsupported corpus version: {version} (expected {CORPUS_FORMAT_VERSION})")
+
+        self.fields = []
+        position = _HEADER.size
+        for _ in range(field_count):
+            kind, length = _FIELD.unpack_from(buffer, position)
+            position += _FIELD.size
+            self.fields.append((buffer[position:position + length].decode("utf-8"), kind))
+            position += length
+
+        (string_count,) = _U32.unpack_from(buffer, strings_offset)
+        ends = struct.unpack_from(f"<{string_count}I", buffer, strings_offset + _U32.size)
+        data_offset = strings_offset + _U32.size * (string_count + 1)
+        self._strings = []
+        start = 0
+        for end in ends:
+            self._strings.append(buffer[data_offset + start:data_offset + end].decode("utf-8"))
+            start = end
+
+    @classmethod
+    def open(cls, path) -> "PackedCorpus":
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def close(self) -> None:
+        self._buffer.close()
+
+    def __enter__(self) -> "PackedCorpus":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> dict:
+        """
+        レコード番号でドキュメントを取り出す
+        """
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("corpus index out of range")
+        return self._decode(self._record_offset(index))
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self._decode(self._record_offset(index))
+
+    def get(self, doc_id):
+        """
+        id でドキュメントを取り出す（存在しない場合は None）
+        """
+        # ハッシュ表は id フィールド（先頭）がある場合のみ作成される
+        if not self._slots:
+            return None
+        doc_id = str(doc_id)
+        mask = self._slots - 1
+        slot = _hash_id(doc_id) & mask
+        while True:
+            (entry,) = _U32.unpack_from(self._buffer, self._hash_offset + slot * _U32.size)
+            if entry == 0:
+                return None
+            offset = self._record_offset(entry - 1)
+            value, _ = self._read_value(offset, self.fields[0][1])
+            if value is not None and str(value) == doc_id:
+                return self._decode(offset)
+            slot = (slot + 1) & mask
+
+    def _record_offset(self, index: int) -> int:
+        return _U64.unpack_from(self._buffer, self._offsets_offset + index * _U64.size)[0]
+
+    def _read_value(self, offset: int, kind: int) -> tuple:
+        """
+        offset の位置の1つの値と、次の値の位置を返す（値がない場合は None）
+        """
+        (number,) = _U32.unpack_from(self._buffer, offset)
+        offset += _U32.size
+        if number == _MISSING:
+            return None, offset
+        if kind == KIND_INTERNED:
+            return self._strings[number], offset
+        text = self._buffer[offset:offset + number].decode("utf-8")
+        return (json.loads(text) if kind == KIND_JSON else text), offset + number
+
+    def _decode(self, offset: int) -> dict:
+        doc = {}
+        for name, kind in self.fields:
+            (number,) = _U32.unpack_from(self._buffer, offset)
+            if number == _MISSING:
+                offset += _U32.size
+                continue
+            doc[name], offset = self._read_value(offset, kind)
+        return doc
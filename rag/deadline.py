@@ -0,0 +1,189 @@
+"""
+リクエスト単位の期限（デッドライン）と、遅い呼び出しに備えたヘッジ・再送
+
+依存先の1回の遅い呼び出しがそのまま p99 の応答時間になるのを防ぐため、
+/api/chat の処理全体に期限を設け、各段階はその残り時間の範囲で実行します。
+
+- Deadline: リクエストの期限。ContextVar で保持し、各段階は budget() で自分の持ち時間を得る
+- HedgedCall: 直近の所要時間の分位点（p95）を超えても返らない呼び出しは、同じ呼び出しをもう1つ送り、
+  先に成功した結果を使う（もう一方は取り消す）。冪等な呼び出し（検索）にのみ使用する
+- retry_with_jitter: 一時的な失敗を、期限内に収まる範囲でフルジッター付きの指数バックオフで再送する
+
+    deadline = start_deadline(20.0)
+    results = await asyncio.wait_for(hedger.call(search), deadline.budget(3.0))
+"""
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+
+_current_deadline = ContextVar("rag_request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    段階の持ち時間（リクエストの期限）を超えた
+    """
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    リクエストの期限（モノトニック時計）
+    """
+
+    def __init__(self, seconds: float):
+        # 0以下の場合は期限なし
+        self.expires_at = time.monotonic() + seconds if seconds > 0 else math.inf
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, limit: float = None, reserve: float = 0.0) -> float:
+        """
+        段階の持ち時間（limit と、後の段階のために reserve 秒を残した残り時間の小さいほう）
+        """
+        budget = max(0.0, self.remaining() - reserve)
+        return budget if limit is None or limit <= 0 else min(limit, budget)
+
+    def activate(self) -> "Deadline":
+        """
+        現在のコンテキスト（ストリーミング応答の生成など）でこの期限を使う
+        """
+        _current_deadline.set(self)
+        return self
+
+
+def start_deadline(seconds: float) -> Deadline:
+    """
+    現在のコンテキストでリクエストの期限を開始
+    """
+    return Deadline(seconds).activate()
+
+
+def current_deadline() -> Deadline:
+    """
+    現在のリクエストの期限（開始されていない場合は期限なし）
+    """
+    deadline = _current_deadline.get()
+    return deadline if deadline is not None else Deadline(0)
+
+
+async def run_with_budget(awaitable, budget: float, stage: str):
+    """
+    budget 秒以内に完了しない場合は取り消して DeadlineExceeded を送出
+    """
+    try:
+        return await asyncio.wait_for(awaitable, timeout=budget if math.isfinite(budget) else None)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(stage) from None
+
+
+class HedgedCall:
+    """
+    所要時間の分位点を超えた呼び出しを重複して送る（ヘッジ）
+
+    分位点は直近 window 件の成功した呼び出しから計算する。件数が min_samples に満たない間は
+    initial_delay を使う。ヘッジで増える呼び出しは、遅い呼び出しの割合（1 - quantile）程度に収まる。
+    """
+
+    def __init__(self, quantile: float = 0.95, window: int = 256, min_samples: int = 20,
+                 initial_delay: float = 1.0, min_delay: float = 0.05):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self._latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @property
+    def delay(self) -> float:
+        """
+        ヘッジを送るまでの待ち時間
+        """
+        if len(self._latencies) < self.min_samples:
+            return self.initial_delay
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, math.ceil(self.quantile * len(ordered)) - 1)
+        return max(self.min_delay, ordered[index])
+
+    async def call(self, factory):
+        """
+        factory() の結果を返す（delay 秒以内に返らない場合はもう1つ送り、先に成功したほうを使う）
+
+        Args:
+            factory: 呼び出すたびに新しいコルーチンを返す関数
+        """
+        self.calls += 1
+        started = [time.monotonic()]
+        tasks = [asyncio.ensure_future(factory())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay)
+            if not done:
+                self.hedged += 1
+                started.append(time.monotonic())
+                tasks.append(asyncio.ensure_future(factory()))
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    index = tasks.index(task)
+                    if index == 1:
+                        self.hedge_wins += 1
+                    self._latencies.append(time.monotonic() - started[index])
+                    return task.result()
+            raise error
+        finally:
+            # 負けた呼び出しと、期限切れなどで呼び出し元が取り消された場合の呼び出しを取り消す
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "delay": round(self.delay, 4),
+        }
+
+
+async def retry_with_jitter(factory, max_retries: int, base_delay: float, is_retryable,
+                            deadline: Deadline = None, on_retry=None):
+    """
+    一時的な失敗をフルジッター付きの指数バックオフで再送する（冪等な呼び出し用）
+
+    待ち時間が期限の残りを超える場合は再送せずに最後の例外を送出する。
+
+    Args:
+        factory: 呼び出すたびに新しいコルーチンを返す関数
+        max_retries: 再送の最大回数
+        base_delay: バックオフの基準秒数（attempt 回目は 0〜base_delay * 2^attempt 秒）
+        is_retryable: 例外を受け取り、再送するかを返す関数
+        deadline: リクエストの期限
+        on_retry: 再送のたびに呼び出す関数
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return await factory()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, base_delay * (2 ** attempt))
+            if deadline is not None and deadline.remaining() <= delay:
+                raise
+            if on_retry is not None:
+                on_retry()
+            await asyncio.sleep(delay)
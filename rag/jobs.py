@@ -0,0 +1,498 @@
+"""
+チャットの非同期ジョブ（受付・キュー・ワーカー・結果の参照）
+
+/api/chat は検索と生成が終わるまでHTTPの接続を保持するため、アクセスが集中すると開いたままの
+接続が増え、接続数に応じてインスタンスがスケールアウトします（長い場合は functionTimeout まで）。
+ジョブとして受け付けた場合は、ジョブIDをすぐに返して接続を閉じ、上限付きのワーカーがキューから
+順に処理します。結果はジョブIDで参照するか、指定したURLへのWebhookで受け取ります。
+
+- キューは put / get / ack / size / close を持つクラスで差し替えられる
+  - MemoryJobQueue: ワーカープロセス内の asyncio.Queue（上限付き、満杯の場合は JobQueueFull）
+  - StorageJobQueue: Azure Storage Queue（ローカルでは Azurite）。取り出したメッセージは処理の完了後に
+    削除し、途中でプロセスが止まった場合は visibility_timeout 後に別のワーカーが処理し直す
+- ジョブの状態は JobStore に保持する（バックエンドは会話のセッションと同じファイル / SQLite を使用できる）
+- ワーカーの数が、ジョブとして同時に実行する検索・生成の上限になる
+
+    store = JobStore(create_backend("sqlite", None, name="jobs"), ttl_seconds=3600)
+    workers = JobWorkerPool(MemoryJobQueue(max_size=1000), store, handler=run_chat_job, workers=4)
+    job = await workers.submit("ライチョウの生息地は?")   # キューが満杯の場合は JobQueueFull
+    job = await store.get(job.id)                           # status: queued / running / succeeded / failed
+"""
+import asyncio
+import json
+import logging
+import re
+import secrets
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# ジョブIDとして受け付ける形式（サーバーが発行する token_urlsafe の文字種）
+_JOB_ID_RE = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+# 終了したジョブの状態
+FINISHED_STATUSES = ("succeeded", "failed")
+
+# キューが満杯の場合に、再送までの待ち時間として返す秒数
+QUEUE_FULL_RETRY_AFTER_SECONDS = 5.0
+
+# 期限切れのジョブをバックエンドから削除する間隔（秒）
+PURGE_INTERVAL_SECONDS = 600
+
+# キューの取り出しに失敗した場合（Storage に接続できないなど）に、次に試すまでの秒数
+GET_ERROR_DELAY_SECONDS = 1.0
+
+
+def is_valid_job_id(job_id) -> bool:
+    return isinstance(job_id, str) and bool(_JOB_ID_RE.match(job_id))
+
+
+def _isoformat(timestamp):
+    if not timestamp:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="milliseconds")
+
+
+class JobQueueFull(Exception):
+    """
+    キューが満杯のためジョブを受け付けられない（HTTPの429として返す）
+    """
+
+    def __init__(self, message: str = "Job queue is full", retry_after: float = QUEUE_FULL_RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobError(Exception):
+    """
+    ジョブの失敗（message はそのまま結果の error としてクライアントに返す）
+    """
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Job:
+    """
+    1件のジョブ（質問・状態・結果）
+    """
+    __slots__ = ("id", "message", "callback_url", "status", "result", "error", "status_code",
+                 "attempts", "created_at", "started_at", "finished_at", "updated_at")
+
+    def __init__(self, job_id: str, message: str, callback_url: str = None, status: str = "queued",
+                 result: dict = None, error: str = None, status_code: int = None, attempts: int = 0,
+                 created_at: float = 0.0, started_at: float = None, finished_at: float = None,
+                 updated_at: float = 0.0):
+        self.id = job_id
+        self.message = message
+        self.callback_url = callback_url
+        self.status = status
+        self.result = result
+        self.error = error
+        self.status_code = status_code
+        self.attempts = attempts
+        self.created_at = created_at
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.updated_at = updated_at
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def queued_seconds(self) -> float:
+        """
+        受け付けてから処理を開始するまでの秒数
+        """
+        return max(0.0, (self.started_at or time.time()) - self.created_at)
+
+    def start(self, attempts: int) -> None:
+        self.status = "running"
+        self.attempts = attempts
+        self.started_at = time.time()
+
+    def succeed(self, result: dict) -> None:
+        self.status = "succeeded"
+        self.result = result
+        self.error = None
+        self.status_code = 200
+        self.finished_at = time.time()
+
+    def fail(self, error: str, status_code: int = 500) -> None:
+        self.status = "failed"
+        self.error = error
+        self.status_code = status_code
+        self.finished_at = time.time()
+
+    def queue_message(self) -> dict:
+        """
+        キューに入れる内容（別のプロセス・インスタンスのワーカーが状態を読めない場合も処理できるようにする）
+        """
+        return {"id": self.id, "message": self.message, "callback_url": self.callback_url,
+                "created_at": self.created_at}
+
+    def to_response(self) -> dict:
+        """
+        ジョブの参照・Webhookで返す内容
+        """
+        response = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": _isoformat(self.created_at),
+            "started_at": _isoformat(self.started_at),
+            "finished_at": _isoformat(self.finished_at),
+        }
+        if self.status == "succeeded":
+            response["result"] = self.result
+        elif self.status == "failed":
+            response["error"] = self.error
+            response["status_code"] = self.status_code
+        return response
+
+    def to_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        data = dict(data)
+        return cls(data.pop("id"), data.pop("message", ""), **{
+            key: value for key, value in data.items() if key in cls.__slots__
+        })
+
+
+class JobStore:
+    """
+    TTL 付きのジョブの状態（バックエンドを指定した場合は書き込みも行う）
+
+    バックエンドがある場合、終了していないジョブは毎回バックエンドから読み込む
+    （別のプロセスのワーカーが更新した状態を返すため）。
+    """
+
+    def __init__(self, backend=None, max_entries: int = 10000, ttl_seconds: float = 3600.0):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._jobs = OrderedDict()
+        self._purged_at = time.monotonic()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def _expired(self, job: Job) -> bool:
+        return self.ttl_seconds > 0 and job.updated_at + self.ttl_seconds <= time.time()
+
+    def create(self, message: str, callback_url: str = None) -> Job:
+        """
+        新しいジョブを作成（保存は save で行う）
+        """
+        now = time.time()
+        return Job(secrets.token_urlsafe(16), message, callback_url, created_at=now, updated_at=now)
+
+    async def get(self, job_id: str):
+        """
+        ジョブを取得（存在しない・期限切れ・IDの形式が不正な場合は None）
+        """
+        if not is_valid_job_id(job_id):
+            return None
+
+        job = self._jobs.get(job_id)
+        if (job is None or not job.finished) and self.backend is not None:
+            data = await asyncio.to_thread(self.backend.load, job_id)
+            job = Job.from_dict(data) if data else job
+
+        if job is None or self._expired(job):
+            if job is not None:
+                await self.delete(job_id)
+            return None
+
+        self._remember(job)
+        return job
+
+    async def save(self, job: Job) -> None:
+        job.updated_at = time.time()
+        self._remember(job)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.save, job.id, job.to_dict())
+        if time.monotonic() - self._purged_at >= PURGE_INTERVAL_SECONDS:
+            self._purged_at = time.monotonic()
+            await self.purge()
+
+    async def delete(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.delete, job_id)
+
+    async def purge(self) -> int:
+        """
+        期限切れのジョブをメモリとバックエンドから削除
+        """
+        expired = [job_id for job_id, job in self._jobs.items() if self._expired(job)]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if self.backend is not None and self.ttl_seconds > 0:
+            return await asyncio.to_thread(self.backend.purge, time.time() - self.ttl_seconds)
+        return len(expired)
+
+    def _remember(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        self._jobs.move_to_end(job.id)
+        while len(self._jobs) > self.max_entries:
+            self._jobs.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._jobs),
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "evictions": self.evictions,
+        }
+
+
+class MemoryJobQueue:
+    """
+    ワーカープロセス内のキュー（プロセスが止まった場合、処理前のジョブは失われる）
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self._queue = asyncio.Queue(max_size)
+
+    async def put(self, message: dict) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            raise JobQueueFull() from None
+
+    async def get(self) -> tuple:
+        """
+        次のメッセージを待って取り出す
+
+        Returns:
+            (メッセージ, 受領の識別子, 取り出された回数)
+        """
+        return await self._queue.get(), None, 1
+
+    async def ack(self, receipt) -> None:
+        self._queue.task_done()
+
+    async def size(self) -> int:
+        return self._queue.qsize()
+
+    async def close(self) -> None:
+        pass
+
+
+class StorageJobQueue:
+    """
+    Azure Storage Queue（azure-storage-queue が必要）
+
+    接続文字列（Azurite など）か、アカウントのURLと資格情報（Managed Identity）のどちらかを指定する。
+    取り出したメッセージは visibility_timeout の間ほかのワーカーから見えなくなり、ack で削除する。
+    """
+
+    def __init__(self, queue_name: str, connection_string: str = None, account_url: str = None,
+                 credential=None, visibility_timeout: int = 120, poll_interval: float = 1.0):
+        # 使う場合のみインポートする（requirements.txt に含めるが、memory のキューでは不要）
+        from azure.storage.queue.aio import QueueClient
+
+        if connection_string:
+            self._client = QueueClient.from_connection_string(connection_string, queue_name)
+        elif account_url:
+            self._client = QueueClient(account_url, queue_name, credential=credential)
+        else:
+            raise ValueError("StorageJobQueue requires a connection string or an account URL")
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self._created = False
+
+    async def _ensure_queue(self) -> None:
+        if self._created:
+            return
+        from azure.core.exceptions import ResourceExistsError
+        try:
+            await self._client.create_queue()
+        except ResourceExistsError:
+            pass
+        self._created = True
+
+    async def put(self, message: dict) -> None:
+        await self._ensure_queue()
+        await self._client.send_message(json.dumps(message, ensure_ascii=False))
+
+    async def get(self) -> tuple:
+        await self._ensure_queue()
+        while True:
+            message = await self._client.receive_message(visibility_timeout=self.visibility_timeout)
+            if message is None:
+                # 空の場合はポーリングする（ワーカーごとに poll_interval 秒に1回の呼び出し）
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                return json.loads(message.content), message, message.dequeue_count or 1
+            except (TypeError, ValueError):
+                # 読めないメッセージは処理し直しても読めないため削除する
+                logging.warning("Dropping malformed job message: %s", message.id)
+                await self._client.delete_message(message)
+
+    async def ack(self, receipt) -> None:
+        await self._client.delete_message(receipt)
+
+    async def size(self) -> int:
+        properties = await self._client.get_queue_properties()
+        return properties.approximate_message_count
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+def create_job_queue(kind: str, max_size: int = 1000, **storage_options):
+    """
+    設定値からキューを作成（memory / storage、storage_options は StorageJobQueue の引数）
+    """
+    kind = (kind or "memory").lower()
+    if kind == "memory":
+        return MemoryJobQueue(max_size)
+    if kind == "storage":
+        return StorageJobQueue(**storage_options)
+    raise ValueError(f"Unsupported job queue: {kind}")
+
+
+class JobWorkerPool:
+    """
+    キューからジョブを取り出して処理する上限付きのワーカー
+
+    handler はジョブを受け取って結果の dict を返すコルーチン関数。失敗をクライアントに返す場合は
+    JobError を送出する（それ以外の例外は内部エラーとして記録する）。
+    notify を指定した場合、callback_url のあるジョブの終了後に notify(job) を呼び出す。
+
+    asyncioの単一イベントループ上で使用する前提です。ワーカーは最初の submit（または start）で起動します。
+    """
+
+    def __init__(self, queue, store: JobStore, handler, workers: int = 4, notify=None, max_attempts: int = 3):
+        self.queue = queue
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.notify = notify
+        self.max_attempts = max_attempts
+        self._tasks = []
+        self.running = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        """
+        ワーカーを起動する（起動済みの場合は何もしない）
+        """
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._run()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """
+        ワーカーを止める（処理中のジョブは取り消され、Storage Queue の場合は別のワーカーが処理し直す）
+        """
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.queue.close()
+
+    async def submit(self, message: str, callback_url: str = None) -> Job:
+        """
+        ジョブを作成してキューに入れる
+
+        Raises:
+            JobQueueFull: キューが満杯の場合（ジョブは保存しない）
+        """
+        job = self.store.create(message, callback_url)
+        await self.store.save(job)
+        try:
+            await self.queue.put(job.queue_message())
+        except JobQueueFull:
+            self.rejected += 1
+            await self.store.delete(job.id)
+            raise
+        self.accepted += 1
+        self.start()
+        return job
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                message, receipt, attempts = await self.queue.get()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("Job queue receive error: %s", e)
+                await asyncio.sleep(GET_ERROR_DELAY_SECONDS)
+                continue
+            try:
+                await self._process(message, receipt, attempts)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 状態の保存・キューからの削除の失敗（Storage Queue の場合は後で処理し直される）
+                logging.error("Job processing error: %s", e)
+
+    async def _process(self, message: dict, receipt, attempts: int) -> None:
+        job = await self.store.get(message.get("id"))
+        if job is None:
+            # 別のプロセスで受け付けたジョブ（状態のバックエンドを共有していない場合）
+            job = Job.from_dict(dict(message, updated_at=time.time()))
+        if job.finished:
+            # 処理済みのジョブが再配信された場合（完了後・削除前にプロセスが止まったなど）
+            await self.queue.ack(receipt)
+            return
+
+        if attempts > self.max_attempts:
+            job.fail("ジョブの処理に繰り返し失敗しました", 500)
+        else:
+            job.start(attempts)
+            await self.store.save(job)
+            self.running += 1
+            try:
+                # ジョブごとに新しいタスク（contextvars のコピー）で実行し、
+                # リクエストの計測・ログの設定が次のジョブに残らないようにする
+                job.succeed(await asyncio.ensure_future(self.handler(job)))
+            except JobError as e:
+                job.fail(str(e), e.status_code)
+            except Exception as e:
+                logging.error("Job %s failed: %s", job.id, e)
+                job.fail("ジョブの処理中にエラーが発生しました", 500)
+            finally:
+                self.running -= 1
+
+        if job.status == "succeeded":
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        await self.store.save(job)
+        await self.queue.ack(receipt)
+
+        if self.notify is not None and job.callback_url:
+            try:
+                await self.notify(job)
+            except Exception as e:
+                # 結果はジョブIDで参照できるため、通知の失敗は記録のみ
+                logging.warning("Job %s callback failed: %s", job.id, e)
+
+    def stats(self) -> dict:
+        return {
+            "queue": type(self.queue).__name__,
+            "workers": len(self._tasks),
+            "running": self.running,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "store": self.store.stats(),
+        }
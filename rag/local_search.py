@@ -0,0 +1,333 @@
+"""
+インプロセス検索エンジン（文字n-gram + BM25）
+
+data/processed/redlist-documents.jsonl から文字bigram/trigramの転置インデックスを構築し、
+Azure AI Searchを使わずにローカルで検索します。数千件規模のコーパスであれば
+ネットワーク往復なしでサブミリ秒の検索が可能です。
+
+インデックスはディレクトリ単位で保存し、語の表とポスティングはNumPy配列（.npy）、
+ドキュメントはパック形式（rag/corpus.py）としてmmapで読み込むため、
+起動時に全体をパースする必要はありません。
+
+    python scripts/build-local-index.py data/processed/redlist-documents.jsonl data/local-index
+"""
+import json
+import math
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from .corpus import PackedCorpus, load_documents, load_jsonl, write_corpus
+from .redlist import repair_document
+
+# インデックス形式のバージョン（互換性のない変更時に更新）
+# 1: ドキュメントを documents.jsonl に保存 / 2: documents.corpus（パック形式）に保存
+# 3: 語の表を terms.json から語の昇順の配列（terms_keys.npy / terms_offsets.npy / terms_df.npy）に変更
+INDEX_FORMAT_VERSION = 3
+SUPPORTED_INDEX_VERSIONS = (1, 2, 3)
+
+# フィールドごとの重み（和名・学名への一致を本文より重視する）
+FIELD_WEIGHTS = {
+    "title": 2.0,
+    "content": 1.0,
+    "japanese_name": 3.0,
+    "scientific_name": 2.0,
+}
+
+# 検索結果として返すフィールド
+STORED_FIELDS = ("id", "title", "content", "url")
+
+NGRAM_SIZES = (2, 3)
+
+# ほぼ全文書に出現する語（定型文など）はidfが0に近く順位にほとんど影響しないため、
+# 長いポスティングの走査を省略する
+MIN_IDF = 0.01
+
+# 英数字・かな・漢字以外（句読点・記号・空白）で文字列を区切る
+_SEGMENT_SPLIT_RE = re.compile(r"[\s\W_]+")
+
+
+def tokenize(text: str) -> list:
+    """
+    文字列を文字bigram/trigramに分割
+
+    NFKC正規化・小文字化したうえで記号や空白で区切り、区切られた各区間から
+    n-gramを生成します。1文字だけの区間はそのまま1トークンとして扱います。
+    """
+    if not text:
+        return []
+
+    text = unicodedata.normalize("NFKC", str(text)).casefold()
+    tokens = []
+    for segment in _SEGMENT_SPLIT_RE.split(text):
+        if not segment:
+            continue
+        if len(segment) == 1:
+            tokens.append(segment)
+            continue
+        for n in NGRAM_SIZES:
+            tokens.extend(segment[i:i + n] for i in range(len(segment) - n + 1))
+    return tokens
+
+
+class TermDictionary:
+    """
+    語 -> (ポスティングの開始位置, 文書頻度) の表
+
+    語の昇順に並べた3つの配列に格納し、np.searchsorted（二分探索）で引きます。
+    辞書と違い、保存した配列をmmapでそのまま参照できます。
+    - keys:    語（固定長のUnicode配列。n-gramは最大3文字のため1語12バイト）
+    - offsets: ポスティングの開始位置（int64）
+    - dfs:     文書頻度（uint32）
+    """
+
+    def __init__(self, keys, offsets, dfs):
+        self.keys = keys
+        self.offsets = offsets
+        self.dfs = dfs
+
+    @classmethod
+    def from_dict(cls, terms: dict) -> "TermDictionary":
+        """
+        語 -> (開始位置, 文書頻度) の辞書から作成
+        """
+        keys = np.array(list(terms), dtype=str) if terms else np.empty(0, dtype="<U1")
+        order = np.argsort(keys, kind="stable")
+        entries = np.array(list(terms.values()), dtype=np.int64).reshape(-1, 2)
+        return cls(keys[order], entries[order, 0], entries[order, 1].astype(np.uint32))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(self, tokens: list):
+        """
+        語の一覧を引き、見つかった語の (tokens での位置, 開始位置, 文書頻度) の配列を返す
+        """
+        if not tokens or not len(self.keys):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        queries = np.array(tokens, dtype=str)
+        positions = np.searchsorted(self.keys, queries)
+        in_range = positions < len(self.keys)
+        found = np.zeros(len(queries), dtype=bool)
+        found[in_range] = self.keys[positions[in_range]] == queries[in_range]
+        positions = positions[found]
+        return np.flatnonzero(found), self.offsets[positions], self.dfs[positions]
+
+    def get(self, token: str):
+        """
+        1語を引く（存在しない場合は None）
+        """
+        _, offsets, dfs = self.lookup([token])
+        return (int(offsets[0]), int(dfs[0])) if len(offsets) else None
+
+    def save(self, directory: Path) -> None:
+        np.save(directory / "terms_keys.npy", np.asarray(self.keys))
+        np.save(directory / "terms_offsets.npy", np.asarray(self.offsets))
+        np.save(directory / "terms_df.npy", np.asarray(self.dfs))
+
+    @classmethod
+    def load(cls, directory: Path) -> "TermDictionary":
+        return cls(
+            np.load(directory / "terms_keys.npy", mmap_mode="r"),
+            np.load(directory / "terms_offsets.npy", mmap_mode="r"),
+            np.load(directory / "terms_df.npy", mmap_mode="r"),
+        )
+
+
+class LocalSearchIndex:
+    """
+    BM25で検索する読み取り専用の転置インデックス
+
+    ポスティングは語ごとに連続した区間として2つの配列に格納します。
+    - postings_docs: ドキュメント番号（uint32）
+    - postings_tf:   フィールド重み付きの出現回数（float32）
+    terms は語 -> (開始位置, 文書頻度) の表（TermDictionary）です。
+    """
+
+    def __init__(self, terms: dict, postings_docs, postings_tf, doc_lengths,
+                 documents: list, k1: float = 1.2, b: float = 0.75):
+        self.terms = terms
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.doc_lengths = doc_lengths
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+
+        n_docs = len(documents)
+        avgdl = float(doc_lengths.mean()) if n_docs else 0.0
+        # BM25の文書長正規化項は文書ごとに固定なので事前計算しておく
+        self._length_norm = (
+            k1 * (1 - b + b * np.asarray(doc_lengths, dtype=np.float32) / avgdl)
+            if avgdl > 0 else np.full(n_docs, k1, dtype=np.float32)
+        )
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @classmethod
+    def from_documents(cls, documents: list, k1: float = 1.2, b: float = 0.75) -> "LocalSearchIndex":
+        """
+        ドキュメントのリストからメモリ上にインデックスを構築
+
+        フィールドのずれたドキュメント（以前の prepare-redlist-data.py の出力）は本来の形に戻してから登録する。
+        """
+        documents = [repair_document(doc) for doc in documents]
+        postings = {}
+        doc_lengths = np.zeros(len(documents), dtype=np.float32)
+
+        for doc_index, doc in enumerate(documents):
+            weighted_tf = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for token, count in Counter(tokenize(doc.get(field, ""))).items():
+                    weighted_tf[token] += weight * count
+            doc_lengths[doc_index] = sum(weighted_tf.values())
+            for token, tf in weighted_tf.items():
+                postings.setdefault(token, []).append((doc_index, tf))
+
+        terms = {}
+        total = sum(len(entries) for entries in postings.values())
+        postings_docs = np.empty(total, dtype=np.uint32)
+        postings_tf = np.empty(total, dtype=np.float32)
+        offset = 0
+        for token, entries in postings.items():
+            terms[token] = (offset, len(entries))
+            for doc_index, tf in entries:
+                postings_docs[offset] = doc_index
+                postings_tf[offset] = tf
+                offset += 1
+
+        stored = [{field: doc.get(field, "") for field in STORED_FIELDS} for doc in documents]
+        return cls(TermDictionary.from_dict(terms), postings_docs, postings_tf, doc_lengths, stored, k1=k1, b=b)
+
+    @classmethod
+    def from_jsonl(cls, path) -> "LocalSearchIndex":
+        # パック形式のコーパスも読み込める
+        return cls.from_documents(load_documents(path))
+
+    def save(self, directory) -> None:
+        """
+        インデックスをディレクトリに保存
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        np.save(directory / "postings_docs.npy", np.asarray(self.postings_docs))
+        np.save(directory / "postings_tf.npy", np.asarray(self.postings_tf))
+        np.save(directory / "doc_lengths.npy", np.asarray(self.doc_lengths))
+
+        self.terms.save(directory)
+
+        write_corpus(self.documents, directory / "documents.corpus")
+
+        meta = {
+            "version": INDEX_FORMAT_VERSION,
+            "documents": len(self.documents),
+            "terms": len(self.terms),
+            "k1": self.k1,
+            "b": self.b,
+            "ngram_sizes": list(NGRAM_SIZES),
+            "field_weights": FIELD_WEIGHTS,
+        }
+        with open(directory / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, directory) -> "LocalSearchIndex":
+        """
+        保存済みインデックスを読み込む（ポスティング配列はmmapで参照）
+        """
+        directory = Path(directory)
+        with open(directory / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") not in SUPPORTED_INDEX_VERSIONS:
+            raise ValueError(
+                f"Unsupported local index version: {meta.get('version')} "
+                f"(expected {INDEX_FORMAT_VERSION})"
+            )
+
+        if meta["version"] >= 3:
+            terms = TermDictionary.load(directory)
+        else:
+            with open(directory / "terms.json", "r", encoding="utf-8") as f:
+                terms = TermDictionary.from_dict({term: tuple(entry) for term, entry in json.load(f).items()})
+
+        return cls(
+            terms,
+            np.load(directory / "postings_docs.npy", mmap_mode="r"),
+            np.load(directory / "postings_tf.npy", mmap_mode="r"),
+            np.load(directory / "doc_lengths.npy"),
+            # ドキュメントは検索結果として返すものだけを取り出す
+            PackedCorpus.open(directory / "documents.corpus") if meta["version"] >= 2
+            else load_jsonl(directory / "documents.jsonl"),
+            k1=meta.get("k1", 1.2),
+            b=meta.get("b", 0.75),
+        )
+
+    @classmethod
+    def open(cls, path) -> "LocalSearchIndex":
+        """
+        パスの種類に応じてインデックスを開く
+        - ディレクトリ: 保存済みインデックスを読み込む
+        - .jsonl / パック形式のファイル: その場でインデックスを構築する（ローカル開発向け）
+        """
+        path = Path(path)
+        if path.is_dir():
+            return cls.load(path)
+        return cls.from_jsonl(path)
+
+    def score(self, query: str):
+        """
+        全ドキュメントに対するBM25スコアを計算
+        """
+        n_docs = len(self.documents)
+        scores = np.zeros(n_docs, dtype=np.float32)
+
+        query_tfs = Counter(tokenize(query))
+        tokens = list(query_tfs)
+        for position, start, df in zip(*self.terms.lookup(tokens)):
+            query_tf = query_tfs[tokens[position]]
+            start, df = int(start), int(df)
+            docs = self.postings_docs[start:start + df]
+            tf = self.postings_tf[start:start + df]
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            if idf < MIN_IDF:
+                continue
+            # 1語のポスティング内でドキュメント番号は重複しないため、加算はそのまま行える
+            scores[docs] += query_tf * idf * tf * (self.k1 + 1) / (tf + self._length_norm[docs])
+
+        return scores
+
+    def search(self, query: str, top_k: int = 3) -> list:
+        """
+        クエリに一致する上位k件を search_documents と同じ形式で返す
+
+        Returns:
+            {id, content, title, url, score} のリスト（スコア降順）
+        """
+        if top_k <= 0 or not self.documents:
+            return []
+
+        scores = self.score(query)
+        k = min(top_k, len(scores))
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        results = []
+        for doc_index in ranked:
+            score = float(scores[doc_index])
+            if score <= 0:
+                break
+            doc = self.documents[doc_index]
+            results.append({
+                "id": doc.get("id", ""),
+                "content": doc.get("content", ""),
+                "title": doc.get("title", ""),
+                "url": doc.get("url", ""),
+                "score": score,
+            })
+        return results
@@ -0,0 +1,200 @@
+"""
+リクエスト処理から切り離したログ出力（キュー + バックグラウンドスレッド）
+
+logging.info() を呼び出すと、通常はそのスレッド（イベントループ）でメッセージの組み立てと
+ハンドラーへの書き込み（Functions ホスト / Application Insights への送信）まで行われます。
+host.json のサンプリングは、ログが作られて送信された後に間引くだけです。ここでは次のようにして、
+ログがイベントループの時間を使わないようにします。
+
+- ルートロガーのハンドラーをキューに置き換え、元のハンドラーへの書き込みは QueueListener の
+  スレッドで行う。キューが満杯の場合は待たずに捨てる（件数は dropped で確認できる）
+- % 書式のメッセージの展開・JSONへの変換も書き込み側のスレッドで行う（呼び出し側は引数を渡すだけ）
+- リクエストの開始時に1回だけサンプリングを判定し、対象外のリクエストでは WARNING 未満のログを
+  キューに入れる前に捨てる
+- JSON形式では、ログにリクエストIDと extra={"fields": {...}} で渡した値（段階ごとの所要時間など）を含める
+
+    install_log_pipeline(max_queue_size=10000, json_format=True, use_queue=True)
+    start_request_log(req.headers.get("x-request-id"), sample_rate=0.1)
+    logging.info("Found %d documents", len(documents))
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+_current_request_log = ContextVar("rag_request_log", default=None)
+
+
+class RequestLog:
+    """
+    1リクエスト分のログの設定（リクエストIDとサンプリングの判定結果）
+    """
+
+    __slots__ = ("request_id", "sampled")
+
+    def __init__(self, request_id: str, sampled: bool):
+        self.request_id = request_id
+        self.sampled = sampled
+
+
+def start_request_log(request_id: str = None, sample_rate: float = 1.0) -> RequestLog:
+    """
+    現在のコンテキストでリクエストのログを開始（サンプリングはここで1回だけ判定する）
+
+    Args:
+        request_id: 呼び出し元から渡されたリクエストID（省略時は生成する）
+        sample_rate: WARNING 未満のログを出力するリクエストの割合（0〜1）
+    """
+    sampled = sample_rate >= 1.0 or random.random() < sample_rate
+    request_log = RequestLog((request_id or uuid.uuid4().hex)[:64], sampled)
+    _current_request_log.set(request_log)
+    return request_log
+
+
+def current_request_id():
+    """
+    現在のリクエストのID（リクエストの外では None）
+    """
+    request_log = _current_request_log.get()
+    return request_log.request_id if request_log is not None else None
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    ログにリクエストIDを付け、サンプリング対象外のリクエストの WARNING 未満のログを捨てる
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_log = _current_request_log.get()
+        if request_log is None:
+            return True
+        if not request_log.sampled and record.levelno < logging.WARNING:
+            return False
+        record.request_id = request_log.request_id
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    1件のログを1行のJSONにする（extra={"fields": {...}} の値はそのまま含める）
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    ログをそのままキューに入れる（メッセージの展開は書き込み側で行い、満杯の場合は待たずに捨てる）
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 標準の QueueHandler はここでメッセージを展開するが、同一プロセス内のキューのため
+        # LogRecord を渡せば書き込み側のスレッドで展開できる
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    キューと書き込みスレッド（install_log_pipeline で作成）
+    """
+
+    def __init__(self, handler: NonBlockingQueueHandler, listener: QueueListener):
+        self.handler = handler
+        self.listener = listener
+        self._stopped = False
+
+    @property
+    def dropped(self) -> int:
+        return self.handler.dropped
+
+    @property
+    def queued(self) -> int:
+        return self.handler.queue.qsize()
+
+    def stop(self) -> None:
+        """
+        キューに残ったログを書き出してスレッドを止める（2回目以降は何もしない）
+        """
+        if self._stopped:
+            return
+        self._stopped = True
+        self.listener.stop()
+
+    def stats(self) -> dict:
+        return {"queued": self.queued, "dropped": self.dropped}
+
+
+def install_log_pipeline(max_queue_size: int = 10000, json_format: bool = False,
+                         use_queue: bool = False):
+    """
+    ルートロガーにリクエストIDの付与・サンプリングを設定し、書き込みをキュー経由にする
+
+    既存のハンドラー（Functions ホストへの送信など）はそのまま書き込み先として使う。
+    ハンドラーがない場合（ローカル実行など）は標準エラー出力に書き込む。
+    json_format と use_queue はどちらも指定した場合のみ有効にする（既定ではホストの形式のまま、
+    呼び出し元のスレッドで書き込むため、Application Insights で関数の呼び出しとの紐づけが保たれる）。
+
+    Args:
+        max_queue_size: キューに溜められるログの件数（超えた分は捨てる）
+        json_format: 書き込み先のハンドラーの形式を JSON にする（False の場合はハンドラーの形式を変えない）
+        use_queue: True の場合は書き込みをキュー経由にする（False の場合はフィルターと形式のみ設定する）
+
+    Returns:
+        LogPipeline（use_queue が False の場合は None）
+    """
+    root = logging.getLogger()
+    handlers = [handler for handler in root.handlers if not isinstance(handler, NonBlockingQueueHandler)]
+    if not handlers:
+        handlers = [logging.StreamHandler()]
+        root.addHandler(handlers[0])
+    if json_format:
+        for handler in handlers:
+            handler.setFormatter(JsonFormatter())
+
+    if not use_queue:
+        for handler in handlers:
+            handler.addFilter(RequestContextFilter())
+        return None
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(max_queue_size))
+    queue_handler.addFilter(RequestContextFilter())
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    pipeline = LogPipeline(queue_handler, listener)
+    # プロセス終了時にキューに残ったログを書き出す
+    atexit.register(pipeline.stop)
+    return pipeline
@@ -0,0 +1,269 @@
+"""
+処理段階ごとのレイテンシ計測とPrometheus形式のメトリクス出力
+
+- timed(stage) で囲んだ区間をモノトニック時計で計測し、固定バケットのヒストグラムに記録する
+- 同じ区間の所要時間はリクエスト単位（contextvars）でも保持し、Server-Timingヘッダーに使用する
+- registry.render() でPrometheusのテキスト形式を出力する
+"""
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# レイテンシのバケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(
+            name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    単調増加するカウンター
+    """
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.label_names), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    固定バケットのヒストグラム
+    """
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # ラベル値 -> [バケットごとの件数, 合計, 件数]
+        self._series = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(labels.get(name, "") for name in self.label_names))
+        return series[2] if series else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (bucket_counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    出力時に関数を呼び出して値を取得するメトリクス（キャッシュ件数などの既存の統計用）
+    """
+
+    def __init__(self, name: str, help_text: str, func, metric_type: str = "gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+        self.metric_type = metric_type
+
+    def render(self) -> list:
+        return [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.metric_type}",
+            f"{self.name} {_format_value(self.func())}",
+        ]
+
+
+class MetricsRegistry:
+    """
+    メトリクスを登録し、Prometheusのテキスト形式で出力する
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str, label_names: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def callback(self, name: str, help_text: str, func, metric_type: str = "gauge") -> CallbackMetric:
+        return self._register(CallbackMetric(name, help_text, func, metric_type))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+class RequestTimings:
+    """
+    1リクエスト内の段階ごとの所要時間（Server-Timingヘッダー用）
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def server_timing(self) -> str:
+        """
+        Server-Timingヘッダーの値（ミリ秒）を組み立てる
+        """
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+
+registry = MetricsRegistry()
+
+stage_latency = registry.histogram(
+    "rag_stage_latency_seconds",
+    "Latency of each chat processing stage in seconds.",
+    label_names=("stage",)
+)
+openai_tokens = registry.counter(
+    "rag_openai_tokens_total",
+    "Azure OpenAI token usage reported in response.usage.",
+    label_names=("type",)
+)
+retrievals = registry.counter(
+    "rag_retrievals_total",
+    "Context retrievals by source (species-name lookup or search).",
+    label_names=("source",)
+)
+search_filters = registry.counter(
+    "rag_search_filters_total",
+    "Searches routed with a category/rank filter, by whether the filter was kept or dropped.",
+    label_names=("result",)
+)
+search_variants = registry.counter(
+    "rag_search_variants_total",
+    "Multi-query search variants by outcome (ok, dropped at the deadline, error).",
+    label_names=("result",)
+)
+context_tokens = registry.histogram(
+    "rag_context_tokens",
+    "Estimated tokens of the retrieved context packed into the prompt.",
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000)
+)
+context_passages = registry.counter(
+    "rag_context_passages_total",
+    "Retrieved passages by how they were packed into the prompt.",
+    label_names=("result",)
+)
+static_responses = registry.counter(
+    "rag_static_responses_total",
+    "Static file responses by status and content encoding.",
+    label_names=("status", "encoding")
+)
+retries = registry.counter(
+    "rag_retries_total",
+    "Retries of idempotent dependency calls by stage.",
+    label_names=("stage",)
+)
+deadline_exceeded = registry.counter(
+    "rag_deadline_exceeded_total",
+    "Chat requests that ran out of their deadline, by the stage that was running.",
+    label_names=("stage",)
+)
+job_callbacks = registry.counter(
+    "rag_job_callbacks_total",
+    "Chat job results posted to callback URLs, by result.",
+    label_names=("result",)
+)
+errors = registry.counter(
+    "rag_errors_total",
+    "Errors by processing stage.",
+    label_names=("stage",)
+)
+
+_current_timings = ContextVar("rag_request_timings", default=None)
+
+
+def start_request() -> RequestTimings:
+    """
+    現在のコンテキストでリクエスト単位の計測を開始
+    """
+    timings = RequestTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    区間の所要時間をヒストグラムと現在のリクエストに記録する
+
+        with timed("search"):
+            documents = await client.search(...)
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        stage_latency.observe(elapsed, stage=stage)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
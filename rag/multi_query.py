@@ -0,0 +1,135 @@
+"""
+複数の検索クエリの生成と、検索結果の統合（Reciprocal Rank Fusion）
+
+質問文をそのまま1回検索するだけでは、言い回しによって取りこぼしが生じます
+（「らいちょう」とひらがなで書かれた場合や、質問の定型句が語の一致を薄める場合など）。
+ここでは1つの質問から次の検索クエリを作成し、並行して検索した結果を順位で統合します。
+
+- 元の質問文
+- 語句の抽出形: カタカナ・漢字・英数字の連続部分だけを残したもの（「について教えてください」などを除く）
+- かな正規化形: 定型句を除いたうえでひらがなをカタカナに変換したもの（種名はカタカナで登録されている）
+
+統合には Reciprocal Rank Fusion（各結果リストでの順位 r に対して 1 / (k + r) を合計）を使用します。
+検索エンジンのスコアはクエリごとに尺度が異なるため、順位だけで統合します。
+"""
+import re
+import unicodedata
+
+# RRF の定数（上位の順位差を緩やかにする。一般的な値は60）
+RRF_K = 60
+
+# 質問の定型句・機能語（長いものから順に除去する）
+_FUNCTION_PHRASE_RE = re.compile(
+    "|".join(sorted((
+        "について教えてください", "を教えてください", "教えてください", "について", "とは",
+        "でしょうか", "ですか", "ますか", "ください", "されている", "されています", "している",
+        "しています", "いますか", "ありますか", "いる", "ある", "どこ", "どれ", "なに", "なん",
+        "どんな", "どの", "もの", "こと", "です", "ます",
+    ), key=len, reverse=True))
+)
+
+# ひらがなの連続部分と、その末尾の助詞（「らいちょうの」の「の」）
+_HIRAGANA_RUN_RE = re.compile(r"[ぁ-ゖー]+")
+_TRAILING_PARTICLES = "のはがをにでともへや"
+
+# 検索語として残す連続部分（カタカナ・漢字・英数字）
+_TERM_RE = re.compile(r"[ァ-ヺー]{2,}|[㐀-鿿々]+|[A-Za-z0-9][A-Za-z0-9+.\-]*")
+
+# カタカナに変換するひらがなの範囲（ぁ〜ゖ）
+_HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in range(ord("ぁ"), ord("ゖ") + 1)}
+
+
+def to_katakana(text: str) -> str:
+    """
+    ひらがなをカタカナに変換
+    """
+    return text.translate(_HIRAGANA_TO_KATAKANA)
+
+
+def _split_particle(match) -> str:
+    run = match.group(0)
+    # 2文字以下は助詞そのもの、または短すぎて語とみなせないため区切りにする
+    if len(run) <= 2:
+        return " "
+    if run[-1] in _TRAILING_PARTICLES:
+        run = run[:-1]
+    return f" {run} "
+
+
+def extract_terms(text: str) -> list:
+    """
+    検索語として意味のある部分（カタカナ・漢字・英数字の連続）を出現順に重複なく取り出す
+    """
+    terms = []
+    for term in _TERM_RE.findall(text):
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+
+def build_query_variants(query: str, max_variants: int = 3) -> list:
+    """
+    1つの質問から検索クエリの候補を作成（先頭は元の質問文、重複は除く）
+
+    Args:
+        query: ユーザーの質問
+        max_variants: 返すクエリの最大数
+
+    Returns:
+        検索クエリのリスト
+    """
+    normalized = unicodedata.normalize("NFKC", query)
+    stripped = _HIRAGANA_RUN_RE.sub(_split_particle, _FUNCTION_PHRASE_RE.sub(" ", normalized))
+
+    candidates = [
+        query,
+        " ".join(extract_terms(stripped)),
+        " ".join(extract_terms(to_katakana(stripped))),
+    ]
+
+    variants = []
+    for candidate in candidates:
+        candidate = candidate.strip()
+        if candidate and candidate not in variants:
+            variants.append(candidate)
+    return variants[:max_variants]
+
+
+def document_key(doc: dict):
+    """
+    検索結果のドキュメントを同一とみなすキー（id。id を含まない結果では本文・タイトル・URL）
+
+    タイトルやURLだけでは区別できない（URLはすべて同じで、タイトルが同じ種も多い）ため、
+    タイトルとURLをキーにすると別の種が1件に統合されてしまう。
+    """
+    doc_id = doc.get("id")
+    if doc_id:
+        return doc_id
+    return doc.get("content"), doc.get("title"), doc.get("url")
+
+
+def reciprocal_rank_fusion(ranked_lists: list, top_k: int, key=document_key, k: int = RRF_K) -> list:
+    """
+    複数の検索結果リストを順位で統合する
+
+    Args:
+        ranked_lists: 検索結果（{id, content, title, url, score}）のリストのリスト（それぞれ順位順）
+        top_k: 返す件数
+        key: ドキュメントを同一とみなすキーを返す関数
+        k: RRF の定数
+
+    Returns:
+        統合後の上位 top_k 件（score は RRF のスコア）
+    """
+    scores = {}
+    documents = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, start=1):
+            doc_key = key(doc)
+            scores[doc_key] = scores.get(doc_key, 0.0) + 1.0 / (k + rank)
+            # 同じドキュメントは最初に現れたもの（元の質問文の結果を優先）を使う
+            documents.setdefault(doc_key, doc)
+
+    # 同点の場合は最初に現れた順（dict の挿入順）を保つ
+    ranked_keys = sorted(scores, key=lambda doc_key: -scores[doc_key])[:top_k]
+    return [dict(documents[doc_key], score=scores[doc_key]) for doc_key in ranked_keys]
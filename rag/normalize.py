@@ -0,0 +1,45 @@
+"""
+クエリ正規化
+
+表記ゆれ（全角/半角、空白、句読点、大文字/小文字）を吸収し、
+同じ意味の質問が同じキーになるように正規化します。
+"""
+import re
+import unicodedata
+
+# 連続する空白をまとめるためのパターン
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 英数字の単語間以外の空白（日本語の文字に隣接する空白）を検出するパターン
+_NON_WORD_SPACE_RE = re.compile(r"(?<![0-9a-z]) | (?![0-9a-z])")
+
+
+def _fold_char(ch: str) -> str:
+    """
+    句読点・記号を空白に置き換える（長音符などの文字は残す）
+    """
+    category = unicodedata.category(ch)
+    if category[0] in ("P", "S"):
+        return " "
+    return ch
+
+
+def normalize_query(text: str) -> str:
+    """
+    クエリ文字列を正規化
+
+    - Unicode NFKC正規化（全角英数字→半角、半角カナ→全角カナ）
+    - 大文字/小文字の統一
+    - 句読点・記号を空白に変換
+    - 連続する空白を1つにまとめ、英数字の単語間以外の空白は除去
+
+    Args:
+        text: 正規化前の文字列
+
+    Returns:
+        正規化後の文字列
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(_fold_char(ch) for ch in text)
+    text = _WHITESPACE_RE.sub(" ", text).strip()
+    return _NON_WORD_SPACE_RE.sub("", text)
@@ -0,0 +1,174 @@
+"""
+質問文から検索のフィルター条件（分類・ランク）を抽出する
+
+「淡水魚で絶滅危惧IA類に指定されているものは?」のような質問は、全文検索だけでは
+全ドキュメントがスコアの対象になり、分類やランクの異なる文書が上位に混ざります。
+ここでは分類（category）とランク（rank）の語彙を規則で照合し、
+AI Search の filter（OData）に変換して候補を絞り込みます。
+
+- 分類: 「鳥」「淡水魚」「植物」などの語を category の値に対応付ける
+- ランク: 「絶滅危惧IA類」「準絶滅危惧」やカテゴリーの略号（CR / EN / VU ...）を rank の値
+  （「絶滅危惧ⅠA類（CR）」のような rag.redlist.RANK_LABELS の表記）に対応付ける
+  「絶滅危惧種」は総称のため（「〇〇は絶滅危惧種ですか?」でNTの種を除外しないよう）条件にしない
+- 「〇〇は鳥類ですか?」のように、はい/いいえで答える質問の述語にあたる語は条件にしない
+- 集計: 「何種」「いくつ」などを含む質問は、件数とファセット（分類別・ランク別の件数）を取得する
+
+    analysis = analyze_query("鳥類で絶滅危惧IA類の種は何種ですか?")
+    analysis.filter      # "search.in(category, '鳥類', '|') and search.in(rank, '絶滅危惧ⅠA類（CR）|CR', '|')"
+    analysis.aggregate   # True
+"""
+import re
+import unicodedata
+
+from .redlist import RANK_LABELS
+
+# 分類（category の値）と、質問中でその分類を表す語
+CATEGORY_TERMS = {
+    "哺乳類": ("哺乳類", "ほ乳類", "哺乳動物"),
+    "鳥類": ("鳥類", "鳥"),
+    "爬虫類": ("爬虫類", "は虫類"),
+    "両生類": ("両生類", "両棲類", "サンショウウオ"),
+    "汽水・淡水魚類": ("淡水魚", "汽水", "魚類", "魚"),
+    "昆虫類": ("昆虫",),
+    "貝類": ("貝類", "貝"),
+    "その他無脊椎動物": ("無脊椎動物", "甲殻類"),
+    "維管束植物": ("植物", "シダ", "樹木"),
+}
+
+# 分類の語を含むが分類を表さない語（「鳥取」の「鳥」など）
+EXCLUDED_TERMS = ("鳥取", "鳥居", "焼き鳥")
+
+# ランクの略号と、rank に格納されうる値
+# prepare-redlist-data.py が格納する表記（RANK_LABELS）に加えて、サンプルデータなどの略号だけの値にも一致させる
+RANK_VALUES = {code: (label, code) for code, label in RANK_LABELS.items()}
+
+# 和名のランク表記（NFKC正規化後。ローマ数字のⅠ・Ⅱは I・II になる）
+_RANK_NAME_PATTERNS = (
+    (re.compile(r"絶滅危惧\s*(?:I|1)\s*A\s*類", re.IGNORECASE), ("CR",)),
+    (re.compile(r"絶滅危惧\s*(?:I|1)\s*B\s*類", re.IGNORECASE), ("EN",)),
+    (re.compile(r"絶滅危惧\s*(?:I|1)\s*類", re.IGNORECASE), ("CR+EN", "CR", "EN")),
+    (re.compile(r"絶滅危惧\s*(?:II|2)\s*類", re.IGNORECASE), ("VU",)),
+    (re.compile(r"準絶滅危惧"), ("NT",)),
+    (re.compile(r"野生絶滅"), ("EW",)),
+    (re.compile(r"絶滅種|絶滅した"), ("EX",)),
+    (re.compile(r"情報不足"), ("DD",)),
+    (re.compile(r"地域個体群"), ("LP",)),
+)
+
+# 略号は大文字の単独の語のみ（学名などの英単語の一部と区別する）
+_RANK_CODE_RE = re.compile(r"(?<![A-Za-z+])(CR\+EN|CR|EN|VU|NT|DD|LP|EX|EW)(?![A-Za-z+])")
+
+# はい/いいえで答える質問の述語（「は鳥類ですか」「はCRに分類されますか」）
+_PREDICATE_RE = re.compile(r"[はって][^\s、。,は]*?(?:ですか|でしょうか|に分類されますか|に含まれますか|に指定されていますか)")
+
+# 件数・内訳を尋ねる表現
+_AGGREGATE_RE = re.compile(r"何種|何件|何個|いくつ|どのくらい|どれくらい|件数|種数|多い|少ない|割合|内訳|一覧")
+
+
+def _odata_in(field: str, values) -> str:
+    """
+    search.in による一致条件（値の ' はODataの規則で '' にエスケープ）
+    """
+    joined = "|".join(value.replace("'", "''") for value in values)
+    return f"search.in({field}, '{joined}', '|')"
+
+
+class QueryAnalysis:
+    """
+    質問文から抽出した検索条件
+    """
+
+    def __init__(self, categories: list, ranks: list, aggregate: bool):
+        self.categories = categories
+        self.ranks = ranks
+        self.aggregate = aggregate
+
+    def __bool__(self) -> bool:
+        return bool(self.categories or self.ranks or self.aggregate)
+
+    @property
+    def has_conditions(self) -> bool:
+        """
+        分類・ランクの条件があるか（質問が検索の対象を自分で指定しているか）
+        """
+        return bool(self.categories or self.ranks)
+
+    @property
+    def filter(self):
+        """
+        AI Search の filter 式（条件がない場合は None）
+        """
+        clauses = []
+        if self.categories:
+            clauses.append(_odata_in("category", self.categories))
+        if self.ranks:
+            values = []
+            for rank in self.ranks:
+                values.extend(value for value in RANK_VALUES[rank] if value not in values)
+            clauses.append(_odata_in("rank", values))
+        return " and ".join(clauses) or None
+
+    def describe(self) -> str:
+        """
+        条件の説明（集計結果の見出しに使用）
+        """
+        parts = []
+        if self.categories:
+            parts.append("分類: " + "・".join(self.categories))
+        if self.ranks:
+            parts.append("ランク: " + "・".join(self.ranks))
+        return " / ".join(parts) or "条件なし"
+
+
+def analyze_query(text: str) -> QueryAnalysis:
+    """
+    質問文から分類・ランク・集計の要否を抽出
+
+    Args:
+        text: ユーザーの質問
+
+    Returns:
+        QueryAnalysis
+    """
+    text = unicodedata.normalize("NFKC", text)
+    aggregate = bool(_AGGREGATE_RE.search(text))
+    text = _PREDICATE_RE.sub(" ", text)
+
+    category_text = text
+    for term in EXCLUDED_TERMS:
+        category_text = category_text.replace(term, " ")
+    categories = [
+        category for category, terms in CATEGORY_TERMS.items()
+        if any(term in category_text for term in terms)
+    ]
+
+    ranks = []
+    remaining = text
+    for pattern, codes in _RANK_NAME_PATTERNS:
+        if pattern.search(remaining):
+            ranks.extend(code for code in codes if code not in ranks)
+            # 「絶滅危惧IA類」が「絶滅危惧I類」などに重ねて一致しないよう、一致した部分を除く
+            remaining = pattern.sub(" ", remaining)
+    for code in _RANK_CODE_RE.findall(text):
+        if code not in ranks:
+            ranks.append(code)
+
+    return QueryAnalysis(categories, ranks, aggregate)
+
+
+def format_facets(analysis: QueryAnalysis, total: int, facets: dict) -> str:
+    """
+    件数とファセットを、コンテキストに含める集計結果の文章にする
+
+    Args:
+        analysis: 検索条件
+        total: 条件に一致したドキュメント数
+        facets: フィールド名 -> [{"value": 値, "count": 件数}, ...]
+    """
+    lines = [f"検索条件: {analysis.describe()}", f"該当する種の数: {total}"]
+    for field, label in (("category", "分類別"), ("rank", "ランク別")):
+        buckets = facets.get(field) or []
+        if buckets:
+            counts = ", ".join(f"{bucket['value']} {bucket['count']}" for bucket in buckets)
+            lines.append(f"{label}: {counts}")
+    return "\n".join(lines)
@@ -0,0 +1,205 @@
+"""
+Azure OpenAI のクォータ（RPM / TPM）に合わせた送信の流量制御
+
+デプロイメントのクォータを超えて送信すると429が連続して返り、再試行が集中して
+かえってスループットが下がります。ここでは送信前にRPM・TPMのトークンバケットで
+順番に許可を出し、クォータ内の一定のペースで送信します。
+
+- 待ち行列は上限付き。満杯の場合や待ち時間の上限を超える場合は OverloadedError を送出する
+- 429の Retry-After を受け取った場合は、その時間すべての送信を止める（penalize）
+"""
+import asyncio
+import time
+
+from rag.context import count_tokens
+
+# バケットに貯められる量（何秒分のバーストを許容するか）
+BURST_SECONDS = 10.0
+
+
+class OverloadedError(Exception):
+    """
+    混雑のため受け付けられない（HTTPの429 / 503として返す）
+    """
+
+    def __init__(self, message: str, status_code: int = 429, retry_after: float = 1.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    """
+    リクエストのトークン数を概算（プロンプト + max_tokens）
+
+    Azure OpenAI もレート制限の判定には max_tokens を含めた見積もりを使用する。
+    """
+    prompt_tokens = sum(count_tokens(message.get("content") or "") + 4 for message in messages)
+    return prompt_tokens + max_tokens
+
+
+class TokenBucket:
+    """
+    一定の速度で補充されるトークンバケット
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        amount を消費できるまでの秒数（1回で消費できる量は容量まで）
+        """
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class AdmissionScheduler:
+    """
+    RPM / TPM のトークンバケットで送信を許可する（先着順）
+
+        await scheduler.acquire(estimated_tokens)
+        response = await client.chat.completions.create(...)
+
+    rpm / tpm が0の場合はその制限を行わない。
+    """
+
+    def __init__(self, rpm: float = 0, tpm: float = 0, max_queue: int = 100,
+                 max_wait: float = 10.0):
+        self.rpm_bucket = TokenBucket(rpm) if rpm > 0 else None
+        self.tpm_bucket = TokenBucket(tpm) if tpm > 0 else None
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self._lock = asyncio.Lock()
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.throttled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rpm_bucket is not None or self.tpm_bucket is not None
+
+    def is_full(self) -> bool:
+        return self.enabled and self.waiting >= self.max_queue
+
+    def check_capacity(self) -> None:
+        """
+        待ち行列が満杯であれば、送信前の処理（検索など）を行う前に OverloadedError を送出する
+        """
+        if self.is_full():
+            self.rejected_queue_full += 1
+            raise OverloadedError("Too many requests are waiting for Azure OpenAI quota",
+                                  status_code=429, retry_after=self._retry_after())
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        wait = max(0.0, self.blocked_until - now)
+        if self.rpm_bucket is not None:
+            wait = max(wait, self.rpm_bucket.wait_time(1, now))
+        if self.tpm_bucket is not None:
+            wait = max(wait, self.tpm_bucket.wait_time(tokens, now))
+        return wait
+
+    async def acquire(self, tokens: int) -> None:
+        """
+        送信の許可を待つ
+
+        Raises:
+            OverloadedError: 待ち行列が満杯（429）、または max_wait 秒以内に許可できない（503）
+        """
+        if not self.enabled and self.blocked_until <= time.monotonic():
+            self.admitted += 1
+            return
+
+        if self.waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise OverloadedError("Too many requests are waiting for Azure OpenAI quota",
+                                  status_code=429, retry_after=self._retry_after())
+
+        deadline = time.monotonic() + self.max_wait
+        self.waiting += 1
+        try:
+            # ロックは先着順に取得されるため、許可も到着順になる
+            # 先に並んだ呼び出し元は自身の期限（こちらの期限より前）までにロックを手放すため、
+            # ロックの待ち時間も期限内に収まる
+            await self._lock.acquire()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(tokens, now)
+                    if wait <= 0:
+                        break
+                    if now + wait > deadline:
+                        raise asyncio.TimeoutError
+                    await asyncio.sleep(wait)
+
+                if self.rpm_bucket is not None:
+                    self.rpm_bucket.consume(1)
+                if self.tpm_bucket is not None:
+                    self.tpm_bucket.consume(tokens)
+                self.admitted += 1
+            finally:
+                self._lock.release()
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise OverloadedError("Timed out waiting for Azure OpenAI quota",
+                                  status_code=503, retry_after=self._retry_after()) from None
+        finally:
+            self.waiting -= 1
+
+    def penalize(self, retry_after: float) -> None:
+        """
+        429の Retry-After の間、すべての送信を止める
+        """
+        self.throttled += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def _retry_after(self) -> float:
+        """
+        クライアントに返す Retry-After の目安（秒）
+        """
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        if self.rpm_bucket is not None:
+            wait = max(wait, self.waiting / self.rpm_bucket.rate)
+        return max(1.0, round(wait, 1))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "throttled": self.throttled,
+        }
+
+
+def parse_retry_after(headers, default: float = 1.0) -> float:
+    """
+    429応答の retry-after-ms / retry-after ヘッダーを秒に変換
+    """
+    if headers is None:
+        return default
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value:
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                continue
+    return default
@@ -0,0 +1,150 @@
+"""
+レッドリストのドキュメントのフィールド（タイトル・本文の組み立てと、列のずれたドキュメントの修正）
+
+e-Gov のレッドリストCSVの列は「カテゴリー, 分類群, 和名, 学名」の順です。以前の
+prepare-redlist-data.py はこれを「学名, 和名, ランク, 科名」として読んでいたため、
+その出力（Blobから取得した verify-download.jsonl や、それを登録したインデックス）では
+フィールドが次のようにずれています。
+
+    japanese_name  <- 分類群（「哺乳類」「コウチュウ目」など）
+    scientific_name <- カテゴリー（「絶滅危惧ⅠA類（CR）」など）
+    rank           <- 和名
+    family         <- 学名
+
+repair_document はこの形のドキュメントを判定し、各フィールドを本来の値に戻して
+タイトルと本文を組み立て直します（id はそのまま）。正しい形のドキュメントは変更しません。
+
+CSVのカテゴリーの表記には「絶滅危惧Ⅱ類（VU） 」（末尾の空白）や「絶滅危惧ⅠA類（CR)」（半角の括弧）
+のような揺れがあるため、rank は normalize_rank で RANK_LABELS の表記にそろえます
+（AI Search の filter / facets は値の完全一致で集計するため）。
+
+検索結果（title / content / url のみ）の和名・学名は species_names で本文から取り出せます。
+
+    doc = repair_document(json.loads(line))
+    doc["japanese_name"]   # "オキナワオオコウモリ"
+    species_names({"content": hit["content"]})   # ("オキナワオオコウモリ", "Pteropus loochoensis")
+"""
+import re
+
+# カテゴリー（ランク）の略号と、rank に格納する表記（環境省のレッドリストの表記）
+RANK_LABELS = {
+    "EX": "絶滅（EX）",
+    "EW": "野生絶滅（EW）",
+    "CR": "絶滅危惧ⅠA類（CR）",
+    "EN": "絶滅危惧ⅠB類（EN）",
+    "CR+EN": "絶滅危惧Ⅰ類（CR+EN）",
+    "VU": "絶滅危惧Ⅱ類（VU）",
+    "NT": "準絶滅危惧（NT）",
+    "DD": "情報不足（DD）",
+    "LP": "絶滅のおそれのある地域個体群（LP）",
+}
+
+# 本文の「ラベル: 値」の行と、対応するフィールド（format_content の各行）
+_CONTENT_LABELS = {"和名": "japanese_name", "学名": "scientific_name", "絶滅危惧ランク": "rank", "科名": "family"}
+
+# ラベルの行を探す本文の先頭の行数
+_CONTENT_HEADER_LINES = 6
+
+# カテゴリー（ランク）の表記の末尾にある略号（「絶滅危惧ⅠA類（CR）」「絶滅（EX)」など）
+_RANK_CODE_SUFFIX_RE = re.compile(r"[（(]\s*(CR\+EN|CR|EN|VU|NT|DD|LP|EX|EW)\s*[)）]\s*$")
+
+
+def looks_like_rank(value) -> bool:
+    """
+    カテゴリー（ランク）の表記か（末尾の略号で判定）
+    """
+    return isinstance(value, str) and bool(_RANK_CODE_SUFFIX_RE.search(value))
+
+
+def normalize_rank(value: str) -> str:
+    """
+    カテゴリー（ランク）の表記を RANK_LABELS の表記にそろえる
+
+    末尾の略号（括弧の全角・半角を問わない）または略号だけの値で判定し、
+    どちらでもない値は前後の空白を除いてそのまま返す。
+    """
+    value = value.strip()
+    match = _RANK_CODE_SUFFIX_RE.search(value)
+    code = match.group(1) if match else value
+    return RANK_LABELS.get(code, value)
+
+
+def format_title(japanese_name, rank):
+    """
+    タイトル（「和名 (ランク)」。文字列のほか pandas の Series も渡せる）
+    """
+    return japanese_name + ' (' + rank + ')'
+
+
+def format_content(category: str, japanese_name, scientific_name, rank, family):
+    """
+    本文（category 以外は文字列のほか pandas の Series も渡せる）
+    """
+    return (
+        f'分類: {category}\n和名: ' + japanese_name
+        + '\n学名: ' + scientific_name
+        + '\n絶滅危惧ランク: ' + rank
+        + '\n科名: ' + family
+        + '\n\nこの種は環境省のレッドリスト(第4次)において' + rank + 'に分類されています。'
+    )
+
+
+def is_shifted(doc: dict) -> bool:
+    """
+    以前の prepare-redlist-data.py が出力した、フィールドのずれたドキュメントか
+    """
+    return looks_like_rank(doc.get("scientific_name")) and not looks_like_rank(doc.get("rank"))
+
+
+def repair_document(doc: dict) -> dict:
+    """
+    フィールドのずれたドキュメントを本来の形に戻す（ずれていない場合はそのまま返す）
+    """
+    if not is_shifted(doc):
+        return doc
+
+    category = doc.get("category") or ""
+    japanese_name = (doc.get("rank") or "").strip()
+    scientific_name = (doc.get("family") or "").strip()
+    rank = normalize_rank(doc["scientific_name"])
+    family = (doc.get("japanese_name") or "").strip()
+
+    return dict(
+        doc,
+        title=format_title(japanese_name, rank),
+        content=format_content(category, japanese_name, scientific_name, rank, family),
+        rank=rank,
+        scientific_name=scientific_name,
+        japanese_name=japanese_name,
+        family=family,
+    )
+
+
+def content_fields(content: str) -> dict:
+    """
+    本文の先頭の「和名: …」「学名: …」などの行からフィールドの値を取り出す
+    """
+    fields = {}
+    for line in content.split("\n", _CONTENT_HEADER_LINES)[:_CONTENT_HEADER_LINES]:
+        label, found, value = line.partition(": ")
+        field = _CONTENT_LABELS.get(label)
+        if found and field is not None:
+            fields[field] = value
+    return fields
+
+
+def species_names(doc: dict) -> tuple:
+    """
+    ドキュメントの和名・学名
+
+    名前のフィールドを含まない検索結果は本文の行から取り出す。フィールドのずれたドキュメントでは
+    和名が rank（本文の「絶滅危惧ランク:」）、学名が family（「科名:」）にあるため、そこから返す。
+    タイトルは「和名 (ランク)」の形で学名を含まないため使わない。
+    """
+    if "japanese_name" in doc and "scientific_name" in doc and "rank" in doc:
+        fields = doc
+    else:
+        fields = content_fields(doc.get("content") or "")
+    if is_shifted(fields):
+        return (fields.get("rank") or "").strip(), (fields.get("family") or "").strip()
+    return (fields.get("japanese_name") or "").strip(), (fields.get("scientific_name") or "").strip()
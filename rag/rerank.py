@@ -0,0 +1,272 @@
+"""
+検索結果の再ランキング（候補を多めに取得し、上位の数件をローカルで選び直す）
+
+AI Search の上位3件をそのままプロンプトに含めると、順位は @search.score だけで決まります。
+ここでは30〜50件の候補を取得し、次の特徴量の線形モデルで並べ替えて上位k件を選びます。
+候補全体をまとめてNumPyで計算するため、50件で1ミリ秒程度です（CPUのみ）。
+
+- search_score:    検索エンジンのスコア（候補内で0〜1に正規化）
+- title_overlap:   質問の語句の文字bigramのうち、タイトルに含まれる割合
+- content_overlap: 同じく本文に含まれる割合
+  （候補の多くに含まれる bigram は、少数にしか含まれない bigram より軽く数える）
+- japanese_name / scientific_name: 和名・学名が質問にそのまま含まれるか（1 / 0）
+  （名前は rag.redlist.species_names で取り出す。検索結果は本文の「和名:」「学名:」の行から、
+  フィールドのずれたドキュメントでは種名が入っている行から取り出す）
+
+上位から1件ずつ選ぶたびに、選んだドキュメントと本文がほぼ同じ候補を減点します（重複の除外）。
+重みは JSON ファイルで変更できます（指定のない値は既定値）。
+
+    {"weights": {"content_overlap": 1.5, "japanese_name": 2.0}, "duplicate_penalty": 1.0}
+
+    reranker = Reranker.from_file("rerank-weights.json")
+    documents = reranker.rerank(query, candidates, top_k=3)
+"""
+import json
+import math
+import re
+import unicodedata
+
+import numpy as np
+
+from .multi_query import extract_terms
+from .redlist import species_names
+
+FEATURES = ("search_score", "title_overlap", "content_overlap", "japanese_name", "scientific_name")
+
+DEFAULT_WEIGHTS = {
+    "search_score": 1.0,
+    "title_overlap": 0.5,
+    "content_overlap": 1.0,
+    "japanese_name": 1.5,
+    "scientific_name": 1.0,
+}
+
+# 重複とみなす本文の類似度（n-gram の集合のコサイン類似度）と、重複した候補から引くスコア
+DEFAULT_DUPLICATE_THRESHOLD = 0.9
+DEFAULT_DUPLICATE_PENALTY = 1.0
+
+# 本文はこの文字数までを使う（種の説明は冒頭にあり、長い本文で計算時間が伸びないようにする）
+CONTENT_MAX_CHARS = 1000
+
+# 重複の判定に使う n-gram のハッシュの次元数
+DUPLICATE_HASH_SIZE = 1024
+
+# 名前の照合に使う最短の長さ（短い名前は質問中の別の語に誤って一致する）
+MIN_NAME_LENGTH = 2
+
+# 英数字・かな・漢字以外（句読点・記号・空白）を区切りとして扱う（rag/local_search.py と同じ文字）
+_SEPARATOR_RE = re.compile(r"[\s\W_]")
+
+# 候補のフィールドを連結して1回で処理するときの区切り（制御文字のため区切り文字として扱われる）
+_FIELD_SEPARATOR = "\x01"
+
+# Unicode のコードポイントは21ビットに収まるため、2文字を1つの整数に詰めて bigram を表す
+_CODEPOINT_BITS = 21
+
+# 質問の bigram の照合に使うハッシュ表（乗算ハッシュの上位ビットを使う）
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_QUERY_TABLE_BITS = 12
+
+# 基本多言語面の文字ごとの変換表（初回の使用時に作成）
+_char_map = None
+
+
+def _get_char_map():
+    """
+    文字ごとの照合用の変換表（NFKC正規化・小文字化した文字、区切り文字は 0）
+
+    unicodedata.normalize は日本語の本文では1文字あたり0.1マイクロ秒以上かかるため、
+    1文字に変換される文字だけを表にしてNumPyで変換する（複数の文字に展開される「㍉」などは変換しない）。
+    """
+    global _char_map
+    if _char_map is None:
+        char_map = np.arange(0x10000, dtype=np.uint32)
+        for code in range(0x10000):
+            if 0xD800 <= code <= 0xDFFF:
+                continue
+            folded = unicodedata.normalize("NFKC", chr(code)).casefold()
+            if len(folded) == 1:
+                char_map[code] = ord(folded)
+            if _SEPARATOR_RE.match(chr(char_map[code])):
+                char_map[code] = 0
+        _char_map = char_map
+    return _char_map
+
+
+def _codepoints(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+
+def fold(codepoints: np.ndarray) -> np.ndarray:
+    """
+    コードポイントの配列を照合用に変換する（区切り文字は 0、基本多言語面の外の文字はそのまま）
+    """
+    char_map = _get_char_map()
+    return np.where(codepoints < 0x10000, char_map[codepoints & 0xFFFF], codepoints)
+
+
+def normalize(text: str) -> str:
+    """
+    照合用に変換した文字列（区切り文字は \\0）
+    """
+    return fold(_codepoints(text)).astype(np.uint32).tobytes().decode("utf-32-le")
+
+
+def bigram_keys(codepoints: np.ndarray) -> np.ndarray:
+    """
+    照合用に変換したコードポイントの配列から、開始位置ごとの文字bigramを整数の配列で返す（区切り文字を含むものは 0）
+    """
+    codepoints = codepoints.astype(np.int64)
+    bigrams = (codepoints[:-1] << _CODEPOINT_BITS) | codepoints[1:]
+    bigrams[(codepoints[:-1] == 0) | (codepoints[1:] == 0)] = 0
+    return bigrams
+
+
+def _hash_slots(keys: np.ndarray, bits: int) -> np.ndarray:
+    return ((keys.astype(np.uint64) * _HASH_MULTIPLIER) >> np.uint64(64 - bits)).astype(np.intp)
+
+
+def match_keys(keys: np.ndarray, query_keys: np.ndarray) -> tuple:
+    """
+    keys のうち query_keys に含まれるものの位置と、query_keys での番号を返す
+
+    質問の bigram は数十個のため、衝突のないハッシュ表を作って1回の参照で照合する
+    （np.searchsorted / np.isin より一桁速い）。
+    """
+    bits = _QUERY_TABLE_BITS
+    slots = _hash_slots(query_keys, bits)
+    while len(np.unique(slots)) < len(query_keys):
+        bits += 2
+        slots = _hash_slots(query_keys, bits)
+    table = np.zeros(1 << bits, dtype=np.int32)
+    table[slots] = np.arange(1, len(query_keys) + 1, dtype=np.int32)
+
+    found = table[_hash_slots(keys, bits)]
+    positions = np.flatnonzero(found)
+    indexes = found[positions] - 1
+    exact = query_keys[indexes] == keys[positions]
+    return positions[exact], indexes[exact]
+
+
+class Reranker:
+    """
+    特徴量の線形モデルによる再ランキング
+    """
+
+    def __init__(self, weights: dict = None, duplicate_threshold: float = DEFAULT_DUPLICATE_THRESHOLD,
+                 duplicate_penalty: float = DEFAULT_DUPLICATE_PENALTY):
+        weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        unknown = set(weights) - set(FEATURES)
+        if unknown:
+            raise ValueError(f"Unknown rerank features: {', '.join(sorted(unknown))}")
+        self.weights = weights
+        self._weight_vector = np.array([weights[name] for name in FEATURES], dtype=np.float32)
+        self.duplicate_threshold = duplicate_threshold
+        self.duplicate_penalty = duplicate_penalty
+        # 変換表の作成と、NumPy の初回の呼び出し（内部モジュールの読み込み）には数十ミリ秒かかるため、
+        # 最初のリクエストの前に1回計算しておく
+        _get_char_map()
+        self.rerank("ウォームアップ", [{"title": "ウォームアップ", "content": "ウォームアップ", "score": 1.0}] * 2, 1)
+
+    @classmethod
+    def from_file(cls, path) -> "Reranker":
+        """
+        重みのJSONファイルから作成（weights / duplicate_threshold / duplicate_penalty、省略した値は既定値）
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(
+            weights=config.get("weights"),
+            duplicate_threshold=config.get("duplicate_threshold", DEFAULT_DUPLICATE_THRESHOLD),
+            duplicate_penalty=config.get("duplicate_penalty", DEFAULT_DUPLICATE_PENALTY),
+        )
+
+    def features(self, query: str, documents: list):
+        """
+        候補ごとの特徴量（FEATURES の順の列）と、本文の n-gram の集合（重複の判定用）を計算する
+
+        Returns:
+            (features, content_sets): float32 の (候補数, 特徴量数) 配列と、(候補数, DUPLICATE_HASH_SIZE) 配列
+        """
+        n_docs = len(documents)
+        features = np.zeros((n_docs, len(FEATURES)), dtype=np.float32)
+
+        scores = np.array([doc.get("score") or 0.0 for doc in documents], dtype=np.float64)
+        low, high = scores.min(), scores.max()
+        features[:, 0] = (scores - low) / (high - low) if high > low else 1.0
+
+        # 全候補のタイトルと本文を連結し、変換と bigram の計算を1回で行う
+        segments = []
+        for doc in documents:
+            segments.append(doc.get("title") or "")
+            segments.append((doc.get("content") or "")[:CONTENT_MAX_CHARS])
+        raw = _codepoints(_FIELD_SEPARATOR.join(segment.replace(_FIELD_SEPARATOR, "") for segment in segments))
+        bigrams = bigram_keys(fold(raw))
+        # 各 bigram が何番目のフィールドか。偶数はタイトル、奇数は本文
+        # （区切りの位置から始まる bigram は 0 のため、どちらに数えてもよい）
+        starts = np.concatenate(([0], np.flatnonzero(raw == ord(_FIELD_SEPARATOR)), [len(bigrams)]))
+        segment_of = np.repeat(np.arange(len(starts) - 1), np.diff(starts))
+
+        query_terms = extract_terms(unicodedata.normalize("NFKC", query)) or [query]
+        query_keys = np.unique(bigram_keys(fold(_codepoints(" ".join(query_terms)))))
+        query_keys = query_keys[query_keys != 0]
+        if len(query_keys):
+            positions, indexes = match_keys(bigrams, query_keys)
+            matches = np.zeros((2 * n_docs, len(query_keys)), dtype=np.float32)
+            matches[segment_of[positions], indexes] = 1.0
+            matches = matches.reshape(n_docs, 2, len(query_keys))
+            # 候補の多くに含まれる bigram（「絶滅危惧」など）は軽く数える
+            document_frequency = matches.max(axis=1).sum(axis=0)
+            idf = np.log1p(n_docs / (1.0 + document_frequency)).astype(np.float32)
+            features[:, 1:3] = (matches @ idf) / idf.sum()
+
+        # 名前の照合（候補ごとの和名・学名を連結して変換し、区切りの位置で分ける）
+        normalized_query = normalize(query)
+        raw = _codepoints(_FIELD_SEPARATOR.join(
+            name.replace(_FIELD_SEPARATOR, "") for doc in documents for name in species_names(doc)))
+        folded = fold(raw)
+        folded[raw == ord(_FIELD_SEPARATOR)] = ord(_FIELD_SEPARATOR)
+        names = folded.astype(np.uint32).tobytes().decode("utf-32-le").split(_FIELD_SEPARATOR)
+        for i, name in enumerate(names):
+            # 名前の前後の区切り文字（\0）は除いて比較する
+            name = name.strip("\0")
+            if len(name) >= MIN_NAME_LENGTH and name in normalized_query:
+                features[i // 2, 3 + i % 2] = 1.0
+
+        content = np.flatnonzero((segment_of & 1).astype(bool) & (bigrams != 0))
+        content_sets = np.zeros((n_docs, DUPLICATE_HASH_SIZE), dtype=np.float32)
+        content_sets[segment_of[content] >> 1, bigrams[content] % DUPLICATE_HASH_SIZE] = 1.0
+        return features, content_sets
+
+    def rerank(self, query: str, documents: list, top_k: int) -> list:
+        """
+        候補を並べ替えて上位 top_k 件を返す（score は再ランキングのスコア）
+
+        スコアが無限大のドキュメント（ファセットの集計結果）は並べ替えずに先頭に置く。
+        """
+        pinned = [doc for doc in documents if not math.isfinite(doc.get("score") or 0.0)]
+        candidates = [doc for doc in documents if math.isfinite(doc.get("score") or 0.0)]
+        if top_k <= 0 or not candidates:
+            return pinned
+
+        features, content_sets = self.features(query, candidates)
+        base = features @ self._weight_vector
+
+        norms = np.sqrt(content_sets.sum(axis=1))
+        norms[norms == 0] = 1.0
+        scale = max(1e-6, 1.0 - self.duplicate_threshold)
+
+        adjusted = base.copy()
+        max_similarity = np.zeros(len(candidates), dtype=np.float32)
+        selected = []
+        for _ in range(min(top_k, len(candidates))):
+            best = int(np.argmax(adjusted))
+            selected.append((best, float(adjusted[best])))
+            # 選んだドキュメントとの本文の類似度（コサイン）が閾値を超えた分に応じて減点する
+            similarity = (content_sets @ content_sets[best]) / (norms * norms[best])
+            max_similarity = np.maximum(max_similarity, similarity)
+            excess = np.clip((max_similarity - self.duplicate_threshold) / scale, 0.0, 1.0)
+            adjusted = base - self.duplicate_penalty * excess
+            adjusted[[index for index, _ in selected]] = -np.inf
+
+        return pinned + [dict(candidates[index], score=score) for index, score in selected]
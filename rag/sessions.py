@@ -0,0 +1,394 @@
+"""
+複数ターンの会話のセッションストア（サーバー側で履歴を保持し、トークン数の上限で要約する）
+
+クライアントが会話全体を毎回送り直すと、ターンが進むほどプロンプトが長くなり、
+生成の待ち時間と料金が増え続けます。ここでは会話の履歴をサーバー側で保持し、
+履歴のトークン数が上限を超えたら古いターンを要約に畳み込みます。
+プロンプトに含める履歴は「要約 + 直近のターン」で上限以下に保たれるため、
+長い会話でも1ターンあたりのプロンプトの大きさ（待ち時間）はほぼ一定になります。
+
+- セッションはメモリ上で LRU（件数の上限）と TTL（最終更新からの秒数）で管理する
+- バックエンド（ローカルファイル / SQLite）を指定すると更新を書き込み、
+  メモリから追い出されたセッションや再起動後のセッションもバックエンドから読み込める
+- 要約は各ターンの先頭の文を残す抽出型（生成APIを追加で呼び出さない）
+- 履歴を使うのは続きの質問（is_follow_up）だけ。種名などを含む自己完結した質問は
+  履歴なしで回答し、回答キャッシュ・同じ質問の合流の対象にする
+
+    store = SessionStore(SQLiteSessionBackend("data/sessions.db"), max_entries=1000, ttl_seconds=3600,
+                         history_max_tokens=1000, summary_max_tokens=300)
+    session = await store.get(conversation_id) or store.create()
+    session.append("user", message)
+    session.append("assistant", answer)
+    await store.save(session)   # 履歴が上限を超えていれば要約してから保存
+"""
+import asyncio
+import json
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+from .context import count_tokens, truncate_sentences
+from .query_filters import CATEGORY_TERMS, EXCLUDED_TERMS
+
+# セッションIDとして受け付ける形式（サーバーが発行する token_urlsafe の文字種）
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+# 要約に残す1ターンあたりのトークン数
+SUMMARY_TURN_TOKENS = 60
+
+# 期限切れのセッションをバックエンドから削除する間隔（秒）
+PURGE_INTERVAL_SECONDS = 600
+
+# 要約の各行のラベル
+_ROLE_LABELS = {"user": "ユーザー", "assistant": "アシスタント"}
+
+# 前の質問を受ける語（指示語・接続の語）。これで始まる質問は続きの質問とみなす
+FOLLOW_UP_PREFIXES = ("その", "それ", "この", "これ", "あの", "あれ", "そこ", "そちら", "彼ら",
+                      "では", "じゃあ", "それでは", "なら", "他に", "ほかに", "他の", "ほかの",
+                      "また", "さらに", "あと", "同じ")
+
+# 主語のない短い質問（「生息地は?」「なぜ減ったの?」）とみなす文字数（記号・空白を除く）
+FOLLOW_UP_MAX_CHARS = 12
+
+# 質問の主語になる語（種名のカタカナ・学名などの英字と、「鳥類」「哺乳類」などの分類の語）
+_TAXON_TERMS = sorted({term for terms in CATEGORY_TERMS.items() for term in (terms[0], *terms[1])},
+                      key=len, reverse=True)
+_SUBJECT_RE = re.compile(r"[ァ-ヺ][ァ-ヺー]+|[A-Za-z]{3,}|" + "|".join(map(re.escape, _TAXON_TERMS)))
+_SYMBOL_RE = re.compile(r"[\s\W_]+")
+
+
+def is_valid_session_id(session_id) -> bool:
+    return isinstance(session_id, str) and bool(_SESSION_ID_RE.match(session_id))
+
+
+def is_follow_up(text: str) -> bool:
+    """
+    前の質問を受けた続きの質問か（履歴がないと検索・回答の対象が決まらない質問）
+
+    - 指示語・接続の語で始まる質問（「その生息地は?」「では鳥類は?」）
+    - 短く、種名や分類などの主語（カタカナ・英字の語、「鳥類」などの分類の語）を含まない質問
+      （「生息地は?」「なぜ減ったの?」。「昆虫類は何種?」は自己完結した質問）
+    """
+    text = unicodedata.normalize("NFKC", text).strip()
+    if text.startswith(FOLLOW_UP_PREFIXES):
+        return True
+    compact = _SYMBOL_RE.sub("", text)
+    for term in EXCLUDED_TERMS:
+        compact = compact.replace(term, "")
+    return len(compact) <= FOLLOW_UP_MAX_CHARS and not _SUBJECT_RE.search(compact)
+
+
+def summarize_turn(role: str, content: str) -> str:
+    """
+    1ターンを要約の1行にする（先頭の文。1文も収まらない場合は先頭の文字）
+    """
+    text = " ".join(content.split())
+    line = truncate_sentences(text, SUMMARY_TURN_TOKENS)
+    if not line:
+        line = text[:SUMMARY_TURN_TOKENS] + "…"
+    return f"{_ROLE_LABELS.get(role, role)}: {line}"
+
+
+class Turn:
+    """
+    会話の1ターン（発言者・本文・トークン数）
+    """
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str, tokens: int = None):
+        self.role = role
+        self.content = content
+        self.tokens = count_tokens(content) if tokens is None else tokens
+
+
+class Session:
+    """
+    1つの会話の要約と直近のターン
+    """
+    __slots__ = ("id", "summary", "turns", "updated_at")
+
+    def __init__(self, session_id: str, summary: str = "", turns: list = None, updated_at: float = 0.0):
+        self.id = session_id
+        self.summary = summary
+        self.turns = turns if turns is not None else []
+        # 最終更新時刻（time.time()。バックエンドに保存するためモノトニック時計ではない）
+        self.updated_at = updated_at
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.turns and not self.summary
+
+    @property
+    def history_tokens(self) -> int:
+        return count_tokens(self.summary) + sum(turn.tokens for turn in self.turns)
+
+    def append(self, role: str, content: str) -> None:
+        self.turns.append(Turn(role, content))
+
+    def last_user_message(self) -> str:
+        for turn in reversed(self.turns):
+            if turn.role == "user":
+                return turn.content
+        return ""
+
+    def compact(self, max_tokens: int, summary_max_tokens: int) -> int:
+        """
+        履歴が max_tokens を超えた場合に、古いターンを要約に畳み込む
+
+        毎ターン要約し直さないよう、履歴が max_tokens の半分以下になるまで
+        （直近の1往復は残して）古い順に畳み込む。要約が summary_max_tokens を超えた場合は
+        古い行から削除する。
+
+        Returns:
+            要約に畳み込んだターン数
+        """
+        if max_tokens <= 0 or self.history_tokens <= max_tokens:
+            return 0
+
+        lines = self.summary.splitlines() if self.summary else []
+        rolled = 0
+        while len(self.turns) > 2 and self.history_tokens > max_tokens // 2:
+            turn = self.turns.pop(0)
+            lines.append(summarize_turn(turn.role, turn.content))
+            self.summary = "\n".join(lines)
+            rolled += 1
+
+        while len(lines) > 1 and count_tokens(self.summary) > summary_max_tokens:
+            lines.pop(0)
+            self.summary = "\n".join(lines)
+        return rolled
+
+    def messages(self) -> list:
+        """
+        チャット補完に渡す履歴のメッセージ（要約は system メッセージ）
+        """
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"これまでの会話の要約:\n{self.summary}"})
+        messages.extend({"role": turn.role, "content": turn.content} for turn in self.turns)
+        return messages
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "summary": self.summary,
+            "turns": [[turn.role, turn.content, turn.tokens] for turn in self.turns],
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Session":
+        turns = [Turn(role, content, tokens) for role, content, tokens in data.get("turns", [])]
+        return cls(data["id"], data.get("summary", ""), turns, data.get("updated_at", 0.0))
+
+
+class FileSessionBackend:
+    """
+    1セッション1ファイル（JSON）で保存するバックエンド
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, session_id: str) -> Path:
+        return self.directory / f"{session_id}.json"
+
+    def load(self, session_id: str):
+        try:
+            with open(self._path(session_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, session_id: str, data: dict) -> None:
+        # 読み込み中のファイルを壊さないよう、一時ファイルに書いてから置き換える
+        tmp_path = self.directory / f"{session_id}.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        tmp_path.replace(self._path(session_id))
+
+    def delete(self, session_id: str) -> None:
+        self._path(session_id).unlink(missing_ok=True)
+
+    def purge(self, expires_before: float) -> int:
+        removed = 0
+        for path in self.directory.glob("*.json"):
+            if path.stat().st_mtime < expires_before:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+
+class SQLiteSessionBackend:
+    """
+    SQLiteの1テーブルに保存するバックエンド（複数ワーカープロセスから共有できる）
+
+    table を変えると、セッション以外の id → dict のデータ（ジョブの状態など）の保存にも使える。
+    """
+
+    def __init__(self, path, table: str = "sessions"):
+        if not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", table):
+            raise ValueError(f"Invalid table name: {table}")
+        self.table = table
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # スレッドプール（asyncio.to_thread）から呼び出すため、接続は1つにしてロックで直列化する
+        self._connection = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str):
+        with self._lock:
+            row = self._connection.execute(f"SELECT data FROM {self.table} WHERE id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id: str, data: dict) -> None:
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, payload, data.get("updated_at", time.time()))
+            )
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._connection.execute(f"DELETE FROM {self.table} WHERE id = ?", (session_id,))
+
+    def purge(self, expires_before: float) -> int:
+        with self._lock:
+            return self._connection.execute(
+                f"DELETE FROM {self.table} WHERE updated_at < ?", (expires_before,)
+            ).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class SessionStore:
+    """
+    LRU + TTL のセッションストア（バックエンドを指定した場合は書き込みも行う）
+
+    asyncioの単一イベントループ上で使用する前提のため、メモリ上の辞書にロックは持ちません。
+    同じ会話への同時のリクエストは、後に保存したものが残ります。
+    """
+
+    def __init__(self, backend=None, max_entries: int = 1000, ttl_seconds: float = 3600.0,
+                 history_max_tokens: int = 1000, summary_max_tokens: int = 300):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.history_max_tokens = history_max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self._sessions = OrderedDict()
+        self._purged_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.compactions = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _expired(self, session: Session) -> bool:
+        return self.ttl_seconds > 0 and session.updated_at + self.ttl_seconds <= time.time()
+
+    def create(self) -> Session:
+        """
+        新しいセッションを作成（保存は save で行う）
+        """
+        return Session(secrets.token_urlsafe(16))
+
+    async def get(self, session_id: str):
+        """
+        セッションを取得（存在しない・期限切れ・IDの形式が不正な場合は None）
+        """
+        if not is_valid_session_id(session_id):
+            return None
+
+        session = self._sessions.get(session_id)
+        if session is None and self.backend is not None:
+            data = await asyncio.to_thread(self.backend.load, session_id)
+            session = Session.from_dict(data) if data else None
+
+        if session is None or self._expired(session):
+            if session is not None:
+                await self.delete(session_id)
+            self.misses += 1
+            return None
+
+        self._remember(session)
+        self.hits += 1
+        return session
+
+    async def save(self, session: Session) -> None:
+        """
+        履歴を上限まで要約してセッションを保存し、件数の上限を超えた分を古い順にメモリから追い出す
+        """
+        if session.compact(self.history_max_tokens, self.summary_max_tokens):
+            self.compactions += 1
+        session.updated_at = time.time()
+        self._remember(session)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.save, session.id, session.to_dict())
+        if time.monotonic() - self._purged_at >= PURGE_INTERVAL_SECONDS:
+            self._purged_at = time.monotonic()
+            await self.purge()
+
+    async def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.delete, session_id)
+
+    async def purge(self) -> int:
+        """
+        期限切れのセッションをメモリとバックエンドから削除
+        """
+        expired = [session_id for session_id, session in self._sessions.items() if self._expired(session)]
+        for session_id in expired:
+            del self._sessions[session_id]
+        if self.backend is not None and self.ttl_seconds > 0:
+            return await asyncio.to_thread(self.backend.purge, time.time() - self.ttl_seconds)
+        return len(expired)
+
+    def _remember(self, session: Session) -> None:
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        # バックエンドがある場合、追い出したセッションは次回バックエンドから読み込む
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._sessions),
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "compactions": self.compactions,
+        }
+
+
+def create_backend(kind: str, path: str, name: str = "sessions"):
+    """
+    設定値からバックエンドを作成（"memory" の場合は None）
+
+    name は既定の保存先（data/<name> / data/<name>.db）と SQLite のテーブル名になる。
+    """
+    kind = (kind or "memory").lower()
+    if kind == "memory":
+        return None
+    if kind == "file":
+        return FileSessionBackend(path or f"data/{name}")
+    if kind == "sqlite":
+        return SQLiteSessionBackend(path or f"data/{name}.db", table=name)
+    raise ValueError(f"Unsupported {name} store: {kind}")
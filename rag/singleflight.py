@@ -0,0 +1,78 @@
+"""
+同一リクエストの合流（single-flight）
+
+同じキーの処理が実行中であれば新たに実行せず、実行中の結果を待ち合わせます。
+人気の質問に同時アクセスが集中した際、検索・生成の重複実行を防ぎます。
+"""
+import asyncio
+
+
+class SingleFlight:
+    """
+    キーごとに実行中のタスクを1つに制限する
+
+    - 最初の呼び出し元がタスクを開始し、同じキーの後続呼び出しは同じタスクを待つ
+    - 例外は待機中のすべての呼び出し元に伝播する
+    - 呼び出し元の1つがキャンセルされても共有タスクは継続し、
+      待機者が全員キャンセルされた場合のみタスクをキャンセルする
+    """
+
+    def __init__(self):
+        # key -> (task, 待機中の呼び出し元の数を保持するリスト)
+        self._inflight = {}
+        self.executions = 0
+        self.collapsed = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key, func):
+        """
+        key の処理が実行中であれば合流し、なければ func() を実行する
+
+        Args:
+            key: 合流判定に使うキー
+            func: 引数なしでコルーチンを返す関数
+
+        Returns:
+            func() の実行結果
+        """
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(func())
+            entry = (task, [0])
+            self._inflight[key] = entry
+            task.add_done_callback(lambda t, k=key: self._on_done(k, t))
+            self.executions += 1
+        else:
+            self.collapsed += 1
+
+        task, waiters = entry
+        waiters[0] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and waiters[0] == 1:
+                # 最後の待機者がキャンセルされたので、共有タスクも不要になった
+                # 後続の呼び出しがキャンセル済みタスクに合流しないよう先に登録を外す
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                task.cancel()
+            raise
+        finally:
+            waiters[0] -= 1
+
+    def stats(self) -> dict:
+        return {
+            "inflight": len(self._inflight),
+            "executions": self.executions,
+            "collapsed": self.collapsed,
+        }
+
+    def _on_done(self, key, task: asyncio.Future) -> None:
+        entry = self._inflight.get(key)
+        if entry is not None and entry[0] is task:
+            del self._inflight[key]
+        # 待機者がいない状態で失敗した場合の "exception was never retrieved" 警告を防ぐ
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,202 @@
+"""
+種名による直接参照（検索を経由しない）
+
+「イリオモテヤマネコは絶滅危惧種ですか?」のように1つの種を名指しする質問では、
+全文検索の往復を待たなくても対象のドキュメントが決まります。ここでは処理済みJSONLの
+和名（japanese_name）と学名（scientific_name）から Aho-Corasick オートマトンを構築し、
+質問文を1回走査するだけで（辞書の大きさによらず文字数に比例する時間で）種名を見つけます。
+以前の prepare-redlist-data.py が出力したフィールドのずれたドキュメント（分類群が japanese_name に、
+ランクが scientific_name に入っているもの）は、rag.redlist.repair_document で本来の形に戻してから登録します。
+
+見つかった種のドキュメントはメモリ上のドキュメントストアからidで取り出します。
+種名が見つからない場合や、一致が多すぎて質問の対象を絞り込めない場合は空のリストを返し、
+呼び出し元は通常の検索にフォールバックします。
+
+    lookup = SpeciesLookup.from_jsonl("data/processed/redlist-documents.jsonl")
+    documents = lookup.find("イリオモテヤマネコは絶滅危惧種ですか?")
+"""
+import unicodedata
+
+from .corpus import load_documents
+from .redlist import repair_document
+
+# 照合に使う名前のフィールド
+NAME_FIELDS = ("japanese_name", "scientific_name")
+
+# ドキュメントストアに保持するフィールド
+STORED_FIELDS = ("id", "title", "content", "url")
+
+# これより短い名前は誤検出が多いため辞書に登録しない
+MIN_NAME_LENGTH = 2
+
+
+def normalize_name(text: str) -> str:
+    """
+    照合用の正規化（NFKC正規化と小文字化。半角カナ・全角英数字の表記ゆれを吸収する）
+    """
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def _is_katakana(ch: str) -> bool:
+    return "ァ" <= ch <= "ヺ" or ch == "ー"
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+class AhoCorasick:
+    """
+    複数の文字列を1回の走査で照合する Aho-Corasick オートマトン
+
+    各ノードは遷移（文字 -> ノード番号）の辞書を持ち、失敗遷移と
+    そのノードで一致が確定する（接尾辞を含む）パターンの一覧を事前に計算する。
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self.patterns = []
+
+        for pattern in patterns:
+            node = 0
+            for ch in pattern:
+                next_node = self._goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][ch] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append(len(self.patterns))
+            self.patterns.append(pattern)
+
+        # 幅優先で失敗遷移を計算し、失敗先の出力を引き継ぐ
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+                queue.append(child)
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def iter_matches(self, text: str):
+        """
+        text 中のすべての一致を (開始位置, 終了位置, パターン番号) で返す
+        """
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for pattern_id in self._output[node]:
+                yield i + 1 - len(self.patterns[pattern_id]), i + 1, pattern_id
+
+
+class SpeciesLookup:
+    """
+    種名（和名・学名）からドキュメントを引く辞書とドキュメントストア
+    """
+
+    def __init__(self, documents: list):
+        self.documents = {}
+        names = {}
+        for doc in documents:
+            doc = repair_document(doc)
+            doc_id = str(doc.get("id", ""))
+            if not doc_id:
+                continue
+            self.documents[doc_id] = {field: doc.get(field, "") for field in STORED_FIELDS}
+            for field in NAME_FIELDS:
+                name = normalize_name(str(doc.get(field) or "")).strip()
+                if len(name) >= MIN_NAME_LENGTH:
+                    doc_ids = names.setdefault(name, [])
+                    if doc_id not in doc_ids:
+                        doc_ids.append(doc_id)
+
+        self.automaton = AhoCorasick(names)
+        self._doc_ids = [names[pattern] for pattern in self.automaton.patterns]
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @classmethod
+    def from_jsonl(cls, path) -> "SpeciesLookup":
+        # パック形式のコーパスも読み込める
+        return cls(load_documents(path))
+
+    def get(self, doc_id: str):
+        """
+        idでドキュメントを取り出す（存在しない場合は None）
+        """
+        return self.documents.get(doc_id)
+
+    def match_names(self, text: str) -> list:
+        """
+        text 中の種名を重ならないように左から最長一致で選び、(開始位置, 終了位置, パターン番号) で返す
+        （位置は正規化後の文字列での位置）
+
+        カタカナの名前は前後がカタカナでない場合のみ、英字の名前は単語の境界でのみ一致とする
+        （「トキ」が「トキワ…」の一部として一致しないようにする）。
+        """
+        text = normalize_name(text)
+        candidates = []
+        for start, end, pattern_id in self.automaton.iter_matches(text):
+            name = self.automaton.patterns[pattern_id]
+            before = text[start - 1] if start > 0 else ""
+            after = text[end] if end < len(text) else ""
+            if _is_katakana(name[0]) and _is_katakana(before):
+                continue
+            if _is_katakana(name[-1]) and _is_katakana(after):
+                continue
+            if _is_word_char(name[0]) and _is_word_char(before):
+                continue
+            if _is_word_char(name[-1]) and _is_word_char(after):
+                continue
+            candidates.append((start, end, pattern_id))
+
+        matches = []
+        last_end = 0
+        for start, end, pattern_id in sorted(candidates, key=lambda m: (m[0], -m[1])):
+            if start >= last_end:
+                matches.append((start, end, pattern_id))
+                last_end = end
+        return matches
+
+    def find(self, text: str, max_documents: int = 3) -> list:
+        """
+        質問文に含まれる種名のドキュメントを search_documents と同じ形式で返す
+
+        種名が見つからない場合、または該当するドキュメントが max_documents 件を超える
+        （対象を絞り込めない）場合は空のリストを返す。
+
+        Returns:
+            {id, content, title, url, score} のリスト（質問文中の出現順）
+        """
+        doc_ids = []
+        for _, _, pattern_id in self.match_names(text):
+            for doc_id in self._doc_ids[pattern_id]:
+                if doc_id not in doc_ids:
+                    doc_ids.append(doc_id)
+        if not doc_ids or len(doc_ids) > max_documents:
+            return []
+
+        results = []
+        for doc_id in doc_ids:
+            doc = self.documents[doc_id]
+            results.append({
+                "id": doc["id"],
+                "content": doc["content"],
+                "title": doc["title"],
+                "url": doc["url"],
+                "score": 1.0,
+            })
+        return results
@@ -0,0 +1,159 @@
+"""
+静的ファイルの配信（起動時にメモリへ読み込み、圧縮済みの表現を保持する）
+
+リクエストのたびにディスクから読み込んで非圧縮で返すと、ページの表示ごとに
+ファイルの読み込みと全体の転送が発生します。ここでは static/ 以下のファイルを起動時に
+1回だけ読み込み、gzip / brotli で事前に圧縮して保持します。
+
+- ETag は内容のハッシュ（エンコーディングごとに別の値）。If-None-Match が一致すれば 304 を返す
+- Accept-Encoding の q 値に従って br / gzip / 非圧縮を選ぶ（brotli はパッケージがある場合のみ）
+- HTMLは Cache-Control: no-cache（毎回 ETag で再検証）、それ以外は max-age でキャッシュさせる
+
+    assets = StaticFiles.load("static")
+    asset = assets.get("index.html")
+    encoding = negotiate_encoding(req.headers.get("accept-encoding"), asset.encodings)
+"""
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # brotli は任意（未インストールの場合は gzip のみ）
+    brotli = None
+
+# 圧縮するコンテンツタイプ（画像などの圧縮済みの形式は除く）
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+# これより小さいファイルは圧縮しない（ヘッダーのほうが大きくなる）
+MIN_COMPRESS_BYTES = 256
+
+# サーバーが優先するエンコーディングの順序（q 値が同じ場合）
+ENCODING_PREFERENCE = ("br", "gzip", "identity")
+
+
+def _is_compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class StaticAsset:
+    """
+    1ファイル分の内容と、エンコーディングごとの表現・ETag
+    """
+
+    def __init__(self, path: str, body: bytes, content_type: str, last_modified: float):
+        self.path = path
+        self.content_type = content_type
+        self.last_modified = email.utils.formatdate(last_modified, usegmt=True)
+        digest = hashlib.sha256(body).hexdigest()[:16]
+
+        # エンコーディング -> (本文, ETag)
+        self.representations = {"identity": (body, f'"{digest}"')}
+        if _is_compressible(content_type) and len(body) >= MIN_COMPRESS_BYTES:
+            # mtime=0 で圧縮結果を決定的にする
+            compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(body, quality=11)
+            for encoding, data in compressed.items():
+                if len(data) < len(body):
+                    self.representations[encoding] = (data, f'"{digest}-{encoding}"')
+
+    @property
+    def encodings(self) -> tuple:
+        return tuple(self.representations)
+
+    def is_not_modified(self, if_none_match: str) -> bool:
+        """
+        If-None-Match がこのファイルのいずれかの ETag に一致するか（弱い比較）
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        etags = {etag for _, etag in self.representations.values()}
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag in etags:
+                return True
+        return False
+
+
+class StaticFiles:
+    """
+    ディレクトリ以下の静的ファイル（相対パス -> StaticAsset）
+    """
+
+    def __init__(self, assets: dict):
+        self.assets = assets
+
+    def __len__(self) -> int:
+        return len(self.assets)
+
+    @classmethod
+    def load(cls, directory) -> "StaticFiles":
+        """
+        ディレクトリ以下のファイルをすべて読み込み、圧縮する（ディレクトリがない場合は空）
+        """
+        directory = Path(directory)
+        assets = {}
+        if directory.is_dir():
+            for path in sorted(directory.rglob("*")):
+                if not path.is_file() or any(part.startswith(".") for part in path.relative_to(directory).parts):
+                    continue
+                relative = path.relative_to(directory).as_posix()
+                content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+                if content_type.startswith("text/") or content_type in ("application/javascript", "image/svg+xml"):
+                    content_type += "; charset=utf-8"
+                assets[relative] = StaticAsset(relative, path.read_bytes(), content_type, path.stat().st_mtime)
+        return cls(assets)
+
+    def get(self, path: str):
+        """
+        相対パスのファイルを返す（ディレクトリの場合は index.html、存在しない場合は None）
+
+        読み込み済みのファイルだけを辞書で引くため、".." などでディレクトリ外は参照できない。
+        """
+        path = path.strip("/")
+        asset = self.assets.get(path)
+        if asset is None:
+            asset = self.assets.get(f"{path}/index.html" if path else "index.html")
+        return asset
+
+
+def negotiate_encoding(accept_encoding: str, available) -> str:
+    """
+    Accept-Encoding と利用可能なエンコーディングから、返すエンコーディングを選ぶ
+
+    q 値の高いもの、同じ場合は br > gzip > identity の順。identity は明示的に q=0 にされない限り選べる。
+    """
+    weights = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+
+    def weight(encoding: str) -> float:
+        if encoding in weights:
+            return weights[encoding]
+        if "*" in weights:
+            return weights["*"]
+        return 1.0 if encoding == "identity" else 0.0
+
+    candidates = [encoding for encoding in ENCODING_PREFERENCE if encoding in available and weight(encoding) > 0]
+    if not candidates:
+        return "identity"
+    return max(candidates, key=lambda encoding: weight(encoding))
@@ -0,0 +1,162 @@
+"""
+Azure ADアクセストークンのキャッシュ（期限前のバックグラウンド更新付き）
+
+DefaultAzureCredential は資格情報のチェーンを順に試すため、起動直後や期限切れ時の
+トークン取得に数百ミリ秒〜数秒かかることがあります。ここではスコープごとに
+アクセストークンと有効期限（expires_on）を保持し、期限の一定時間前に
+バックグラウンドで更新することで、リクエストがIDエンドポイントを待たないようにします。
+
+AsyncTokenCredential と同じ get_token / close を持つため、
+OpenAIのトークンプロバイダーと SearchClient の credential の両方に渡せます。
+"""
+import asyncio
+import logging
+import time
+
+# 有効期限のこの秒数前からバックグラウンドで更新する
+DEFAULT_REFRESH_MARGIN_SECONDS = 300.0
+
+# 更新に失敗した場合の再試行間隔（秒、失敗ごとに倍増）
+RETRY_DELAY_SECONDS = 5.0
+
+# 残りの有効期間がこの秒数未満のトークンは使わずに取得し直す
+MIN_VALIDITY_SECONDS = 30.0
+
+
+class _TokenEntry:
+    """
+    1スコープ分のトークンと更新タスク
+    """
+
+    def __init__(self):
+        self.token = None
+        self.fetched_at = 0.0
+        self.lock = asyncio.Lock()
+        self.refresh_task = None
+
+
+class CachedTokenCredential:
+    """
+    資格情報をラップし、スコープごとにトークンをキャッシュする
+
+    - 有効なトークンがあれば資格情報を呼ばずに返す
+    - 取得したトークンは期限の refresh_margin 秒前（有効期間が短い場合は半分の時点）に
+      バックグラウンドで更新する。更新に失敗しても期限までは既存のトークンを返し、再試行する
+    - 初回や期限切れで有効なトークンがない場合のみ、呼び出し元が取得を待つ
+      （同時に呼ばれても資格情報の呼び出しは1回にまとめる）
+    """
+
+    def __init__(self, credential, refresh_margin: float = DEFAULT_REFRESH_MARGIN_SECONDS):
+        self.credential = credential
+        self.refresh_margin = refresh_margin
+        self._entries = {}
+        self.hits = 0
+        self.fetches = 0
+        self.background_refreshes = 0
+        self.failures = 0
+
+    async def get_token(self, *scopes, **kwargs):
+        """
+        AsyncTokenCredential.get_token と同じ形式でトークンを返す
+
+        claims や tenant_id が指定された場合（追加認証の要求など）はキャッシュを使わない
+        """
+        if kwargs.get("claims") or kwargs.get("tenant_id"):
+            return await self.credential.get_token(*scopes, **kwargs)
+
+        entry = self._entries.get(scopes)
+        if entry is None:
+            entry = self._entries[scopes] = _TokenEntry()
+
+        if self._is_valid(entry.token):
+            self.hits += 1
+            return entry.token
+
+        async with entry.lock:
+            # ロック待ちの間に別の呼び出し元が取得済みであればそれを使う
+            if self._is_valid(entry.token):
+                self.hits += 1
+                return entry.token
+            await self._fetch(scopes, entry)
+            return entry.token
+
+    async def prefetch(self, *scopes) -> None:
+        """
+        トークンを事前に取得し、以降の更新をバックグラウンドに任せる
+        """
+        await self.get_token(*scopes)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "hits": self.hits,
+            "fetches": self.fetches,
+            "background_refreshes": self.background_refreshes,
+            "failures": self.failures,
+            "expires_in": {
+                " ".join(scopes): round(entry.token.expires_on - now)
+                for scopes, entry in self._entries.items()
+                if entry.token is not None
+            },
+        }
+
+    async def close(self) -> None:
+        for entry in self._entries.values():
+            if entry.refresh_task is not None:
+                entry.refresh_task.cancel()
+        self._entries.clear()
+        await self.credential.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    @staticmethod
+    def _is_valid(token) -> bool:
+        return token is not None and token.expires_on - time.time() > MIN_VALIDITY_SECONDS
+
+    async def _fetch(self, scopes: tuple, entry: _TokenEntry) -> None:
+        try:
+            token = await self.credential.get_token(*scopes)
+        except Exception:
+            self.failures += 1
+            raise
+        self.fetches += 1
+        entry.token = token
+        entry.fetched_at = time.time()
+        self._schedule_refresh(scopes, entry)
+
+    def _schedule_refresh(self, scopes: tuple, entry: _TokenEntry) -> None:
+        current = asyncio.current_task()
+        if entry.refresh_task is not None and entry.refresh_task is not current:
+            entry.refresh_task.cancel()
+        entry.refresh_task = asyncio.ensure_future(self._refresh_later(scopes, entry))
+
+    async def _refresh_later(self, scopes: tuple, entry: _TokenEntry) -> None:
+        """
+        期限前まで待機してトークンを更新する（失敗時は期限まで再試行する）
+        """
+        lifetime = entry.token.expires_on - entry.fetched_at
+        margin = min(self.refresh_margin, lifetime / 2)
+        await asyncio.sleep(max(0.0, entry.token.expires_on - margin - time.time()))
+
+        delay = RETRY_DELAY_SECONDS
+        while True:
+            try:
+                async with entry.lock:
+                    await self._fetch(scopes, entry)
+                self.background_refreshes += 1
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                remaining = entry.token.expires_on - time.time()
+                logging.warning("Token refresh failed (%.0fs left): %s", remaining, e)
+                if remaining <= 0:
+                    # 期限切れ後は次の get_token で呼び出し元が取得する
+                    entry.refresh_task = None
+                    return
+                await asyncio.sleep(min(delay, max(remaining / 2, 1.0)))
+                delay *= 2
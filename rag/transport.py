@@ -0,0 +1,156 @@
+"""
+Azure OpenAI / AI Search 向けのHTTPトランスポート（接続プールの設定と統計）
+
+SDKの既定のトランスポートは接続数・キープアライブ・タイムアウトが固定のため、
+高並列時に接続の作り直しや接続待ちが発生します。ここでは接続プールを明示的に作成し、
+インスタンスの規模に合わせて設定できるようにします。
+
+- OpenAI: httpx.AsyncClient（最大接続数・キープアライブ・タイムアウト・HTTP/2）
+- Search: aiohttp.ClientSession を共有する azure-core の AioHttpTransport
+
+どちらも stats() で使用中・待機中の接続数と接続待ちの回数を返します。
+"""
+import httpx
+
+
+class HttpPoolSettings:
+    """
+    接続プールとタイムアウトの設定
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0, connect_timeout: float = 5.0,
+                 read_timeout: float = 60.0, http2: bool = False):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2
+
+
+class PooledAsyncHTTPTransport(httpx.AsyncHTTPTransport):
+    """
+    接続プールの統計を取得できる httpx のトランスポート
+    """
+
+    def __init__(self, settings: HttpPoolSettings):
+        super().__init__(
+            limits=httpx.Limits(
+                max_connections=settings.max_connections,
+                max_keepalive_connections=settings.max_keepalive_connections,
+                keepalive_expiry=settings.keepalive_expiry,
+            ),
+            http2=settings.http2,
+        )
+        self.settings = settings
+        self.requests = 0
+        self.waits = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        connections = self._pool.connections
+        if len(connections) >= self.settings.max_connections and \
+                not any(connection.is_available() for connection in connections):
+            # 空き接続がなく新規接続も作れないため、プールの空きを待つことになる（送信前の状態での概算）
+            self.waits += 1
+        return await super().handle_async_request(request)
+
+    def stats(self) -> dict:
+        connections = self._pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            "max_connections": self.settings.max_connections,
+            "http2": self.settings.http2,
+            "connections": len(connections),
+            "in_use": len(connections) - idle,
+            "idle": idle,
+            "requests": self.requests,
+            "waits": self.waits,
+        }
+
+
+def create_openai_http_client(settings: HttpPoolSettings):
+    """
+    AsyncAzureOpenAI の http_client に渡す httpx.AsyncClient を作成
+
+    Returns:
+        (httpx.AsyncClient, PooledAsyncHTTPTransport) のタプル
+    """
+    transport = PooledAsyncHTTPTransport(settings)
+    client = httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(
+            settings.read_timeout,
+            connect=settings.connect_timeout,
+        ),
+    )
+    return client, transport
+
+
+class SearchHttpPool:
+    """
+    SearchClient 用の aiohttp 接続プール
+
+    aiohttp.ClientSession はイベントループ上で作成する必要があるため、
+    get_search_client など非同期関数の中で作成する。
+    """
+
+    def __init__(self, settings: HttpPoolSettings):
+        import aiohttp
+        from azure.core.pipeline.transport import AioHttpTransport
+
+        self.settings = settings
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.waits = 0
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_create)
+        trace_config.on_connection_reuseconn.append(self._on_reuse)
+        trace_config.on_connection_queued_start.append(self._on_queued)
+
+        self.connector = aiohttp.TCPConnector(
+            limit=settings.max_connections,
+            keepalive_timeout=settings.keepalive_expiry,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=self.connector,
+            trace_configs=[trace_config],
+            # azure-core が既定で作成するセッションと同じ設定（プロキシの環境変数を使用し、展開はSDK側で行う）
+            trust_env=True,
+            auto_decompress=False,
+        )
+        # セッションはこのクラスで管理し、SearchClient の close では閉じない
+        self.transport = AioHttpTransport(
+            session=self.session,
+            session_owner=False,
+            connection_timeout=settings.connect_timeout,
+            read_timeout=settings.read_timeout,
+        )
+
+    async def _on_create(self, session, context, params) -> None:
+        self.connections_created += 1
+
+    async def _on_reuse(self, session, context, params) -> None:
+        self.connections_reused += 1
+
+    async def _on_queued(self, session, context, params) -> None:
+        self.waits += 1
+
+    def stats(self) -> dict:
+        # aiohttp は使用中・待機中の接続数を公開していないため、内部の状態から集計する
+        in_use = len(getattr(self.connector, "_acquired", ()))
+        idle = sum(len(conns) for conns in getattr(self.connector, "_conns", {}).values())
+        return {
+            "max_connections": self.settings.max_connections,
+            "connections": in_use + idle,
+            "in_use": in_use,
+            "idle": idle,
+            "created": self.connections_created,
+            "reused": self.connections_reused,
+            "waits": self.waits,
+        }
+
+    async def close(self) -> None:
+        await self.session.close()
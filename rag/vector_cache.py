@@ -0,0 +1,182 @@
+"""
+埋め込みベクトルのディスクキャッシュ（内容のハッシュをキーにしたmmap）
+
+コーパスの埋め込みは、ドキュメントの内容が変わらない限り作り直す必要はありません。
+ここでは埋め込みの入力テキストとモデル名のハッシュをキーに、ベクトルを
+float32 の連続したファイルに追記していきます。変更のないドキュメントはハッシュが
+一致するため再計算されず、埋め込みのコストは変更された件数に比例します。
+
+ディレクトリの構成:
+    meta.json    次元数・件数（件数を超える部分は書き込み途中として無視する）
+    keys.txt     1行に1つのハッシュ（行番号がベクトルの行番号）
+    vectors.f32  float32 のベクトルを行単位で連結したもの（np.memmap で参照）
+
+    cache = VectorCache.open("data/vectors", dimensions=1536)
+    missing = [doc for doc in documents if content_hash(embedding_text(doc), model) not in cache]
+    cache.append(keys, vectors)
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+# キャッシュ形式のバージョン（互換性のない変更時に更新）
+CACHE_FORMAT_VERSION = 1
+
+
+def embedding_text(doc: dict) -> str:
+    """
+    ドキュメントの埋め込みに使う入力テキスト（タイトルと本文）
+    """
+    return f"{doc.get('title', '')}\n{doc.get('content', '')}"
+
+
+def content_hash(text: str, model: str) -> str:
+    """
+    埋め込みのキャッシュキー（モデルを変えた場合は別のキーになる）
+    """
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+
+class VectorCache:
+    """
+    ハッシュ -> ベクトルの追記型キャッシュ
+    """
+
+    def __init__(self, directory: Path, dimensions: int, keys: list):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.keys = keys
+        self._rows = {key: row for row, key in enumerate(keys)}
+        self._vectors = None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    @classmethod
+    def open(cls, directory, dimensions: int = None) -> "VectorCache":
+        """
+        キャッシュを開く（存在しない場合は dimensions を指定して新規作成）
+        """
+        directory = Path(directory)
+        meta_path = directory / "meta.json"
+        if not meta_path.exists():
+            if dimensions is None:
+                raise FileNotFoundError(f"Vector cache not found: {directory}")
+            directory.mkdir(parents=True, exist_ok=True)
+            cache = cls(directory, dimensions, [])
+            cache._write_meta()
+            (directory / "keys.txt").touch()
+            (directory / "vectors.f32").touch()
+            return cache
+
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != CACHE_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported vector cache version: {meta.get('version')} "
+                f"(expected {CACHE_FORMAT_VERSION})"
+            )
+        if dimensions is not None and meta["dimensions"] != dimensions:
+            raise ValueError(f"Vector cache has {meta['dimensions']} dimensions (expected {dimensions})")
+
+        with open(directory / "keys.txt", "r", encoding="utf-8") as f:
+            lines = [line.rstrip("\n") for line in f]
+        cache = cls(directory, meta["dimensions"], lines[:meta["count"]])
+        vector_bytes = (directory / "vectors.f32").stat().st_size
+        if len(lines) != meta["count"] or vector_bytes != meta["count"] * meta["dimensions"] * 4:
+            # 書き込み途中で中断した場合の余分な行を切り捨てる
+            cache._truncate_files()
+        return cache
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """
+        全ベクトル（件数 x 次元数、読み取り専用のmmap）
+        """
+        if self._vectors is None or len(self._vectors) != len(self.keys):
+            if not self.keys:
+                return np.zeros((0, self.dimensions), dtype=np.float32)
+            self._vectors = np.memmap(self.directory / "vectors.f32", dtype=np.float32, mode="r",
+                                      shape=(len(self.keys), self.dimensions))
+        return self._vectors
+
+    def get(self, key: str):
+        """
+        ハッシュに対応するベクトル（存在しない場合は None）
+        """
+        row = self._rows.get(key)
+        return None if row is None else self.vectors[row]
+
+    def append(self, keys: list, vectors) -> None:
+        """
+        ベクトルを追記する（既に存在するキーは追記しない）
+
+        ベクトルとキーを書き込んだ後に meta.json の件数を更新するため、
+        途中で中断しても件数までの内容は整合している。
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimensions:
+            raise ValueError(f"Expected vectors of shape (n, {self.dimensions}), got {vectors.shape}")
+
+        rows = [i for i, key in enumerate(keys) if key not in self._rows]
+        if not rows:
+            return
+        with open(self.directory / "vectors.f32", "ab") as f:
+            f.write(vectors[rows].tobytes())
+        with open(self.directory / "keys.txt", "a", encoding="utf-8") as f:
+            for i in rows:
+                f.write(keys[i] + "\n")
+
+        for i in rows:
+            self._rows[keys[i]] = len(self.keys)
+            self.keys.append(keys[i])
+        self._write_meta()
+
+    def compact(self, keep_keys) -> int:
+        """
+        keep_keys に含まれないベクトル（内容が変わったドキュメントの古いベクトル）を削除する
+
+        Returns:
+            削除した件数
+        """
+        keep_keys = set(keep_keys)
+        keys = [key for key in self.keys if key in keep_keys]
+        removed = len(self.keys) - len(keys)
+        if removed == 0:
+            return 0
+
+        vectors = np.array(self.vectors[[self._rows[key] for key in keys]], dtype=np.float32)
+        self._vectors = None
+        # 書き換え中に中断した場合は空のキャッシュとして扱われる（次回すべて作り直す）
+        self._write_meta(count=0)
+        tmp_path = self.directory / "vectors.f32.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(vectors.tobytes())
+        tmp_path.replace(self.directory / "vectors.f32")
+        with open(self.directory / "keys.txt", "w", encoding="utf-8") as f:
+            f.writelines(key + "\n" for key in keys)
+
+        self.keys = keys
+        self._rows = {key: row for row, key in enumerate(keys)}
+        self._write_meta()
+        return removed
+
+    def _truncate_files(self) -> None:
+        self._vectors = None
+        with open(self.directory / "vectors.f32", "r+b") as f:
+            f.truncate(len(self.keys) * self.dimensions * 4)
+        with open(self.directory / "keys.txt", "w", encoding="utf-8") as f:
+            f.writelines(key + "\n" for key in self.keys)
+
+    def _write_meta(self, count: int = None) -> None:
+        count = len(self.keys) if count is None else count
+        meta = {"version": CACHE_FORMAT_VERSION, "dimensions": self.dimensions, "count": count}
+        tmp_path = self.directory / "meta.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        tmp_path.replace(self.directory / "meta.json")
@@ -0,0 +1,45 @@
+"""
+ローカル検索インデックス作成スクリプト
+redlist-documents.jsonl から文字n-gram + BM25の転置インデックスを作成し、
+LOCAL_SEARCH_INDEX_PATH で指定して Azure AI Search の代わりに使用できるようにする
+
+使い方:
+    python scripts/build-local-index.py [入力JSONL（パック形式も可）] [出力ディレクトリ]
+"""
+import sys
+import time
+from pathlib import Path
+
+# リポジトリルートの rag パッケージを読み込めるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rag.corpus import load_documents
+from rag.local_search import LocalSearchIndex
+
+input_file = Path(sys.argv[1]) if len(sys.argv) > 1 else Path('data/processed/redlist-documents.jsonl')
+output_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else Path('data/local-index')
+
+if not input_file.exists():
+    print(f"❌ 入力ファイルが見つかりません: {input_file}")
+    sys.exit(1)
+
+print(f"読み込み中: {input_file}")
+documents = load_documents(input_file)
+
+start = time.perf_counter()
+index = LocalSearchIndex.from_documents(documents)
+elapsed = time.perf_counter() - start
+print(f"インデックス作成: {len(index)}件 / {len(index.terms)}語 ({elapsed:.2f}秒)")
+
+index.save(output_dir)
+print(f"保存先: {output_dir}")
+
+# 動作確認として検索時間を計測
+index = LocalSearchIndex.load(output_dir)
+query = 'イリオモテヤマネコは絶滅危惧種ですか?'
+start = time.perf_counter()
+results = index.search(query)
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(f"\n検索テスト: {query} ({elapsed_ms:.2f}ms)")
+for result in results:
+    print(f"  {result['score']:.2f} {result['title']}")
@@ -0,0 +1,84 @@
+"""
+コーパスの形式変換スクリプト（JSONL <-> パック形式）
+
+JSONLのコーパスを、mmapで参照できるパック形式（rag/corpus.py）に変換します。
+入力がパック形式の場合はJSONLに戻します（変換の向きは入力ファイルの先頭で判定）。
+
+パック形式のファイルは build-local-index.py / upload-index.py / embed-documents.py /
+tests のスタブ・ベンチマークの入力や、SPECIES_LOOKUP_PATH / LOCAL_SEARCH_INDEX_PATH に指定できます。
+
+使い方:
+    python scripts/convert-corpus.py data/processed/redlist-documents.jsonl
+    python scripts/convert-corpus.py data/processed/redlist-documents.corpus data/processed/roundtrip.jsonl
+    python scripts/convert-corpus.py data/processed/redlist-documents.jsonl --verify
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# リポジトリルートの rag パッケージを読み込めるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rag.corpus import PackedCorpus, is_packed_corpus, iter_documents, load_jsonl, write_corpus
+
+PACKED_SUFFIX = '.corpus'
+
+
+def to_packed(input_path: Path, output_path: Path, verify: bool) -> None:
+    documents = load_jsonl(input_path)
+    start = time.perf_counter()
+    kinds = write_corpus(documents, output_path)
+    elapsed = time.perf_counter() - start
+    print(f"✅ {len(documents)}件をパック形式に変換しました ({elapsed:.2f}秒)")
+    for field, kind in kinds.items():
+        print(f"  {field}: {kind}")
+
+    if verify:
+        with PackedCorpus.open(output_path) as corpus:
+            mismatches = sum(1 for original, packed in zip(documents, corpus) if original != packed)
+            if len(corpus) != len(documents) or mismatches:
+                print(f"❌ 変換結果が一致しません（{mismatches}件）")
+                sys.exit(1)
+        print("  検証: すべてのドキュメントが一致しました")
+
+
+def to_jsonl(input_path: Path, output_path: Path) -> None:
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for document in iter_documents(input_path):
+            f.write(json.dumps(document, ensure_ascii=False) + '\n')
+            count += 1
+    print(f"✅ {count}件をJSONLに変換しました")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='コーパスをJSONLとパック形式の間で変換')
+    parser.add_argument('input', type=Path, help='入力ファイル（JSONL またはパック形式）')
+    parser.add_argument('output', nargs='?', type=Path,
+                        help='出力ファイル（省略時は拡張子を .corpus / .jsonl に変えたパス）')
+    parser.add_argument('--verify', action='store_true', help='変換後に読み直して元のドキュメントと比較')
+    args = parser.parse_args()
+
+    if not args.input.exists():
+        print(f"❌ 入力ファイルが見つかりません: {args.input}")
+        sys.exit(1)
+
+    packed = is_packed_corpus(args.input)
+    output = args.output or args.input.with_suffix('.jsonl' if packed else PACKED_SUFFIX)
+    if output.resolve() == args.input.resolve():
+        print("❌ 入力と出力が同じファイルです")
+        sys.exit(1)
+
+    print(f"Input: {args.input} ({args.input.stat().st_size:,} bytes)")
+    if packed:
+        to_jsonl(args.input, output)
+    else:
+        to_packed(args.input, output, args.verify)
+    print(f"Output: {output} ({output.stat().st_size:,} bytes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,10 @@ param(
     [Parameter(Mandatory=$true)]
     [string]$SearchAdminKey,
     
-    [string]$IndexName = "redlist-index"
+    [string]$IndexName = "redlist-index",
+    
+    # ハイブリッド検索用の埋め込みの次元数（text-embedding-3-small / ada-002 は1536）
+    [int]$VectorDimensions = 1536
 )
 
 $searchEndpoint = "https://$SearchService.search.windows.net"
@@ -78,8 +81,34 @@ $indexSchema = @{
             name = "url"
             type = "Edm.String"
             searchable = $false
+        },
+        @{
+            # scripts/embed-documents.py で作成した埋め込み（検索にのみ使用し、結果には含めない）
+            name = "content_vector"
+            type = "Collection(Edm.Single)"
+            searchable = $true
+            retrievable = $false
+            dimensions = $VectorDimensions
+            vectorSearchProfile = "vector-profile"
         }
     )
+    vectorSearch = @{
+        algorithms = @(
+            @{
+                name = "hnsw-config"
+                kind = "hnsw"
+                hnswParameters = @{
+                    metric = "cosine"
+                }
+            }
+        )
+        profiles = @(
+            @{
+                name = "vector-profile"
+                algorithm = "hnsw-config"
+            }
+        )
+    }
     semantic = @{
         configurations = @(
             @{
@@ -0,0 +1,209 @@
+"""
+コーパス埋め込みスクリプト（ハイブリッド検索用）
+
+redlist-documents.jsonl の各ドキュメント（タイトル + 本文）の埋め込みを Azure OpenAI で作成し、
+content_vector フィールドを加えたJSONLを出力します。出力は upload-index.py でそのまま登録できます。
+
+- 埋め込みは入力テキストとデプロイメント名のハッシュをキーにディスクへキャッシュし、
+  内容が変わっていないドキュメントは再計算しない（2回目以降は変更分だけAPIを呼ぶ）
+- 複数のドキュメントを1リクエストにまとめ、複数リクエストを並列に送信する
+- 429は Retry-After（retry-after-ms）を考慮して再送する
+
+使い方:
+    python scripts/embed-documents.py
+    python scripts/embed-documents.py data/processed/redlist-documents.jsonl --batch-size 16 --concurrency 4
+    python scripts/upload-index.py data/processed/redlist-documents.vectors.jsonl
+
+ローカルのスタブサーバーに対して実行する場合:
+    python tests/stubs/openai_stub.py --port 8082
+    python scripts/embed-documents.py --endpoint http://127.0.0.1:8082 --api-key dummy
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+from openai import AsyncAzureOpenAI, APIConnectionError, InternalServerError, RateLimitError
+
+# リポジトリルートの rag パッケージを読み込めるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rag.corpus import load_documents
+from rag.redlist import repair_document
+from rag.rate_limit import parse_retry_after
+from rag.vector_cache import VectorCache, content_hash, embedding_text
+
+DEFAULT_INPUT = Path('data/processed/redlist-documents.jsonl')
+DEFAULT_OUTPUT = Path('data/processed/redlist-documents.vectors.jsonl')
+DEFAULT_CACHE = Path('data/vectors')
+
+# 埋め込みAPIの1リクエストあたりの入力数の上限
+MAX_BATCH_INPUTS = 2048
+
+
+class EmbedStats:
+    """
+    埋め込みの進捗を集計する
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.cached = 0
+        self.embedded = 0
+        self.requests = 0
+        self.retries = 0
+        self.tokens = 0
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        return (f"キャッシュ {self.cached}件 / 新規 {self.embedded}件 / {self.requests}リクエスト / "
+                f"再送 {self.retries}回 / {self.tokens:,}トークン / {elapsed:.2f}秒")
+
+
+def create_client(args) -> AsyncAzureOpenAI:
+    # 再送はこのスクリプトで制御するため、SDKの自動リトライは無効化する
+    if args.api_key:
+        return AsyncAzureOpenAI(azure_endpoint=args.endpoint, api_key=args.api_key,
+                                api_version='2024-02-01', max_retries=0)
+
+    # キーがない場合はManaged Identity / Azure CLIで認証
+    from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
+    credential = DefaultAzureCredential()
+    token_provider = get_bearer_token_provider(credential, 'https://cognitiveservices.azure.com/.default')
+    return AsyncAzureOpenAI(azure_endpoint=args.endpoint, azure_ad_token_provider=token_provider,
+                            api_version='2024-02-01', max_retries=0)
+
+
+async def embed_batch(client: AsyncAzureOpenAI, texts: list, args, stats: EmbedStats) -> list:
+    """
+    1バッチの埋め込みを取得する（入力と同じ順序のベクトルのリスト）
+    """
+    for attempt in range(args.max_retries + 1):
+        try:
+            response = await client.embeddings.create(model=args.deployment, input=texts)
+        except RateLimitError as e:
+            if attempt == args.max_retries:
+                raise
+            delay = parse_retry_after(e.response.headers, default=args.retry_delay * (2 ** attempt))
+        except (APIConnectionError, InternalServerError):
+            if attempt == args.max_retries:
+                raise
+            delay = args.retry_delay * (2 ** attempt) * (0.5 + random.random())
+        else:
+            stats.requests += 1
+            if response.usage is not None:
+                stats.tokens += response.usage.prompt_tokens
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        stats.retries += 1
+        await asyncio.sleep(delay)
+
+
+async def embed_missing(documents: list, keys: list, cache, args, stats: EmbedStats):
+    """
+    キャッシュにないドキュメントの埋め込みを並列に取得してキャッシュに追記する
+
+    Returns:
+        VectorCache（キャッシュが未作成の場合は最初の応答の次元数で作成する）
+    """
+    missing = {}
+    for doc, key in zip(documents, keys):
+        if cache is not None and key in cache:
+            stats.cached += 1
+        else:
+            # 内容が同じドキュメントは1回だけ埋め込む
+            missing.setdefault(key, embedding_text(doc))
+    if not missing:
+        return cache
+
+    items = list(missing.items())
+    batches = [items[i:i + args.batch_size] for i in range(0, len(items), args.batch_size)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with create_client(args) as client:
+
+        async def run(batch):
+            async with semaphore:
+                return batch, await embed_batch(client, [text for _, text in batch], args, stats)
+
+        # 完了した順にキャッシュへ追記する（中断しても完了分は次回再利用される）
+        for future in asyncio.as_completed([run(batch) for batch in batches]):
+            batch, vectors = await future
+            if cache is None:
+                cache = VectorCache.open(args.cache, dimensions=len(vectors[0]))
+            cache.append([key for key, _ in batch], vectors)
+            stats.embedded += len(batch)
+            if stats.requests % 20 == 0:
+                print(f"  {stats.report()}")
+
+    return cache
+
+
+def write_output(documents: list, keys: list, cache: VectorCache, path: Path) -> None:
+    """
+    content_vector を加えたドキュメントをJSONLに書き出す
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for doc, key in zip(documents, keys):
+            vector = [round(value, 7) for value in cache.get(key).tolist()]
+            f.write(json.dumps(dict(doc, content_vector=vector), ensure_ascii=False) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='コーパスの埋め込みを作成してcontent_vectorを付与')
+    parser.add_argument('input', nargs='?', type=Path, default=DEFAULT_INPUT, help='入力JSONL（パック形式も可）')
+    parser.add_argument('--output', type=Path, default=DEFAULT_OUTPUT, help='出力JSONL')
+    parser.add_argument('--cache', type=Path, default=DEFAULT_CACHE, help='埋め込みキャッシュのディレクトリ')
+    parser.add_argument('--endpoint', default=os.getenv('AZURE_OPENAI_ENDPOINT'))
+    parser.add_argument('--api-key', default=os.getenv('AZURE_OPENAI_API_KEY'))
+    parser.add_argument('--deployment',
+                        default=os.getenv('AZURE_OPENAI_EMBEDDING_DEPLOYMENT', 'text-embedding-3-small'))
+    parser.add_argument('--batch-size', type=int, default=16, help='1リクエストあたりのドキュメント数')
+    parser.add_argument('--concurrency', type=int, default=4, help='並列に送信するリクエスト数')
+    parser.add_argument('--max-retries', type=int, default=5)
+    parser.add_argument('--retry-delay', type=float, default=1.0, help='バックオフの基準秒数')
+    parser.add_argument('--compact', action='store_true',
+                        help='入力に含まれないドキュメント（内容の変わった古い版）のベクトルをキャッシュから削除')
+    args = parser.parse_args()
+
+    args.batch_size = max(1, min(args.batch_size, MAX_BATCH_INPUTS))
+    args.concurrency = max(1, args.concurrency)
+
+    if not args.endpoint:
+        print("❌ AZURE_OPENAI_ENDPOINT environment variable not set")
+        sys.exit(1)
+    if not args.input.exists():
+        print(f"❌ 入力ファイルが見つかりません: {args.input}")
+        sys.exit(1)
+
+    print(f"Endpoint: {args.endpoint}")
+    print(f"Deployment: {args.deployment}")
+    print(f"Input: {args.input}")
+
+    # フィールドのずれたドキュメント（以前の prepare-redlist-data.py の出力）は本来の形で埋め込み・出力する
+    documents = [repair_document(doc) for doc in load_documents(args.input)]
+    keys = [content_hash(embedding_text(doc), args.deployment) for doc in documents]
+    cache = VectorCache.open(args.cache) if (args.cache / 'meta.json').exists() else None
+
+    stats = EmbedStats()
+    cache = asyncio.run(embed_missing(documents, keys, cache, args, stats))
+    print(f"\n✅ {stats.report()}")
+    if cache is None:
+        print("入力にドキュメントがありません")
+        return
+
+    if args.compact:
+        removed = cache.compact(keys)
+        print(f"キャッシュから削除: {removed}件")
+
+    write_output(documents, keys, cache, args.output)
+    print(f"キャッシュ: {args.cache} ({len(cache)}件 / {cache.dimensions}次元)")
+    print(f"出力: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
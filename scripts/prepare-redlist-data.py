@@ -1,12 +1,53 @@
-import pandas as pd
+"""
+レッドリストCSVをインデックス用のJSON Linesに変換するスクリプト
+
+- 列単位（pandas）で文字列を組み立て、行ごとのループ処理を避ける
+- カテゴリごとのCSVをプロセスプールで並列に処理する
+- CSVはチャンク単位で読み込み、JSONLへ逐次書き出すことでメモリ使用量を抑える
+- CSVとドキュメントのハッシュをマニフェストに記録し、変更されたCSVだけを再処理する
+- 前回との差分（追加・変更・削除）を delta JSONL として出力する
+
+ドキュメントのidはカテゴリと種を表す列から決まるため、CSVの行が増減しても
+他のドキュメントのidは変わりません。以前のスクリプトはidに連番（"1", "2", ...）を
+使っていたため、マニフェストがない初回の実行では、連番のidの削除も差分に出力します
+（差分を反映しないと、インデックスに同じ種が以前のidと新しいidで2件ずつ残るため）。
+削除する連番の範囲は、上書きする前の全件のJSONL（以前のスクリプトの出力）の最大のidか、
+--legacy-ids で指定した値です。どちらもない場合は推測せず、警告だけを表示します。
+
+使い方:
+    python scripts/prepare-redlist-data.py [--workers N] [--chunksize N] [--full] [--legacy-ids N] [--benchmark]
+"""
+import argparse
+import hashlib
 import json
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import pandas as pd
+
+# リポジトリルートの rag パッケージを読み込めるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rag.redlist import format_content, format_title, normalize_rank
+
 # 入力・出力ディレクトリ
 input_dir = Path('data/raw')
 output_dir = Path('data/processed')
-output_dir.mkdir(parents=True, exist_ok=True)
+output_file = output_dir / 'redlist-documents.jsonl'
+delta_file = output_dir / 'redlist-documents.delta.jsonl'
+manifest_file = output_dir / 'manifest.json'
+# CSVごとの処理結果（次回以降、変更のないCSVはこれを再利用する）
+parts_dir = output_dir / '.parts'
+
+MANIFEST_VERSION = 1
+
+# ドキュメントの組み立て方の版（変わった場合は、CSVに変更がなくてもすべて再処理して差分に出力する）
+# 2: CSVの列を「カテゴリー, 分類群, 和名, 学名」として読むよう修正
+# 3: rank の表記を RANK_LABELS にそろえる（末尾の空白・半角の括弧の揺れをなくす）
+DOCUMENT_FORMAT = 3
 
 # カテゴリマッピング
 category_names = {
@@ -21,80 +62,348 @@ category_names = {
     'redList2012_ikansoku.csv': '維管束植物',
 }
 
-all_documents = []
-doc_id = 1
+SOURCE_URL = 'https://data.e-gov.go.jp/data/dataset/env_20140904_0456'
+
+# ドキュメントのフィールド順
+DOCUMENT_FIELDS = ['id', 'title', 'content', 'category', 'rank', 'url',
+                   'scientific_name', 'japanese_name', 'family']
+
+# idの元にする列（カテゴリに加えて種を一意に表す和名・学名）
+ID_KEY_FIELDS = ['category', 'japanese_name', 'scientific_name']
+
+
+def make_document_id(key: str, occurrence: int) -> str:
+    """
+    キー文字列から安定したドキュメントidを生成
+
+    AI Searchのキーに使える英数字のみで構成する。同じキーの行が
+    同一ファイル内に複数ある場合は出現順の番号で区別する。
+    """
+    if occurrence > 1:
+        key = f"{key}\x1f{occurrence}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
 
-for filename, category in category_names.items():
+
+def hash_file(path: Path) -> str:
+    """
+    ファイル内容のSHA-256を計算
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def column_as_str(df: pd.DataFrame, position: int) -> pd.Series:
+    """
+    位置指定で列を文字列として取り出す（列がない・欠損値の場合は空文字）
+    """
+    if df.shape[1] <= position:
+        return pd.Series('', index=df.index)
+    return df.iloc[:, position].fillna('').astype(str)
+
+
+def build_documents(df: pd.DataFrame, category: str) -> pd.DataFrame:
+    """
+    CSVの1チャンクからドキュメントの列を組み立てる（列単位の文字列連結）
+    """
+    # e-GovのCSVの列は「カテゴリー, 分類群, 和名, 学名」の順
+    # （分類群は family に格納する。昆虫類などでは目名になる）
+    # カテゴリーは表記の揺れ（末尾の空白・半角の括弧）をそろえる（filter / facets は完全一致のため）
+    rank = column_as_str(df, 0).map(normalize_rank)
+    family = column_as_str(df, 1).str.strip()
+    japanese_name = column_as_str(df, 2).str.strip()
+    scientific_name = column_as_str(df, 3).str.strip()
+
+    # タイトルとコンテンツを構築
+    title = format_title(japanese_name, rank)
+    content = format_content(category, japanese_name, scientific_name, rank, family)
+
+    return pd.DataFrame({
+        'id': '',
+        'title': title,
+        'content': content,
+        'category': category,
+        'rank': rank,
+        'url': SOURCE_URL,
+        'scientific_name': scientific_name,
+        'japanese_name': japanese_name,
+        'family': family,
+    }, columns=DOCUMENT_FIELDS)
+
+
+def process_file(filename: str, category: str, part_path: str, chunksize: int) -> dict:
+    """
+    1つのCSVを処理し、ドキュメントをパートファイルへ書き出す（ワーカープロセスで実行）
+
+    Returns:
+        処理結果（件数・所要時間・列名・エラー・ドキュメントごとのハッシュ）
+    """
     file_path = input_dir / filename
-    
-    if not file_path.exists():
-        print(f"⚠️  ファイルが見つかりません: {filename}")
-        continue
-    
-    print(f"処理中: {category} ({filename})")
-    
+    result = {'filename': filename, 'category': category, 'part_path': part_path,
+              'rows': 0, 'seconds': 0.0, 'columns': None, 'error': None, 'documents': {}}
+
+    start = time.perf_counter()
     try:
-        # CP932(Windows-31J)で読み込み
-        df = pd.read_csv(file_path, encoding='cp932')
-        
-        # 列名を確認(ファイルによって異なる場合がある)
-        print(f"  列: {df.columns.tolist()}")
-        
-        # 各行をドキュメント化
-        for idx, row in df.iterrows():
-            # CSVの列構造に応じて調整
-            scientific_name = row.iloc[0] if len(row) > 0 else ""
-            japanese_name = row.iloc[1] if len(row) > 1 else ""
-            rank = row.iloc[2] if len(row) > 2 else ""
-            family = row.iloc[3] if len(row) > 3 else ""
-            
-            # タイトルとコンテンツを構築
-            title = f"{japanese_name} ({scientific_name})"
-            content = f"""
-分類: {category}
-和名: {japanese_name}
-学名: {scientific_name}
-絶滅危惧ランク: {rank}
-科名: {family}
-
-この種は環境省のレッドリスト(第4次)において{rank}に分類されています。
-""".strip()
-            
-            # JSONドキュメント作成
-            document = {
-                'id': str(doc_id),
-                'title': title,
-                'content': content,
-                'category': category,
-                'rank': rank,
-                'url': 'https://data.e-gov.go.jp/data/dataset/env_20140904_0456',
-                'scientific_name': scientific_name,
-                'japanese_name': japanese_name,
-                'family': family
-            }
-            
-            all_documents.append(document)
-            doc_id += 1
-    
+        occurrences = {}
+        with open(part_path, 'w', encoding='utf-8') as out:
+            # CP932(Windows-31J)でチャンクごとに読み込み
+            for chunk in pd.read_csv(file_path, encoding='cp932', chunksize=chunksize):
+                if result['columns'] is None:
+                    result['columns'] = chunk.columns.tolist()
+
+                documents = build_documents(chunk, category)
+                keys = documents[ID_KEY_FIELDS[0]].str.cat(
+                    [documents[field] for field in ID_KEY_FIELDS[1:]], sep='\x1f'
+                )
+
+                lines = []
+                for key, values in zip(keys, documents.itertuples(index=False, name=None)):
+                    occurrences[key] = occurrences.get(key, 0) + 1
+                    doc_id = make_document_id(key, occurrences[key])
+                    line = json.dumps(dict(zip(DOCUMENT_FIELDS, (doc_id,) + values[1:])),
+                                      ensure_ascii=False)
+                    result['documents'][doc_id] = hashlib.sha256(line.encode('utf-8')).hexdigest()[:16]
+                    lines.append(line)
+
+                if lines:
+                    out.write('\n'.join(lines) + '\n')
+                result['rows'] += len(lines)
     except Exception as e:
-        print(f"  ✗ エラー: {e}")
+        result['error'] = str(e)
 
-print(f"\n処理完了: {len(all_documents)}件のドキュメント")
+    result['seconds'] = time.perf_counter() - start
+    return result
 
-# JSON Lines形式で保存
-output_file = output_dir / 'redlist-documents.jsonl'
-with open(output_file, 'w', encoding='utf-8') as f:
-    for doc in all_documents:
-        f.write(json.dumps(doc, ensure_ascii=False) + '\n')
 
-print(f"保存先: {output_file}")
+def load_manifest() -> dict:
+    """
+    前回実行時のマニフェストを読み込む（存在しない場合は空）
+    """
+    if not manifest_file.exists():
+        return {'version': MANIFEST_VERSION, 'files': {}}
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        print("⚠️  マニフェストの形式が異なるため、すべてのCSVを再処理します")
+        return {'version': MANIFEST_VERSION, 'files': {}}
+    return manifest
+
+
+def merge_parts(filenames: list) -> int:
+    """
+    パートファイルをカテゴリ順に結合して全件のJSONLを書き出す
+    """
+    total = 0
+    with open(output_file, 'w', encoding='utf-8') as out:
+        for filename in filenames:
+            with open(parts_dir / f'{filename}.jsonl', 'r', encoding='utf-8') as part:
+                for line in part:
+                    out.write(line)
+                    total += 1
+    return total
+
+
+def find_legacy_ids(path: Path) -> int:
+    """
+    以前のスクリプトが出力したJSONLの連番のidの最大値（ファイルがない・連番のidがない場合は0）
+    """
+    if not path.exists():
+        return 0
+    legacy_ids = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            doc_id = str(json.loads(line).get('id', ''))
+            if doc_id.isdigit():
+                legacy_ids = max(legacy_ids, int(doc_id))
+    return legacy_ids
+
+
+def write_delta(old_files: dict, new_files: dict, legacy_ids: int = 0) -> dict:
+    """
+    前回と今回のドキュメントハッシュを比較し、差分をJSONLで書き出す
+
+    AI Searchのバッチ形式に合わせ、追加・変更は "@search.action": "mergeOrUpload"、
+    削除は "@search.action": "delete" として出力する。legacy_ids を指定した場合は、
+    以前のスクリプトの連番のid（"1" から legacy_ids まで）の削除も出力する
+    （存在しないidの削除はAI Searchではエラーにならない）。
+    """
+    counts = {'added': 0, 'modified': 0, 'deleted': 0, 'legacy_deleted': 0}
+
+    with open(delta_file, 'w', encoding='utf-8') as out:
+        for filename in sorted(set(old_files) | set(new_files)):
+            old_docs = old_files.get(filename, {}).get('documents', {})
+            new_docs = new_files.get(filename, {}).get('documents', {})
+            if old_docs == new_docs:
+                continue
+
+            changed = set()
+            for doc_id, doc_hash in new_docs.items():
+                if doc_id not in old_docs:
+                    counts['added'] += 1
+                    changed.add(doc_id)
+                elif old_docs[doc_id] != doc_hash:
+                    counts['modified'] += 1
+                    changed.add(doc_id)
+
+            if changed:
+                with open(parts_dir / f'{filename}.jsonl', 'r', encoding='utf-8') as part:
+                    for line in part:
+                        document = json.loads(line)
+                        if document['id'] in changed:
+                            document['@search.action'] = 'mergeOrUpload'
+                            out.write(json.dumps(document, ensure_ascii=False) + '\n')
+
+            for doc_id in old_docs:
+                if doc_id not in new_docs:
+                    counts['deleted'] += 1
+                    out.write(json.dumps({'@search.action': 'delete', 'id': doc_id}) + '\n')
+
+        for doc_id in range(1, legacy_ids + 1):
+            counts['legacy_deleted'] += 1
+            out.write(json.dumps({'@search.action': 'delete', 'id': str(doc_id)}) + '\n')
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='レッドリストCSVをJSON Linesに変換')
+    parser.add_argument('--workers', type=int, default=min(len(category_names), os.cpu_count() or 1),
+                        help='並列処理するプロセス数')
+    parser.add_argument('--chunksize', type=int, default=5000,
+                        help='CSVを読み込む行数の単位')
+    parser.add_argument('--full', action='store_true',
+                        help='マニフェストを無視してすべてのCSVを再処理')
+    parser.add_argument('--legacy-ids', type=int, default=None,
+                        help='マニフェストがない場合に削除を出力する連番のidの最大値'
+                             '（既定: 上書きする前の全件のJSONLの最大のid。0で出力しない）')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='ファイルごとの処理速度（rows/sec）を表示')
+    args = parser.parse_args()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    total_start = time.perf_counter()
+
+    # マニフェストがない場合、インデックスには以前のスクリプトの連番のidが登録されている可能性がある
+    # （範囲は全件のJSONLを上書きする前に、以前の出力から求める）
+    legacy_index = not manifest_file.exists()
+    legacy_ids = 0
+    if legacy_index:
+        legacy_ids = find_legacy_ids(output_file) if args.legacy_ids is None else max(0, args.legacy_ids)
+    manifest = load_manifest()
+    old_files = manifest['files']
+    new_files = {}
+
+    reprocess = args.full
+    if old_files and manifest.get('document_format', 1) != DOCUMENT_FORMAT:
+        print("⚠️  ドキュメントの形式が変わったため、すべてのCSVを再処理します（変更は差分に出力されます）")
+        reprocess = True
+
+    targets = []
+    for filename, category in category_names.items():
+        file_path = input_dir / filename
+        if not file_path.exists():
+            print(f"⚠️  ファイルが見つかりません: {filename}")
+            if filename in old_files:
+                print("    前回のドキュメントは削除対象として差分に出力されます")
+            continue
+
+        file_hash = hash_file(file_path)
+        previous = old_files.get(filename)
+        if (not reprocess and previous is not None and previous.get('sha256') == file_hash
+                and (parts_dir / f'{filename}.jsonl').exists()):
+            print(f"変更なし: {category} ({filename})")
+            new_files[filename] = previous
+            continue
+
+        targets.append((filename, category, file_hash))
+
+    unchanged = len(new_files)
+
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = [
+            executor.submit(process_file, filename, category,
+                            str(parts_dir / f'{filename}.jsonl.tmp'), args.chunksize)
+            for filename, category, _ in targets
+        ]
+        # 出力順を安定させるため、投入順（カテゴリ順）に結果を受け取る
+        results = [future.result() for future in futures]
+
+    for (filename, category, file_hash), result in zip(targets, results):
+        print(f"処理中: {category} ({filename})")
+        if result['error'] is not None:
+            print(f"  ✗ エラー: {result['error']}")
+            if os.path.exists(result['part_path']):
+                os.remove(result['part_path'])
+            # 処理に失敗したCSVは前回の結果を維持する（誤って削除扱いにしない）
+            if filename in old_files and (parts_dir / f'{filename}.jsonl').exists():
+                new_files[filename] = old_files[filename]
+            continue
+
+        print(f"  列: {result['columns']}")
+        os.replace(result['part_path'], parts_dir / f'{filename}.jsonl')
+        new_files[filename] = {
+            'category': category,
+            'sha256': file_hash,
+            'documents': result['documents'],
+        }
+
+    # CSVが削除された場合は、そのパートファイルも不要になる
+    for filename in set(old_files) - set(new_files):
+        stale_part = parts_dir / f'{filename}.jsonl'
+        if stale_part.exists():
+            stale_part.unlink()
+
+    # JSON Lines形式で保存（全件と差分）
+    ordered = [filename for filename in category_names if filename in new_files]
+    total = merge_parts(ordered)
+    delta_counts = write_delta(old_files, new_files, legacy_ids)
+
+    manifest = {'version': MANIFEST_VERSION, 'document_format': DOCUMENT_FORMAT,
+                'files': {filename: new_files[filename] for filename in ordered}}
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    print(f"\n処理完了: {total}件のドキュメント（再処理 {len(targets)}ファイル / 変更なし {unchanged}ファイル）")
+    print(f"保存先: {output_file}")
+    print(f"差分: 追加 {delta_counts['added']}件 / 変更 {delta_counts['modified']}件 / "
+          f"削除 {delta_counts['deleted'] + delta_counts['legacy_deleted']}件 ({delta_file})")
+    if delta_counts['legacy_deleted']:
+        print(f"\n⚠️  マニフェストがないため、以前のスクリプトの連番のid（1〜{legacy_ids}）の削除を差分に出力しました。")
+        print("    以前のデータを登録したインデックスには、差分を反映してください（以前のidのドキュメントが削除されます）:")
+        print("      python scripts/upload-index.py --delta")
+        print("    全件のアップロードやインデクサーで登録する場合は、以前のドキュメントが残り同じ種が2件ずつになるため、")
+        print("    インデックスを作り直してから登録してください。")
+    elif legacy_index and args.legacy_ids is None:
+        print(f"\n⚠️  マニフェストと以前の出力（{output_file}）に連番のidがないため、以前のidの削除は差分に出力していません。")
+        print("    以前のスクリプトで作成したデータを登録したインデックスに反映する場合は、インデックスのドキュメント数")
+        print("    （連番のidの最大値）を --legacy-ids で指定して実行し直すか、インデックスを作り直してから登録してください。")
+
+    # サマリー表示
+    print("\nカテゴリ別件数:")
+    category_counts = {}
+    for entry in new_files.values():
+        category_counts[entry['category']] = category_counts.get(entry['category'], 0) + len(entry['documents'])
+
+    for cat, count in sorted(category_counts.items()):
+        print(f"  {cat}: {count}件")
+
+    if args.benchmark:
+        total_seconds = time.perf_counter() - total_start
+        print(f"\nベンチマーク (workers={args.workers}, chunksize={args.chunksize}):")
+        for result in results:
+            rate = result['rows'] / result['seconds'] if result['seconds'] > 0 else 0.0
+            print(f"  {result['filename']:<36} {result['rows']:>7}行 "
+                  f"{result['seconds']:>7.3f}秒 {rate:>12,.0f} rows/sec")
+        processed = sum(result['rows'] for result in results)
+        overall = processed / total_seconds if total_seconds > 0 else 0.0
+        print(f"  {'合計 (結合・書き出しを含む)':<30} {processed:>7}行 "
+              f"{total_seconds:>7.3f}秒 {overall:>12,.0f} rows/sec")
 
-# サマリー表示
-print("\nカテゴリ別件数:")
-category_counts = {}
-for doc in all_documents:
-    cat = doc['category']
-    category_counts[cat] = category_counts.get(cat, 0) + 1
 
-for cat, count in sorted(category_counts.items()):
-    print(f"  {cat}: {count}件")
+if __name__ == '__main__':
+    main()
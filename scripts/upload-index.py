@@ -0,0 +1,302 @@
+"""
+AI Searchインデックス一括アップロードスクリプト
+
+redlist-documents.jsonl（または差分の redlist-documents.delta.jsonl）を逐次読み込み、
+azure.search.documents.aio の SearchClient で redlist-index に直接登録します。
+
+- 件数とペイロードサイズの両方でバッチを区切る
+- 複数バッチを非同期に並列送信する
+- スロットリング（429/503）は Retry-After を考慮した指数バックオフで再送する
+- 差分ファイルの "@search.action"（mergeOrUpload / delete など）に従う
+- 入力はJSONLのほか、パック形式のコーパス（scripts/convert-corpus.py で作成）も指定できる
+- 以前の prepare-redlist-data.py が出力したフィールドのずれたドキュメントは、本来の形に戻して登録する
+  （rag/redlist.py。id は変わらないため、登録済みのインデックスに再度アップロードすると上書きで修正される）
+
+使い方:
+    python scripts/upload-index.py                      # 全件をアップロード
+    python scripts/upload-index.py --delta              # 差分のみをアップロード
+    python scripts/upload-index.py data/processed/redlist-documents.jsonl --concurrency 8
+
+ローカルのスタブサーバーに対して実行する場合:
+    python tests/stubs/search_stub.py --port 8081
+    python scripts/upload-index.py --endpoint http://127.0.0.1:8081 --key dummy
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
+from azure.search.documents import IndexDocumentsBatch
+from azure.search.documents.aio import SearchClient
+
+# リポジトリルートの rag パッケージを読み込めるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rag.corpus import is_packed_corpus, iter_documents
+from rag.redlist import repair_document
+
+DEFAULT_INPUT = Path('data/processed/redlist-documents.jsonl')
+DEFAULT_DELTA = Path('data/processed/redlist-documents.delta.jsonl')
+
+# AI Searchの1リクエストあたりの上限は1000件・16MB
+MAX_BATCH_DOCUMENTS = 1000
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+# 再送対象のステータスコード（スロットリング・一時的な障害）
+RETRYABLE_STATUS_CODES = {409, 422, 429, 503}
+
+# "@search.action" の値と IndexDocumentsBatch のメソッドの対応
+ACTION_METHODS = {
+    'upload': 'add_upload_actions',
+    'merge': 'add_merge_actions',
+    'mergeOrUpload': 'add_merge_or_upload_actions',
+    'delete': 'add_delete_actions',
+}
+
+
+class UploadStats:
+    """
+    アップロードの進捗を集計する
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.batches = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.repaired = 0
+        self.failed_keys = []
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        rate = self.succeeded / elapsed if elapsed > 0 else 0.0
+        return (f"{self.succeeded}件成功 / {self.failed}件失敗 / {self.batches}バッチ / "
+                f"再送 {self.retries}回 / {elapsed:.2f}秒 ({rate:,.0f} docs/sec)")
+
+
+def read_documents(path: Path):
+    """
+    JSONL（またはパック形式）を逐次読み込む
+
+    Yields:
+        (document, JSONでのバイト数)
+    """
+    if is_packed_corpus(path):
+        for document in iter_documents(path):
+            yield document, len(json.dumps(document, ensure_ascii=False).encode('utf-8'))
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line), len(line.encode('utf-8'))
+
+
+def read_batches(path: Path, max_documents: int, max_bytes: int, stats: UploadStats = None):
+    """
+    ドキュメントを逐次読み込み、件数とバイト数の上限で区切ったバッチを返す
+
+    Yields:
+        (action, document) のリスト
+    """
+    batch = []
+    batch_bytes = 0
+    for document, size in read_documents(path):
+        action = document.pop('@search.action', 'mergeOrUpload')
+        if action not in ACTION_METHODS:
+            raise ValueError(f"Unsupported @search.action: {action}")
+
+        if action != 'delete':
+            repaired = repair_document(document)
+            if repaired is not document:
+                document = repaired
+                size = len(json.dumps(document, ensure_ascii=False).encode('utf-8'))
+                if stats is not None:
+                    stats.repaired += 1
+
+        if batch and (len(batch) >= max_documents or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+
+        batch.append((action, document))
+        batch_bytes += size
+
+    if batch:
+        yield batch
+
+
+def build_index_batch(actions: list) -> IndexDocumentsBatch:
+    """
+    (action, document) のリストから IndexDocumentsBatch を作成
+    """
+    index_batch = IndexDocumentsBatch()
+    for action, document in actions:
+        getattr(index_batch, ACTION_METHODS[action])([document])
+    return index_batch
+
+
+def retry_delay(attempt: int, base_delay: float, error: HttpResponseError = None) -> float:
+    """
+    再送までの待機時間（Retry-Afterがあれば優先し、なければ指数バックオフ + ジッター）
+    """
+    if error is not None and error.response is not None:
+        retry_after = error.response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return base_delay * (2 ** attempt) * (0.5 + random.random())
+
+
+async def upload_batch(client: SearchClient, actions: list, stats: UploadStats,
+                       max_retries: int, base_delay: float) -> None:
+    """
+    1バッチを送信し、スロットリングされたドキュメントだけを再送する
+    """
+    pending = actions
+    for attempt in range(max_retries + 1):
+        error = None
+        try:
+            results = await client.index_documents(build_index_batch(pending))
+        except HttpResponseError as e:
+            if e.status_code not in RETRYABLE_STATUS_CODES:
+                raise
+            error = e
+            retry = pending
+        else:
+            retry = []
+            keys = {result.key: result for result in results}
+            for action, document in pending:
+                result = keys.get(str(document.get('id')))
+                if result is None or result.succeeded:
+                    stats.succeeded += 1
+                elif result.status_code in RETRYABLE_STATUS_CODES:
+                    retry.append((action, document))
+                else:
+                    stats.failed += 1
+                    stats.failed_keys.append((result.key, result.error_message))
+
+        if not retry:
+            return
+
+        if attempt == max_retries:
+            break
+
+        stats.retries += 1
+        pending = retry
+        await asyncio.sleep(retry_delay(attempt, base_delay, error))
+
+    stats.failed += len(pending)
+    stats.failed_keys.extend((str(document.get('id')), 'retry limit exceeded') for _, document in pending)
+
+
+async def upload(args) -> UploadStats:
+    """
+    バッチを並列に送信する（読み込みは送信に合わせて逐次行い、メモリ使用量を抑える）
+    """
+    stats = UploadStats()
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)
+
+    # キーがない場合はManaged Identity / Azure CLIで認証
+    if args.key:
+        credential = AzureKeyCredential(args.key)
+    else:
+        from azure.identity.aio import DefaultAzureCredential
+        credential = DefaultAzureCredential()
+
+    # 再送はこのスクリプトで制御するため、SDKの自動リトライは無効化する
+    async with SearchClient(endpoint=args.endpoint, index_name=args.index,
+                            credential=credential, retry_total=0) as client:
+
+        async def worker():
+            while True:
+                actions = await queue.get()
+                try:
+                    if actions is None:
+                        return
+                    await upload_batch(client, actions, stats, args.max_retries, args.retry_delay)
+                except Exception as e:
+                    # 再送対象外のエラーはバッチ全体を失敗として記録し、残りの送信は継続する
+                    print(f"  ✗ バッチ送信エラー: {e}")
+                    stats.failed += len(actions)
+                    stats.failed_keys.extend((str(document.get('id')), str(e)) for _, document in actions)
+                else:
+                    stats.batches += 1
+                    if stats.batches % 10 == 0:
+                        print(f"  {stats.report()}")
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+        try:
+            for actions in read_batches(args.input, args.batch_size, args.max_bytes, stats):
+                await queue.put(actions)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    if not args.key:
+        await credential.close()
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSONLをAI Searchインデックスに一括アップロード')
+    parser.add_argument('input', nargs='?', type=Path, help='入力JSONL（既定: 全件のJSONL）')
+    parser.add_argument('--delta', action='store_true',
+                        help=f'差分ファイル（{DEFAULT_DELTA}）をアップロード')
+    parser.add_argument('--endpoint', default=os.getenv('AZURE_SEARCH_ENDPOINT'))
+    parser.add_argument('--index', default=os.getenv('AZURE_SEARCH_INDEX', 'redlist-index'))
+    parser.add_argument('--key', default=os.getenv('AZURE_SEARCH_KEY'))
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_DOCUMENTS,
+                        help='1バッチあたりの最大件数')
+    parser.add_argument('--max-bytes', type=int, default=4 * 1024 * 1024,
+                        help='1バッチあたりの最大バイト数')
+    parser.add_argument('--concurrency', type=int, default=4, help='並列に送信するバッチ数')
+    parser.add_argument('--max-retries', type=int, default=5)
+    parser.add_argument('--retry-delay', type=float, default=1.0, help='バックオフの基準秒数')
+    args = parser.parse_args()
+
+    if args.input is None:
+        args.input = DEFAULT_DELTA if args.delta else DEFAULT_INPUT
+    args.batch_size = max(1, min(args.batch_size, MAX_BATCH_DOCUMENTS))
+    args.max_bytes = max(1, min(args.max_bytes, MAX_BATCH_BYTES))
+    args.concurrency = max(1, args.concurrency)
+
+    if not args.endpoint:
+        print("❌ AZURE_SEARCH_ENDPOINT environment variable not set")
+        sys.exit(1)
+    if not args.input.exists():
+        print(f"❌ 入力ファイルが見つかりません: {args.input}")
+        sys.exit(1)
+
+    print(f"Endpoint: {args.endpoint}")
+    print(f"Index: {args.index}")
+    print(f"Input: {args.input}")
+
+    stats = asyncio.run(upload(args))
+
+    print(f"\n{'✅' if stats.failed == 0 else '⚠️ '} {stats.report()}")
+    if stats.repaired:
+        print(f"  フィールドのずれたドキュメントを修正して登録しました: {stats.repaired}件")
+    for key, message in stats.failed_keys[:10]:
+        print(f"  ✗ {key}: {message}")
+    if stats.failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,642 @@
+"""
+チャットAPI 負荷試験・ベンチマーク
+
+/api/chat に対して指定した並列数（クローズドループ）または到着レート（オープンループ）で
+リクエストを送信し、スループットと段階別（search / completion など）の p50 / p95 / p99 を集計します。
+結果はJSONで保存し、コミット間で比較して性能の劣化を検出できます。
+
+実行モード:
+- inprocess: function_app の chat を同一プロセス内で直接呼び出す。
+             Azure OpenAI / AI Search はスタブ（tests/stubs）を起動して置き換えるため、ネットワーク不要
+- http:      起動済みの Functions ホスト（func start）の /api/chat に送信する。
+             段階別の時間は Server-Timing ヘッダー（SERVER_TIMING_ENABLED=true）から取得する
+
+--jobs を指定した場合は /api/chat/jobs でジョブとして送信し、結果が出るまで状態を参照します。
+受け付け（202）までの時間を accept、キューで待った時間を queue、結果の取得までを client として集計します。
+
+使い方（リポジトリルートで実行）:
+    python tests/benchmark-chat.py --concurrency 8 --requests 200 --output bench/current.json
+    python tests/benchmark-chat.py --rate 20 --duration 30 --stream
+    python tests/benchmark-chat.py --baseline bench/base.json --output bench/current.json
+    python tests/benchmark-chat.py --mode http --url http://localhost:7071 --concurrency 4
+    python tests/benchmark-chat.py --rate 50 --requests 300 --unique-questions --jobs
+    python tests/benchmark-chat.py --load-results bench/current.json --baseline bench/base.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'tests' / 'stubs'))
+
+RESULT_FORMAT_VERSION = 1
+
+DEFAULT_QUESTIONS = ROOT / 'tests' / 'test-cases.json'
+DEFAULT_CORPORA = (
+    ROOT / 'data' / 'processed' / 'redlist-documents.jsonl',
+    ROOT / 'data' / 'processed' / 'sample-documents.jsonl',
+)
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """
+    線形補間によるパーセンタイル（sorted_values は昇順）
+    """
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def summarize(values: list) -> dict:
+    """
+    ミリ秒の値の一覧を集計
+    """
+    values = sorted(values)
+    summary = {'count': len(values)}
+    if values:
+        summary['mean'] = round(sum(values) / len(values), 2)
+        for p in PERCENTILES:
+            summary[f'p{p}'] = round(percentile(values, p), 2)
+        summary['max'] = round(values[-1], 2)
+    return summary
+
+
+def parse_server_timing(header: str) -> dict:
+    """
+    Server-Timing ヘッダー（"search;dur=12.3, total;dur=45.6"）を {段階: ミリ秒} に変換
+    """
+    stages = {}
+    for entry in (header or '').split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if name and key == 'dur':
+                try:
+                    stages[name] = float(value)
+                except ValueError:
+                    pass
+    return stages
+
+
+class BenchmarkResults:
+    """
+    リクエストごとの計測値を集める
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.status_codes = {}
+        self.cache = {}
+        self.errors = 0
+        self.error_samples = []
+        self.started = None
+        self.finished = None
+
+    def record(self, status: int, client_ms: float, stages: dict = None,
+               cache: str = None, error: str = None) -> None:
+        self.status_codes[str(status)] = self.status_codes.get(str(status), 0) + 1
+        if cache:
+            self.cache[cache] = self.cache.get(cache, 0) + 1
+        if error is not None or status >= 400:
+            self.errors += 1
+            if len(self.error_samples) < 5:
+                self.error_samples.append(error or f'HTTP {status}')
+            return
+        self.latencies.setdefault('client', []).append(client_ms)
+        for stage, ms in (stages or {}).items():
+            self.latencies.setdefault(stage, []).append(ms)
+
+    def to_dict(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        completed = len(self.latencies.get('client', []))
+        return {
+            'requests': completed + self.errors,
+            'succeeded': completed,
+            'errors': self.errors,
+            'error_samples': self.error_samples,
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_rps': round(completed / elapsed, 2) if elapsed > 0 else 0.0,
+            'status_codes': self.status_codes,
+            'cache': self.cache,
+            'stages': {stage: summarize(values) for stage, values in sorted(self.latencies.items())},
+        }
+
+
+class InProcessTarget:
+    """
+    function_app の HTTP ハンドラー（chat など）を同一プロセス内で呼び出す
+    """
+
+    def __init__(self, module, handlers: dict):
+        self.module = module
+        self.handlers = handlers
+
+    @classmethod
+    def load(cls) -> 'InProcessTarget':
+        # function_app は環境変数をインポート時に読み込むため、環境変数の設定後にインポートする
+        import function_app
+        handlers = {function.get_function_name(): function.get_user_function()
+                    for function in function_app.app.get_functions()}
+        if 'chat' not in handlers:
+            raise RuntimeError('chat function not found in function_app')
+        return cls(function_app, handlers)
+
+    @staticmethod
+    def _request(method: str, path: str, body: dict = None, headers: dict = None, path_params: dict = None):
+        from azurefunctions.extensions.http.fastapi import Request
+
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'path_params': path_params or {},
+            'query_string': b'',
+            'headers': [(key.lower().encode('latin-1'), value.encode('latin-1'))
+                        for key, value in (headers or {}).items()],
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': payload, 'more_body': False}
+
+        return Request(scope, receive)
+
+    async def send(self, body: dict, headers: dict, stream: bool) -> tuple:
+        response = await self.handlers['chat'](self._request('POST', '/api/chat', body, headers))
+        if stream and hasattr(response, 'body_iterator'):
+            return response.status_code, response.headers, self._iterate(response.body_iterator)
+        return response.status_code, response.headers, None
+
+    @staticmethod
+    async def _iterate(body_iterator):
+        async for chunk in body_iterator:
+            yield chunk if isinstance(chunk, str) else chunk.decode('utf-8')
+
+    async def call(self, function_name: str, method: str, path: str, body: dict = None,
+                   headers: dict = None, path_params: dict = None) -> tuple:
+        """
+        JSONを返すハンドラーを呼び出し、(ステータス, ヘッダー, 本文のJSON) を返す
+        """
+        request = self._request(method, path, body, headers, path_params)
+        response = await self.handlers[function_name](request)
+        return response.status_code, response.headers, json.loads(response.body)
+
+    async def close(self) -> None:
+        # function_app がシングルトンで保持しているクライアントの接続を閉じる
+        await self.module.close_clients()
+
+
+class HttpTarget:
+    """
+    起動済みの Functions ホストに HTTP で送信する
+    """
+
+    def __init__(self, url: str, connections: int):
+        import aiohttp
+        self.base_url = url.rstrip('/')
+        self.url = self.base_url + '/api/chat'
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=connections),
+            timeout=aiohttp.ClientTimeout(total=300)
+        )
+
+    async def send(self, body: dict, headers: dict, stream: bool) -> tuple:
+        response = await self.session.post(self.url, json=body, headers=headers)
+        if stream:
+            return response.status, response.headers, self._iterate(response)
+        async with response:
+            await response.read()
+        return response.status, response.headers, None
+
+    @staticmethod
+    async def _iterate(response):
+        async with response:
+            async for line in response.content:
+                yield line.decode('utf-8')
+
+    async def call(self, function_name: str, method: str, path: str, body: dict = None,
+                   headers: dict = None, path_params: dict = None) -> tuple:
+        async with self.session.request(method, self.base_url + path, json=body, headers=headers) as response:
+            return response.status, response.headers, await response.json(content_type=None)
+
+    async def close(self) -> None:
+        await self.session.close()
+
+
+def parse_timestamp(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+async def run_job_request(target, body: dict, args, results: BenchmarkResults) -> None:
+    """
+    ジョブとして送信し、終了するまで状態を参照して計測値を記録
+    """
+    start = time.perf_counter()
+    try:
+        status, _, job = await target.call('create_chat_job', 'POST', '/api/chat/jobs', body,
+                                           {'Content-Type': 'application/json'})
+        accept_ms = (time.perf_counter() - start) * 1000
+        if status != 202:
+            results.record(status, accept_ms, error=f"HTTP {status}: {job.get('error')}")
+            return
+
+        job_id = job['job_id']
+        while job['status'] not in ('succeeded', 'failed'):
+            await asyncio.sleep(args.job_poll_interval_ms / 1000)
+            status, _, job = await target.call('get_chat_job', 'GET', f'/api/chat/jobs/{job_id}',
+                                               path_params={'job_id': job_id})
+            if status != 200:
+                results.record(status, (time.perf_counter() - start) * 1000, error=f'HTTP {status} while polling')
+                return
+
+        stages = {'accept': accept_ms}
+        started = parse_timestamp(job.get('started_at'))
+        if started is not None:
+            stages['queue'] = (started - parse_timestamp(job['created_at'])) * 1000
+        if job['status'] == 'failed':
+            results.record(job.get('status_code') or 500, (time.perf_counter() - start) * 1000,
+                           error=job.get('error'))
+            return
+        results.record(200, (time.perf_counter() - start) * 1000, stages)
+    except Exception as e:
+        results.record(0, (time.perf_counter() - start) * 1000, error=f'{type(e).__name__}: {e}')
+
+
+async def run_request(target, question: str, args, results: BenchmarkResults) -> None:
+    """
+    1リクエストを送信して計測値を記録
+    """
+    headers = {'Content-Type': 'application/json'}
+    if not args.use_cache:
+        headers['Cache-Control'] = 'no-cache'
+    body = {'message': question}
+    if args.unique_questions:
+        # 同一質問の合流（single-flight）やキャッシュを避け、毎回検索・生成を実行させる
+        body['message'] = f"{question} {random.getrandbits(32):08x}"
+    if args.jobs:
+        await run_job_request(target, body, args, results)
+        return
+    if args.stream:
+        body['stream'] = True
+        headers['Accept'] = 'text/event-stream'
+
+    start = time.perf_counter()
+    try:
+        status, response_headers, events = await target.send(body, headers, args.stream)
+        stages = parse_server_timing(response_headers.get('Server-Timing'))
+        cache = response_headers.get('X-Cache')
+        error = None
+
+        if events is not None:
+            # SSE: 参照ソース・最初の差分が届くまでの時間と、完了時のキャッシュ状態を記録
+            buffer = ''
+            event = None
+            async for text in events:
+                now_ms = (time.perf_counter() - start) * 1000
+                *lines, buffer = (buffer + text).split('\n')
+                for line in lines:
+                    if line.startswith('event:'):
+                        event = line[6:].strip()
+                        if event == 'sources':
+                            stages.setdefault('first_sources', now_ms)
+                        elif event == 'delta':
+                            stages.setdefault('first_delta', now_ms)
+                        elif event == 'error':
+                            error = 'stream error event'
+                    elif line.startswith('data:') and event == 'done':
+                        cache = json.loads(line[5:]).get('cache', cache)
+
+        results.record(status, (time.perf_counter() - start) * 1000, stages, cache, error)
+    except Exception as e:
+        results.record(0, (time.perf_counter() - start) * 1000, error=f'{type(e).__name__}: {e}')
+
+
+async def run_closed_loop(target, questions: list, args, results: BenchmarkResults) -> None:
+    """
+    並列数を固定し、各ワーカーが応答を受け取るたびに次のリクエストを送信する
+    """
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    remaining = [args.requests]
+
+    async def worker(worker_id: int):
+        i = worker_id
+        while True:
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    return
+            else:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            await run_request(target, questions[i % len(questions)], args, results)
+            i += args.concurrency
+
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+
+
+async def run_open_loop(target, questions: list, args, results: BenchmarkResults) -> None:
+    """
+    到着レート（req/s）に従ってポアソン到着でリクエストを送信する（応答を待たない）
+    """
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    tasks = []
+    i = 0
+    while True:
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        if deadline is None and i >= args.requests:
+            break
+        tasks.append(asyncio.create_task(run_request(target, questions[i % len(questions)], args, results)))
+        i += 1
+        await asyncio.sleep(random.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+
+
+async def start_stubs(args, documents: list) -> tuple:
+    """
+    Azure OpenAI / AI Search のスタブを起動し、(runnerのリスト, OpenAIのURL, SearchのURL) を返す
+    """
+    from aiohttp import web
+    from openai_stub import OpenAIStub
+    from search_stub import SearchStub
+
+    openai_stub = OpenAIStub(args.openai_latency_ms, args.openai_jitter_ms,
+                             args.openai_tokens_per_second, args.openai_error_rate,
+                             connect_latency_ms=args.connect_latency_ms,
+                             rpm_limit=args.openai_rpm_limit, tpm_limit=args.openai_tpm_limit)
+    search_stub = SearchStub(documents, args.search_latency_ms, args.search_jitter_ms,
+                             connect_latency_ms=args.connect_latency_ms,
+                             slow_rate=args.search_slow_rate, slow_ms=args.search_slow_ms)
+
+    runners = []
+    urls = []
+    for app, port in ((openai_stub.build_app(), args.openai_stub_port),
+                      (search_stub.build_app(), args.search_stub_port)):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', port)
+        await site.start()
+        runners.append(runner)
+        host, bound_port = runner.addresses[0][:2]
+        urls.append(f'http://{host}:{bound_port}')
+    return runners, urls[0], urls[1]
+
+
+def load_corpus(path: Path) -> list:
+    from rag.corpus import load_documents
+
+    candidates = (path,) if path else DEFAULT_CORPORA
+    for candidate in candidates:
+        if candidate.exists():
+            return load_documents(candidate)
+    print('❌ スタブに登録するドキュメントが見つかりません。')
+    print('   python scripts/generate-sample-data.py を実行するか、--corpus を指定してください。')
+    sys.exit(1)
+
+
+async def run_benchmark(args, questions: list) -> BenchmarkResults:
+    runners = []
+    if args.mode == 'inprocess' or args.start_stubs:
+        documents = load_corpus(args.corpus)
+        runners, openai_url, search_url = await start_stubs(args, documents)
+        print(f"Stubs: OpenAI {openai_url} / Search {search_url} ({len(documents)} documents)")
+
+    try:
+        if args.mode == 'inprocess':
+            os.environ.update({
+                'AZURE_OPENAI_ENDPOINT': openai_url,
+                'AZURE_OPENAI_API_KEY': 'stub',
+                'AZURE_SEARCH_ENDPOINT': search_url,
+                'AZURE_SEARCH_KEY': 'stub',
+                'SERVER_TIMING_ENABLED': 'true',
+            })
+            if args.local_index:
+                os.environ['LOCAL_SEARCH_INDEX_PATH'] = str(args.local_index)
+            if args.species_lookup:
+                os.environ['SPECIES_LOOKUP_PATH'] = str(args.species_lookup)
+            target = InProcessTarget.load()
+        else:
+            target = HttpTarget(args.url, args.concurrency if not args.rate else 0)
+
+        try:
+            # ウォームアップ（クライアント生成・接続確立）は集計に含めない
+            warmup = BenchmarkResults()
+            for i in range(args.warmup):
+                await run_request(target, questions[i % len(questions)], args, warmup)
+
+            results = BenchmarkResults()
+            results.started = time.perf_counter()
+            if args.rate:
+                await run_open_loop(target, questions, args, results)
+            else:
+                await run_closed_loop(target, questions, args, results)
+            results.finished = time.perf_counter()
+            return results
+        finally:
+            await target.close()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report: dict) -> None:
+    summary = report['summary']
+    print(f"\n{summary['succeeded']}件成功 / {summary['errors']}件失敗 / {summary['elapsed_seconds']:.2f}秒 "
+          f"({summary['throughput_rps']:.2f} req/s)")
+    if summary['cache']:
+        print('Cache: ' + ', '.join(f"{key}={value}" for key, value in sorted(summary['cache'].items())))
+    for sample in summary['error_samples']:
+        print(f"  ✗ {sample}")
+
+    print(f"\n{'stage':<24}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for stage, stats in summary['stages'].items():
+        if not stats['count']:
+            continue
+        print(f"{stage:<24}{stats['count']:>8}{stats['mean']:>10.1f}{stats['p50']:>10.1f}"
+              f"{stats['p95']:>10.1f}{stats['p99']:>10.1f}{stats['max']:>10.1f}")
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    ベースラインと比較し、しきい値を超えて悪化した項目を返す
+
+    - 各段階の p50 / p95 / p99 が (1 + threshold) 倍を超えた場合
+    - スループットが (1 - threshold) 倍を下回った場合
+    """
+    regressions = []
+    base_summary = baseline['summary']
+    current_summary = current['summary']
+
+    print(f"\nBaseline: {baseline.get('git_commit') or '-'} ({baseline.get('created', '-')})")
+    print(f"{'metric':<32}{'baseline':>12}{'current':>12}{'change':>10}")
+
+    def row(name: str, base: float, value: float, higher_is_better: bool = False) -> None:
+        change = (value - base) / base if base else 0.0
+        worse = change < -threshold if higher_is_better else change > threshold
+        mark = '  ⚠️' if worse else ''
+        print(f"{name:<32}{base:>12.2f}{value:>12.2f}{change:>+10.1%}{mark}")
+        if worse:
+            regressions.append(f"{name}: {base:.2f} -> {value:.2f} ({change:+.1%})")
+
+    row('throughput_rps', base_summary['throughput_rps'], current_summary['throughput_rps'],
+        higher_is_better=True)
+    for stage, stats in current_summary['stages'].items():
+        base_stats = base_summary['stages'].get(stage)
+        if not base_stats or not base_stats.get('count') or not stats.get('count'):
+            continue
+        for p in PERCENTILES:
+            row(f"{stage}.p{p}", base_stats[f'p{p}'], stats[f'p{p}'])
+    return regressions
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    スタブの遅延設定のオプションを追加（tests/benchmark-coldstart.py と共通）
+    """
+    stub_group = parser.add_argument_group('スタブ設定')
+    stub_group.add_argument('--openai-latency-ms', type=float, default=300.0)
+    stub_group.add_argument('--openai-jitter-ms', type=float, default=100.0)
+    stub_group.add_argument('--openai-tokens-per-second', type=float, default=100.0)
+    stub_group.add_argument('--openai-error-rate', type=float, default=0.0)
+    stub_group.add_argument('--openai-rpm-limit', type=float, default=0.0,
+                            help='OpenAIスタブのRPM上限（超過時は429）')
+    stub_group.add_argument('--openai-tpm-limit', type=float, default=0.0,
+                            help='OpenAIスタブのTPM上限（超過時は429）')
+    stub_group.add_argument('--openai-stub-port', type=int, default=0, help='0の場合は空きポート')
+    stub_group.add_argument('--search-latency-ms', type=float, default=50.0)
+    stub_group.add_argument('--search-jitter-ms', type=float, default=20.0)
+    stub_group.add_argument('--search-slow-rate', type=float, default=0.0,
+                            help='Searchスタブが --search-slow-ms だけ遅れて応答する割合（テールレイテンシ）')
+    stub_group.add_argument('--search-slow-ms', type=float, default=2000.0)
+    stub_group.add_argument('--search-stub-port', type=int, default=0, help='0の場合は空きポート')
+    stub_group.add_argument('--connect-latency-ms', type=float, default=0.0,
+                            help='新規接続の最初のリクエストに加える遅延（TLSハンドシェイク相当）')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='チャットAPIの負荷試験・ベンチマーク')
+    parser.add_argument('--mode', choices=('inprocess', 'http'), default='inprocess')
+    parser.add_argument('--url', default='http://localhost:7071', help='httpモードの送信先')
+    parser.add_argument('--concurrency', type=int, default=4, help='同時実行数（クローズドループ）')
+    parser.add_argument('--rate', type=float, help='到着レート req/s（指定時はオープンループ）')
+    parser.add_argument('--requests', type=int, default=100, help='送信するリクエスト数')
+    parser.add_argument('--duration', type=float, help='実行秒数（指定時は --requests より優先）')
+    parser.add_argument('--warmup', type=int, default=2, help='集計から除外する最初のリクエスト数')
+    parser.add_argument('--stream', action='store_true', help='SSE（stream: true）で送信')
+    parser.add_argument('--jobs', action='store_true',
+                        help='/api/chat/jobs でジョブとして送信し、結果が出るまで状態を参照')
+    parser.add_argument('--job-poll-interval-ms', type=float, default=100.0, help='ジョブの状態を参照する間隔')
+    parser.add_argument('--use-cache', action='store_true',
+                        help='回答キャッシュを使用（既定は Cache-Control: no-cache で毎回生成）')
+    parser.add_argument('--unique-questions', action='store_true',
+                        help='質問ごとに乱数を付加し、同時実行中の同一質問の合流を避ける')
+    parser.add_argument('--questions', type=Path, default=DEFAULT_QUESTIONS)
+    parser.add_argument('--corpus', type=Path, help='Searchスタブに登録するJSONL')
+    parser.add_argument('--local-index', type=Path,
+                        help='inprocessモードで LOCAL_SEARCH_INDEX_PATH として使用')
+    parser.add_argument('--species-lookup', type=Path,
+                        help='inprocessモードで SPECIES_LOOKUP_PATH として使用（種名の直接参照）')
+    parser.add_argument('--start-stubs', action='store_true',
+                        help='httpモードでもスタブを起動（Functionsホストの接続先に設定して使用）')
+
+    add_stub_arguments(parser)
+
+    result_group = parser.add_argument_group('結果の保存・比較')
+    result_group.add_argument('--output', type=Path, help='結果を保存するJSON')
+    result_group.add_argument('--label', help='結果に記録するラベル')
+    result_group.add_argument('--baseline', type=Path, help='比較対象の結果JSON')
+    result_group.add_argument('--threshold', type=float, default=0.10,
+                              help='劣化とみなす変化率（既定: 0.10 = 10%%）')
+    result_group.add_argument('--load-results', type=Path,
+                              help='ベンチマークを実行せず、保存済みの結果を表示・比較')
+    args = parser.parse_args()
+
+    args.concurrency = max(1, args.concurrency)
+
+    if args.load_results:
+        with open(args.load_results, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    else:
+        with open(args.questions, 'r', encoding='utf-8') as f:
+            questions = [case['question'] for case in json.load(f)]
+
+        load = f"rate {args.rate} req/s" if args.rate else f"concurrency {args.concurrency}"
+        amount = f"{args.duration}s" if args.duration else f"{args.requests} requests"
+        print(f"Mode: {args.mode} / {load} / {amount}{' / stream' if args.stream else ''}"
+              f"{' / jobs' if args.jobs else ''}")
+
+        results = asyncio.run(run_benchmark(args, questions))
+        report = {
+            'version': RESULT_FORMAT_VERSION,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'label': args.label,
+            'config': {
+                'mode': args.mode,
+                'concurrency': None if args.rate else args.concurrency,
+                'rate': args.rate,
+                'requests': None if args.duration else args.requests,
+                'duration': args.duration,
+                'stream': args.stream,
+                'jobs': args.jobs,
+                'use_cache': args.use_cache,
+                'unique_questions': args.unique_questions,
+                'local_index': str(args.local_index) if args.local_index else None,
+                'species_lookup': str(args.species_lookup) if args.species_lookup else None,
+                'openai_latency_ms': args.openai_latency_ms,
+                'openai_jitter_ms': args.openai_jitter_ms,
+                'openai_tokens_per_second': args.openai_tokens_per_second,
+                'openai_rpm_limit': args.openai_rpm_limit,
+                'openai_tpm_limit': args.openai_tpm_limit,
+                'search_latency_ms': args.search_latency_ms,
+                'search_jitter_ms': args.search_jitter_ms,
+                'search_slow_rate': args.search_slow_rate,
+                'search_slow_ms': args.search_slow_ms,
+                'connect_latency_ms': args.connect_latency_ms,
+            },
+            'summary': results.to_dict(),
+        }
+
+    print_report(report)
+
+    if args.output and not args.load_results:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report.get('config'):
+            print('\n⚠️  ベースラインと実行条件（config）が異なります')
+        regressions = compare_reports(baseline, report, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)}項目で {args.threshold:.0%} を超える劣化があります")
+            sys.exit(1)
+        print('\n✅ 劣化は検出されませんでした')
+
+
+if __name__ == '__main__':
+    main()
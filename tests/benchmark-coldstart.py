@@ -0,0 +1,208 @@
+"""
+コールドスタート計測
+
+新しいPythonプロセスで function_app を読み込み、最初と2回目の /api/chat の所要時間を計測します。
+ウォームアップ（warm_up）の有無を比較し、インポート時間・事前準備の時間・
+最初のリクエストで支払っていたコストを確認できます。
+
+Azure OpenAI / AI Search は tests/stubs のスタブを親プロセスで起動して使用します。
+--connect-latency-ms で新規接続の遅延（TLSハンドシェイク相当）を模擬できます。
+
+使い方（リポジトリルートで実行）:
+    python tests/benchmark-coldstart.py --runs 5 --connect-latency-ms 150
+    python tests/benchmark-coldstart.py --runs 5 --output bench/coldstart.json --importtime
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 負荷試験スクリプトのスタブ起動・リクエスト送信・集計処理を再利用する
+_spec = importlib.util.spec_from_file_location('benchmark_chat', ROOT / 'tests' / 'benchmark-chat.py')
+benchmark_chat = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(benchmark_chat)
+
+CHILD_QUESTIONS = ('イリオモテヤマネコは絶滅危惧種ですか?', 'ライチョウの生息地はどこですか?')
+
+
+async def send_chat(target, message: str) -> float:
+    """
+    キャッシュを迂回して1リクエストを送信し、所要時間（ミリ秒）を返す
+    """
+    start = time.perf_counter()
+    status, _, _ = await target.send({'message': message},
+                                     {'Content-Type': 'application/json', 'Cache-Control': 'no-cache'},
+                                     stream=False)
+    if status != 200:
+        raise RuntimeError(f'chat returned HTTP {status}')
+    return (time.perf_counter() - start) * 1000
+
+
+async def run_child(warm_up: bool) -> dict:
+    """
+    子プロセス側: function_app を読み込んでリクエストを送信する（接続先は環境変数で指定済み）
+    """
+    result = {}
+    start = time.perf_counter()
+    target = benchmark_chat.InProcessTarget.load()
+    result['import_ms'] = (time.perf_counter() - start) * 1000
+
+    try:
+        if warm_up:
+            start = time.perf_counter()
+            result['warmup_steps'] = await target.module.warm_up()
+            result['warmup_ms'] = (time.perf_counter() - start) * 1000
+        result['first_request_ms'] = await send_chat(target, CHILD_QUESTIONS[0])
+        result['second_request_ms'] = await send_chat(target, CHILD_QUESTIONS[1])
+    finally:
+        await target.close()
+    return result
+
+
+async def spawn_child(env: dict, warm_up: bool) -> dict:
+    """
+    新しいPythonプロセスで1回計測する
+    """
+    command = [sys.executable, str(Path(__file__).resolve()), '--child']
+    if warm_up:
+        command.append('--warm-up')
+
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *command, cwd=ROOT, env=env,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    elapsed = (time.perf_counter() - start) * 1000
+    if process.returncode != 0:
+        raise RuntimeError(f'child process failed:\n{stderr.decode("utf-8", "replace")}')
+
+    result = json.loads(stdout.decode('utf-8').strip().splitlines()[-1])
+    result['process_ms'] = elapsed
+    return result
+
+
+async def measure(args) -> dict:
+    documents = benchmark_chat.load_corpus(args.corpus)
+    runners, openai_url, search_url = await benchmark_chat.start_stubs(args, documents)
+    print(f"Stubs: OpenAI {openai_url} / Search {search_url} ({len(documents)} documents)")
+
+    env = dict(os.environ, **{
+        'AZURE_OPENAI_ENDPOINT': openai_url,
+        'AZURE_OPENAI_API_KEY': 'stub',
+        'AZURE_SEARCH_ENDPOINT': search_url,
+        'AZURE_SEARCH_KEY': 'stub',
+        'PYTHONDONTWRITEBYTECODE': '1',
+    })
+    if args.local_index:
+        env['LOCAL_SEARCH_INDEX_PATH'] = str(args.local_index)
+
+    runs = {'cold': [], 'warm': []}
+    try:
+        for i in range(args.runs):
+            # 実行順による偏りを避けるため、ウォームアップあり・なしを交互に実行する
+            for mode in ('cold', 'warm'):
+                runs[mode].append(await spawn_child(env, warm_up=(mode == 'warm')))
+            print(f"  run {i + 1}/{args.runs}")
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+    summary = {}
+    for mode, results in runs.items():
+        summary[mode] = {
+            metric: benchmark_chat.summarize([result[metric] for result in results])
+            for metric in ('import_ms', 'warmup_ms', 'first_request_ms', 'second_request_ms', 'process_ms')
+            if all(metric in result for result in results)
+        }
+    return {'summary': summary, 'runs': runs}
+
+
+def import_profile(limit: int) -> list:
+    """
+    python -X importtime で function_app が直接読み込むモジュールの累積時間（ミリ秒）を取得
+    """
+    import subprocess
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import function_app'],
+                               cwd=ROOT, capture_output=True, text=True)
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 直接のインポートは区切りの空白1文字 + インデント2文字
+        if name.startswith('   ') and not name.startswith('    '):
+            modules.append((name.strip(), int(cumulative) / 1000))
+    return sorted(modules, key=lambda item: -item[1])[:limit]
+
+
+def print_report(report: dict) -> None:
+    print(f"\n{'metric':<28}{'p50 (cold)':>12}{'p50 (warm)':>12}{'max (cold)':>12}{'max (warm)':>12}  (ms)")
+    cold = report['summary']['cold']
+    warm = report['summary']['warm']
+    for metric in ('import_ms', 'warmup_ms', 'first_request_ms', 'second_request_ms', 'process_ms'):
+        if metric not in cold and metric not in warm:
+            continue
+        values = []
+        for summary in (cold, warm):
+            stats = summary.get(metric)
+            values.append((f"{stats['p50']:.1f}", f"{stats['max']:.1f}") if stats else ('-', '-'))
+        print(f"{metric:<28}{values[0][0]:>12}{values[1][0]:>12}{values[0][1]:>12}{values[1][1]:>12}")
+
+    if report.get('import_profile'):
+        print('\nimport time (cumulative, direct imports of function_app):')
+        for name, ms in report['import_profile']:
+            print(f"  {ms:>8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='コールドスタート計測')
+    parser.add_argument('--runs', type=int, default=5, help='ウォームアップあり・なしそれぞれの実行回数')
+    parser.add_argument('--corpus', type=Path, help='Searchスタブに登録するJSONL')
+    parser.add_argument('--local-index', type=Path,
+                        help='LOCAL_SEARCH_INDEX_PATH として使用（ローカル検索の読み込み時間を含めて計測）')
+    parser.add_argument('--importtime', action='store_true', help='モジュールごとのインポート時間を表示')
+    parser.add_argument('--output', type=Path, help='結果を保存するJSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--warm-up', action='store_true', help=argparse.SUPPRESS)
+    benchmark_chat.add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_child(args.warm_up))))
+        return
+
+    report = {
+        'version': benchmark_chat.RESULT_FORMAT_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': benchmark_chat.git_commit(),
+        'config': {
+            'runs': args.runs,
+            'local_index': str(args.local_index) if args.local_index else None,
+            'openai_latency_ms': args.openai_latency_ms,
+            'search_latency_ms': args.search_latency_ms,
+            'connect_latency_ms': args.connect_latency_ms,
+        },
+        **asyncio.run(measure(args)),
+    }
+    if args.importtime:
+        report['import_profile'] = import_profile(15)
+
+    print_report(report)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
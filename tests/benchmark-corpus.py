@@ -0,0 +1,191 @@
+"""
+コーパスの読み込み計測（JSONL とパック形式の比較）
+
+新しいPythonプロセスでコーパスを読み込み、参照できるようになるまでの時間・
+idによる参照の時間・読み込み後のメモリ使用量（RSS）を形式ごとに計測します。
+
+- jsonl:       JSONL全体を解析し、idの辞書を作成する（従来の読み込み方）
+- packed:      パック形式をmmapで開き、参照したレコードだけを復元する
+- packed-full: パック形式から全ドキュメントを復元する（インデックス作成など全件が必要な場合）
+
+使い方（リポジトリルートで実行）:
+    python tests/benchmark-corpus.py
+    python tests/benchmark-corpus.py --input verify-download.jsonl --runs 5 --output bench/corpus.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# 結果の保存形式・コミットの取得は負荷試験スクリプトと共通にする
+_spec = importlib.util.spec_from_file_location('benchmark_chat', ROOT / 'tests' / 'benchmark-chat.py')
+benchmark_chat = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(benchmark_chat)
+
+DEFAULT_INPUTS = (
+    ROOT / 'data' / 'processed' / 'redlist-documents.jsonl',
+    ROOT / 'verify-download.jsonl',
+    ROOT / 'data' / 'processed' / 'sample-documents.jsonl',
+)
+
+CASES = ('jsonl', 'packed', 'packed-full')
+METRICS = ('ready_ms', 'lookup_us', 'rss_mb')
+
+
+def current_rss_bytes():
+    """
+    現在のRSS（/proc がない環境では最大RSS、取得できない場合は None）
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_child(case: str, path: Path, ids: list) -> dict:
+    """
+    子プロセス側: コーパスを読み込み、idで参照する
+    """
+    from rag.corpus import PackedCorpus, load_documents, load_jsonl
+
+    baseline = current_rss_bytes()
+    start = time.perf_counter()
+    if case == 'jsonl':
+        documents = {doc['id']: doc for doc in load_jsonl(path)}
+    elif case == 'packed':
+        documents = PackedCorpus.open(path)
+    else:
+        documents = {doc['id']: doc for doc in load_documents(path)}
+    ready_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    found = sum(1 for doc_id in ids if documents.get(doc_id) is not None)
+    lookup_us = (time.perf_counter() - start) * 1_000_000 / max(1, len(ids))
+    if found != len(ids):
+        raise RuntimeError(f'{len(ids) - found} ids not found')
+
+    rss = current_rss_bytes()
+    return {
+        'ready_ms': ready_ms,
+        'lookup_us': lookup_us,
+        'rss_mb': (rss - baseline) / (1024 * 1024) if rss is not None and baseline is not None else None,
+    }
+
+
+def spawn_child(case: str, path: Path, ids: list) -> dict:
+    """
+    新しいPythonプロセスで1回計測する（参照するidは標準入力で渡す）
+    """
+    completed = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), '--child', case, str(path)],
+        input=json.dumps(ids), capture_output=True, text=True, cwd=ROOT,
+        env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f'child process failed:\n{completed.stderr}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(values: list) -> dict:
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    return {'p50': statistics.median(values), 'min': min(values), 'max': max(values)}
+
+
+def measure(args, jsonl_path: Path, packed_path: Path) -> dict:
+    from rag.corpus import load_jsonl
+
+    all_ids = [doc['id'] for doc in load_jsonl(jsonl_path)]
+    ids = random.Random(0).choices(all_ids, k=args.lookups) if all_ids else []
+    paths = {'jsonl': jsonl_path, 'packed': packed_path, 'packed-full': packed_path}
+
+    runs = {case: [] for case in CASES}
+    for i in range(args.runs):
+        # 実行順による偏り（ページキャッシュなど）を避けるため、形式を交互に実行する
+        for case in CASES:
+            runs[case].append(spawn_child(case, paths[case], ids))
+        print(f"  run {i + 1}/{args.runs}")
+
+    summary = {
+        case: {metric: summarize([result[metric] for result in results]) for metric in METRICS}
+        for case, results in runs.items()
+    }
+    return {'summary': summary, 'runs': runs}
+
+
+def print_report(report: dict) -> None:
+    sizes = report['file_bytes']
+    print(f"\n{'case':<14}{'file (KB)':>12}{'ready (ms)':>12}{'lookup (us)':>13}{'RSS (MB)':>11}  (p50)")
+    for case in CASES:
+        stats = report['summary'][case]
+        size = sizes['jsonl' if case == 'jsonl' else 'packed'] / 1024
+        values = [f"{stats[metric]['p50']:.2f}" if stats[metric] else '-' for metric in METRICS]
+        print(f"{case:<14}{size:>12,.0f}{values[0]:>12}{values[1]:>13}{values[2]:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='コーパスの読み込み計測（JSONL / パック形式）')
+    parser.add_argument('--input', type=Path, help='計測するJSONL（パック形式は一時ディレクトリに作成）')
+    parser.add_argument('--runs', type=int, default=5, help='形式ごとの実行回数')
+    parser.add_argument('--lookups', type=int, default=1000, help='idで参照する回数')
+    parser.add_argument('--output', type=Path, help='結果を保存するJSON')
+    parser.add_argument('--child', nargs=2, metavar=('CASE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        case, path = args.child
+        print(json.dumps(run_child(case, Path(path), json.loads(sys.stdin.read()))))
+        return
+
+    candidates = (args.input,) if args.input else DEFAULT_INPUTS
+    jsonl_path = next((path for path in candidates if path.exists()), None)
+    if jsonl_path is None:
+        print('❌ 計測するJSONLが見つかりません。--input を指定してください。')
+        sys.exit(1)
+
+    from rag.corpus import write_corpus
+
+    with tempfile.TemporaryDirectory() as tmp:
+        packed_path = Path(tmp) / 'corpus.corpus'
+        write_corpus(benchmark_chat.load_corpus(jsonl_path), packed_path)
+        print(f"Input: {jsonl_path}")
+        report = {
+            'version': benchmark_chat.RESULT_FORMAT_VERSION,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_commit': benchmark_chat.git_commit(),
+            'config': {'input': str(jsonl_path), 'runs': args.runs, 'lookups': args.lookups},
+            'file_bytes': {'jsonl': jsonl_path.stat().st_size, 'packed': packed_path.stat().st_size},
+            **measure(args, jsonl_path, packed_path),
+        }
+
+    print_report(report)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
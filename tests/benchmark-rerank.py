@@ -0,0 +1,179 @@
+"""
+再ランキングの計測（検索の上位k件と、候補を多めに取得して再ランキングした上位k件の比較）
+
+コーパスのドキュメントから種名を含む質問を作成し、ローカル検索（BM25）の結果について
+次の指標と、再ランキングの所要時間を計測します。正解は名前のフィールドが一致するドキュメントです。
+
+- hit@1:  1位が正解か（プロンプトに1件だけ含める場合に回答できる割合）
+- hit@k:  上位k件に正解が含まれるか
+- mrr@k:  上位k件での正解の順位の逆数の平均
+- unique@k: 上位k件のうち、本文が重複しないドキュメントの割合
+
+使い方（リポジトリルートで実行）:
+    python tests/benchmark-rerank.py
+    python tests/benchmark-rerank.py --input data/processed/redlist-documents.jsonl --candidates 40 --output bench/rerank.json
+    python tests/benchmark-rerank.py --weights rerank-weights.json
+"""
+import argparse
+import importlib.util
+import json
+import random
+import statistics
+import sys
+import time
+import unicodedata
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from rag.corpus import load_documents
+from rag.local_search import LocalSearchIndex
+from rag.redlist import repair_document
+from rag.rerank import Reranker
+
+# 結果の保存形式・コミットの取得は負荷試験スクリプトと共通にする
+_spec = importlib.util.spec_from_file_location('benchmark_chat', ROOT / 'tests' / 'benchmark-chat.py')
+benchmark_chat = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(benchmark_chat)
+
+DEFAULT_INPUTS = (
+    ROOT / 'data' / 'processed' / 'redlist-documents.jsonl',
+    ROOT / 'verify-download.jsonl',
+    ROOT / 'data' / 'processed' / 'sample-documents.jsonl',
+)
+
+# 質問の定型（種名以外の語が多い質問ほど、検索のスコアだけでは順位が乱れやすい）
+QUESTION_TEMPLATES = (
+    '{name}は絶滅危惧種ですか?',
+    '{name}の絶滅危惧ランクと生息地について教えてください',
+    '{name}の個体数が減少している理由は何ですか?',
+    '{name}はどの分類の生き物で、どんな環境に生息していますか?',
+)
+
+
+def normalize_name(text: str) -> str:
+    return unicodedata.normalize('NFKC', text or '').casefold().strip()
+
+
+def build_questions(documents: list, name_field: str, count: int, seed: int) -> list:
+    """
+    名前のフィールドから質問を作成（正解は同じ名前のドキュメントすべて）
+    """
+    names = sorted({normalize_name(doc.get(name_field)) for doc in documents} - {''})
+    rng = random.Random(seed)
+    rng.shuffle(names)
+    questions = []
+    for i, name in enumerate(names[:count]):
+        template = QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)]
+        questions.append({'question': template.format(name=name), 'name': name})
+    return questions
+
+
+def relevant(doc: dict, name: str, name_field: str, corpus_by_key: dict) -> bool:
+    source = corpus_by_key.get((doc.get('title'), doc.get('content')))
+    return source is not None and normalize_name(source.get(name_field)) == name
+
+
+def evaluate(ranked: list, name: str, name_field: str, corpus_by_key: dict, k: int) -> dict:
+    flags = [relevant(doc, name, name_field, corpus_by_key) for doc in ranked[:k]]
+    rank = next((i + 1 for i, flag in enumerate(flags) if flag), None)
+    contents = [doc.get('content') for doc in ranked[:k]]
+    return {
+        'hit@1': 1.0 if flags[:1] == [True] else 0.0,
+        f'hit@{k}': 1.0 if rank else 0.0,
+        f'mrr@{k}': 1.0 / rank if rank else 0.0,
+        f'unique@{k}': len(set(contents)) / len(contents) if contents else 0.0,
+    }
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='再ランキングの計測（精度と所要時間）')
+    parser.add_argument('--input', type=Path, help='コーパス（JSONL またはパック形式）')
+    parser.add_argument('--name-field', default='japanese_name', help='質問に使う名前のフィールド')
+    parser.add_argument('--questions', type=int, default=300, help='作成する質問の数')
+    parser.add_argument('--candidates', type=int, default=40, help='再ランキングする候補の数')
+    parser.add_argument('--top-k', type=int, default=3, help='プロンプトに含める件数')
+    parser.add_argument('--weights', type=Path, help='再ランキングの重みのJSON')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, help='結果を保存するJSON')
+    args = parser.parse_args()
+
+    candidates = (args.input,) if args.input else DEFAULT_INPUTS
+    path = next((path for path in candidates if path.exists()), None)
+    if path is None:
+        print('❌ コーパスが見つかりません。--input を指定してください。')
+        sys.exit(1)
+
+    # 質問と正解は本来の和名・学名で作成する（フィールドのずれた verify-download.jsonl などは修正して使う）
+    documents = [repair_document(doc) for doc in load_documents(path)]
+    corpus_by_key = {(doc.get('title'), doc.get('content')): doc for doc in documents}
+    index = LocalSearchIndex.from_documents(documents)
+    reranker = Reranker.from_file(args.weights) if args.weights else Reranker()
+    questions = build_questions(documents, args.name_field, args.questions, args.seed)
+    print(f"Input: {path} ({len(documents)} documents, {len(questions)} questions)")
+
+    k = args.top_k
+    # 初回の呼び出し（NumPy の初期化など）は計測から除く
+    if questions:
+        reranker.rerank(questions[0]['question'], index.search(questions[0]['question'], args.candidates), k)
+    results = {'search': [], 'rerank': []}
+    latencies = []
+    candidate_counts = []
+    for item in questions:
+        query, name = item['question'], item['name']
+        results['search'].append(evaluate(index.search(query, k), name, args.name_field, corpus_by_key, k))
+
+        pool = index.search(query, args.candidates)
+        candidate_counts.append(len(pool))
+        start = time.perf_counter()
+        ranked = reranker.rerank(query, pool, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results['rerank'].append(evaluate(ranked, name, args.name_field, corpus_by_key, k))
+
+    summary = {
+        case: {metric: statistics.mean(row[metric] for row in rows) for metric in rows[0]}
+        for case, rows in results.items() if rows
+    }
+    timing = {
+        'candidates_mean': statistics.mean(candidate_counts) if candidate_counts else 0,
+        'rerank_ms_p50': statistics.median(latencies) if latencies else None,
+        'rerank_ms_p99': percentile(latencies, 0.99) if latencies else None,
+    }
+
+    metrics = list(next(iter(summary.values())).keys()) if summary else []
+    print(f"\n{'case':<10}" + ''.join(f"{metric:>12}" for metric in metrics))
+    for case, values in summary.items():
+        print(f"{case:<10}" + ''.join(f"{values[metric]:>12.3f}" for metric in metrics))
+    if latencies:
+        print(f"\nrerank: {timing['candidates_mean']:.0f} candidates / "
+              f"p50 {timing['rerank_ms_p50']:.3f} ms / p99 {timing['rerank_ms_p99']:.3f} ms")
+
+    if args.output:
+        report = {
+            'version': benchmark_chat.RESULT_FORMAT_VERSION,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_commit': benchmark_chat.git_commit(),
+            'config': {
+                'input': str(path), 'name_field': args.name_field, 'questions': len(questions),
+                'candidates': args.candidates, 'top_k': k,
+                'weights': reranker.weights, 'duplicate_penalty': reranker.duplicate_penalty,
+                'duplicate_threshold': reranker.duplicate_threshold,
+            },
+            'summary': summary,
+            'timing': timing,
+        }
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
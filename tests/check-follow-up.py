@@ -0,0 +1,125 @@
+"""
+続きの質問の判定と、続きの質問の検索対象の確認
+
+会話の途中の質問について次を確認します。条件を満たさない場合は終了コード1で終了します。
+
+- 判定: 「その生息地は?」のような対象を省略した質問だけを続きの質問とし、
+  「昆虫類は何種?」のように分類の語（漢字）で対象を指定した短い質問は自己完結した質問とすること
+  （自己完結した質問は履歴を使わず、回答キャッシュ・同じ質問の合流の対象になる）
+- 検索対象: 続きの質問でも種名・分類はまず今回の質問から読み取り、
+  対象を変えた質問（「では鳥類は?」）で前の質問の種が返らないこと。
+  対象を省略した質問（「その生息地は?」）では前の質問の種が返ること
+
+検索は function_app.retrieve_documents を、種名の直接参照（SPECIES_LOOKUP_PATH）と
+ローカル検索（LOCAL_SEARCH_INDEX_PATH）で実行します（ネットワーク接続は不要）。
+
+使い方（リポジトリルートで実行）:
+    python tests/check-follow-up.py
+    python tests/check-follow-up.py --input data/processed/redlist-documents.jsonl
+"""
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+DEFAULT_INPUTS = (
+    ROOT / 'verify-download.jsonl',
+    ROOT / 'data' / 'processed' / 'redlist-documents.jsonl',
+)
+
+# (質問, 続きの質問か)
+FOLLOW_UP_CASES = (
+    ('その生息地は?', True),
+    ('生息地は?', True),
+    ('なぜ減ったの?', True),
+    ('では鳥類は?', True),
+    ('鳥類の絶滅危惧種は?', False),
+    ('哺乳類で絶滅したのは?', False),
+    ('昆虫類は何種?', False),
+    ('植物は?', False),
+    ('ライチョウの生息地は?', False),
+    ('Pteropus loochoensis は?', False),
+)
+
+# (直前の質問, 続きの質問, 返るべきドキュメントの分類, 返るべきドキュメントのタイトルの先頭（None は問わない）)
+RETRIEVAL_CASES = (
+    ('イリオモテヤマネコは絶滅危惧種ですか?', 'では鳥類は?', '鳥類', None),
+    ('イリオモテヤマネコは絶滅危惧種ですか?', 'その生息地は?', '哺乳類', 'イリオモテヤマネコ ('),
+    ('ライチョウのランクは?', 'では哺乳類は?', '哺乳類', None),
+)
+
+
+def check_follow_up() -> list:
+    """
+    続きの質問の判定を確認し、問題の一覧を返す
+    """
+    from rag.sessions import is_follow_up
+
+    problems = []
+    for question, expected in FOLLOW_UP_CASES:
+        actual = is_follow_up(question)
+        print(f"is_follow_up: {question} -> {actual} (期待 {expected})")
+        if actual != expected:
+            problems.append(f"{question!r} の判定が期待と異なります: {actual}")
+    return problems
+
+
+async def check_retrieval() -> list:
+    """
+    続きの質問で取得するドキュメントを確認し、問題の一覧を返す
+    """
+    import function_app
+    from rag.sessions import Session
+
+    problems = []
+    for previous, question, category, title in RETRIEVAL_CASES:
+        session = Session('check-follow-up-session')
+        session.append('user', previous)
+        session.append('assistant', '回答')
+        documents = await function_app.retrieve_documents(
+            question, function_app.previous_question(question, session))
+
+        titles = [doc['title'] for doc in documents]
+        print(f"retrieve: {previous} -> {question}: {titles}")
+        if not documents:
+            problems.append(f"{question!r} でドキュメントが返りません")
+            continue
+        if any(f"分類: {category}\n" not in doc['content'] for doc in documents):
+            problems.append(f"{question!r} で {category} 以外のドキュメントが返りました: {titles}")
+        if title is not None and not titles[0].startswith(title):
+            problems.append(f"{question!r} で {title} が返りません: {titles}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='続きの質問の判定と検索対象の確認')
+    parser.add_argument('--input', type=Path, help='コーパス（JSONL またはパック形式）')
+    args = parser.parse_args()
+
+    candidates = (args.input,) if args.input else DEFAULT_INPUTS
+    path = next((path for path in candidates if path.exists()), None)
+    if path is None:
+        print('❌ コーパスが見つかりません。--input を指定してください。')
+        sys.exit(1)
+
+    # function_app は読み込み時に環境変数を参照するため、インポートの前に設定する
+    os.environ['SPECIES_LOOKUP_PATH'] = str(path)
+    os.environ['LOCAL_SEARCH_INDEX_PATH'] = str(path)
+    print(f"Input: {path}")
+
+    problems = check_follow_up() + asyncio.run(check_retrieval())
+
+    if problems:
+        print('\n❌ 確認に失敗しました:')
+        for problem in problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print('\n✅ すべての確認に成功しました')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+複数クエリの検索結果の統合（Reciprocal Rank Fusion）の確認
+
+検索結果の統合で、別のドキュメントを1件にまとめないことを確認します。
+条件を満たさない場合は終了コード1で終了します。
+
+- 同じタイトル・URLの別のドキュメント（id が異なる）は別々に統合されること
+- 1つの結果リスト内の同じタイトルの別のドキュメントのスコアが合算されないこと
+- 実データ（verify-download.jsonl。以前の形式ではタイトルが「分類 (ランク)」で、4,904件に対して
+  127種類しかない）の候補を統合しても、件数が id の種類の数と一致すること
+
+使い方（リポジトリルートで実行）:
+    python tests/check-multi-query.py
+    python tests/check-multi-query.py --input data/processed/redlist-documents.jsonl
+"""
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from rag.corpus import load_documents
+from rag.multi_query import RRF_K, reciprocal_rank_fusion
+
+DEFAULT_INPUTS = (
+    ROOT / 'verify-download.jsonl',
+    ROOT / 'data' / 'processed' / 'redlist-documents.jsonl',
+)
+
+URL = 'https://data.e-gov.go.jp/data/dataset/env_20140904_0456'
+
+# 統合する候補の数（検索1回分の取得件数に相当）
+CANDIDATES = 40
+
+
+def as_result(doc: dict, score: float) -> dict:
+    """
+    run_search の結果の形（{id, content, title, url, score}）
+    """
+    return {'id': doc['id'], 'content': doc['content'], 'title': doc['title'], 'url': doc['url'], 'score': score}
+
+
+def check_shared_title() -> list:
+    """
+    タイトル・URLが同じ別のドキュメントを統合して、問題の一覧を返す
+    """
+    problems = []
+    title = '維管束植物 (絶滅危惧Ⅱ類（VU） )'
+    first = {'id': 'a', 'content': '和名: ヒメバイカモ', 'title': title, 'url': URL}
+    second = {'id': 'b', 'content': '和名: ヒメコウホネ', 'title': title, 'url': URL}
+    other = {'id': 'c', 'content': '和名: ライチョウ', 'title': '鳥類 (絶滅危惧ⅠB類（EN）)', 'url': URL}
+
+    fused = reciprocal_rank_fusion([
+        [as_result(first, 3.0), as_result(second, 2.0), as_result(other, 1.0)],
+        [as_result(other, 3.0), as_result(first, 2.0)],
+    ], top_k=10)
+    ids = [doc['id'] for doc in fused]
+    print(f"shared title: {ids} {[round(doc['score'], 5) for doc in fused]}")
+    if sorted(ids) != ['a', 'b', 'c']:
+        problems.append(f"同じタイトルの別のドキュメントが統合されました: {ids}")
+
+    # second は1つ目のリストの2位だけ（同じタイトルの first のスコアが加わらない）
+    scores = {doc['id']: doc['score'] for doc in fused}
+    expected = 1.0 / (RRF_K + 2)
+    if abs(scores.get('b', 0.0) - expected) > 1e-12:
+        problems.append(f"同じタイトルのドキュメントのスコアが合算されました: {scores.get('b')} (期待 {expected})")
+    return problems
+
+
+def check_corpus(documents: list) -> list:
+    """
+    実データの候補を統合して、問題の一覧を返す
+    """
+    problems = []
+    titles = {doc['title'] for doc in documents}
+    # 2つのクエリの結果が半分ずつ重なる場合
+    step = CANDIDATES // 2
+    checked = merged = 0
+    for start in range(0, len(documents) - CANDIDATES - step, CANDIDATES):
+        first = [as_result(doc, 1.0) for doc in documents[start:start + CANDIDATES]]
+        second = [as_result(doc, 1.0) for doc in documents[start + step:start + step + CANDIDATES]]
+        expected = len({doc['id'] for doc in first + second})
+        fused = reciprocal_rank_fusion([first, second], top_k=expected)
+        checked += 1
+        if len({doc['id'] for doc in fused}) != expected:
+            merged += 1
+    print(f"corpus: {len(documents)} documents / {len(titles)} titles / "
+          f"統合で件数が減った組 {merged}/{checked}")
+    if merged:
+        problems.append(f"別のドキュメントが1件に統合された組があります: {merged}/{checked}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='検索結果の統合の確認')
+    parser.add_argument('--input', type=Path, help='コーパス（JSONL またはパック形式）')
+    args = parser.parse_args()
+
+    problems = check_shared_title()
+
+    candidates = (args.input,) if args.input else DEFAULT_INPUTS
+    path = next((path for path in candidates if path.exists()), None)
+    if path is not None:
+        print(f"Input: {path}")
+        problems += check_corpus(load_documents(path))
+    else:
+        print('コーパスが見つからないため、実データでの確認は省略します')
+
+    if problems:
+        print('\n❌ 確認に失敗しました:')
+        for problem in problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print('\n✅ すべての確認に成功しました')
+
+
+if __name__ == '__main__':
+    main()
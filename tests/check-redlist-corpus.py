@@ -0,0 +1,188 @@
+"""
+実データのコーパスに対する確認（フィールドの形・種名の直接参照・分類とランクのフィルター・再ランキングの名前）
+
+Blobから取得した verify-download.jsonl（または処理済みJSONL）を読み込み、次を確認します。
+生成したサンプルデータではなく実データで確認するためのもので、条件を満たさない場合は終了コード1で終了します。
+
+- フィールド: repair_document の後、rank が RANK_LABELS の表記で、japanese_name が分類群でないこと
+- 種名の直接参照: 各ドキュメントの和名・学名を含む質問で SpeciesLookup がそのドキュメントを返すこと
+  （同名の種が max_documents 件を超える場合は、対象を絞り込めないため空のリストが正しい）
+- フィルター: 分類・ランクを含む質問の filter（rag/query_filters.py）が、AI Search と同じ完全一致で
+  その分類・ランクのドキュメントすべてに一致すること（スタブの parse_filter で評価する）
+- 再ランキングの名前: 検索結果と同じ title / content / url だけのドキュメントから、species_names が
+  修正前・修正後のどちらの本文でも本来の和名・学名を取り出すこと
+
+使い方（リポジトリルートで実行）:
+    python tests/check-redlist-corpus.py
+    python tests/check-redlist-corpus.py --input data/processed/redlist-documents.jsonl
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'tests' / 'stubs'))
+
+from rag.corpus import load_documents
+from rag.query_filters import analyze_query
+from rag.redlist import RANK_LABELS, repair_document, species_names
+from rag.species_lookup import SpeciesLookup, normalize_name
+from search_stub import parse_filter
+
+DEFAULT_INPUTS = (
+    ROOT / 'verify-download.jsonl',
+    ROOT / 'data' / 'processed' / 'redlist-documents.jsonl',
+)
+
+# 必ず直接参照で見つかるべき質問と、返るべきドキュメントの和名
+LOOKUP_CASES = (
+    ('イリオモテヤマネコは絶滅危惧種ですか?', 'イリオモテヤマネコ'),
+    ('ライチョウの生息地は?', 'ライチョウ'),
+    ('Prionailurus bengalensis iriomotensis の絶滅危惧ランクは?', 'イリオモテヤマネコ'),
+)
+
+# 分類・ランクを含む質問（filter が一致すべきドキュメントは質問から抽出した分類・ランクで決まる）
+FILTER_QUESTIONS = (
+    '鳥類で絶滅危惧IA類の種は何種ですか?',
+    '絶滅危惧I類の哺乳類を教えてください',
+    'VUに指定されている貝は?',
+    '準絶滅危惧の植物は何種ありますか?',
+    '野生絶滅した種は?',
+    '淡水魚の情報不足の種の一覧',
+)
+
+# 一致率の下限（和名の一部が別の種の和名になっている場合などを除く）
+MIN_LOOKUP_HIT_RATE = 0.95
+
+
+def check_fields(documents: list) -> list:
+    """
+    repair_document の後のフィールドの形を確認し、問題の一覧を返す
+    """
+    problems = []
+    categories = {doc.get('category') for doc in documents}
+    labels = set(RANK_LABELS.values())
+    bad_rank = [doc['id'] for doc in documents if doc.get('rank') not in labels]
+    bad_name = [doc['id'] for doc in documents if doc.get('japanese_name') in categories]
+    print(f"fields: rank が RANK_LABELS の表記でない {len(bad_rank)}件 / japanese_name が分類 {len(bad_name)}件")
+    if bad_rank:
+        problems.append(f"rank が RANK_LABELS の表記でないドキュメント: {bad_rank[:5]}")
+    if bad_name:
+        problems.append(f"japanese_name が分類のドキュメント: {bad_name[:5]}")
+    return problems
+
+
+def check_lookup(raw: list, documents: list) -> list:
+    """
+    各ドキュメントの和名・学名で直接参照できるかを確認し、問題の一覧を返す
+
+    辞書は読み込んだままのドキュメント（raw）から作成し、正解は修正後のドキュメントで判定する。
+    """
+    problems = []
+    start = time.perf_counter()
+    lookup = SpeciesLookup(raw)
+    print(f"lookup: {len(lookup.automaton)} names ({(time.perf_counter() - start) * 1000:.0f} ms)")
+
+    for question, expected in LOOKUP_CASES:
+        titles = [result['title'] for result in lookup.find(question)]
+        if not any(title.startswith(expected + ' (') for title in titles):
+            problems.append(f"{question!r} で {expected} が見つかりません: {titles}")
+
+    # 同じ名前のドキュメントの数（多すぎる場合は空のリストが正しい）
+    name_counts = {}
+    for doc in documents:
+        for field in ('japanese_name', 'scientific_name'):
+            name = normalize_name(doc.get(field) or '').strip()
+            name_counts[name] = name_counts.get(name, 0) + 1
+
+    for field in ('japanese_name', 'scientific_name'):
+        checked = hits = 0
+        latencies = []
+        for doc in documents:
+            name = (doc.get(field) or '').strip()
+            if not name or name_counts.get(normalize_name(name), 0) > 3:
+                continue
+            checked += 1
+            begin = time.perf_counter()
+            results = lookup.find(f"{name}は絶滅危惧種ですか?")
+            latencies.append(time.perf_counter() - begin)
+            if any(result['title'] == doc['title'] for result in results):
+                hits += 1
+        rate = hits / checked if checked else 0.0
+        mean_us = sum(latencies) / len(latencies) * 1e6 if latencies else 0.0
+        print(f"lookup ({field}): {hits}/{checked} hit ({rate:.3f}), mean {mean_us:.0f} µs")
+        if rate < MIN_LOOKUP_HIT_RATE:
+            problems.append(f"{field} での直接参照の一致率が低すぎます: {rate:.3f}")
+    return problems
+
+
+def check_filters(documents: list) -> list:
+    """
+    質問から作成した filter が、その分類・ランクのドキュメントに一致するかを確認し、問題の一覧を返す
+    """
+    problems = []
+    for question in FILTER_QUESTIONS:
+        analysis = analyze_query(question)
+        if not analysis.filter:
+            problems.append(f"{question!r} から filter が作成されません")
+            continue
+        conditions = parse_filter(analysis.filter)
+        matched = {doc['id'] for doc in documents
+                   if all(str(doc.get(field)) in values for field, values in conditions)}
+
+        ranks = {RANK_LABELS[code] for code in analysis.ranks}
+        expected = {doc['id'] for doc in documents
+                    if (not analysis.categories or doc.get('category') in analysis.categories)
+                    and (not ranks or doc.get('rank') in ranks)}
+        print(f"filter: {question} -> {len(matched)}件 (期待 {len(expected)}件) [{analysis.describe()}]")
+        if not expected or matched != expected:
+            problems.append(f"{question!r} の filter の一致が期待と異なります: {len(matched)}件 / 期待 {len(expected)}件")
+    return problems
+
+
+def check_species_names(raw: list, documents: list) -> list:
+    """
+    検索結果の形（title / content / url）のドキュメントから和名・学名を取り出せるかを確認し、問題の一覧を返す
+    """
+    problems = []
+    for label, source in (('修正前', raw), ('修正後', documents)):
+        wrong = [doc['id'] for doc, expected in zip(source, documents)
+                 if species_names({field: doc.get(field) for field in ('title', 'content', 'url')})
+                 != (expected['japanese_name'], expected['scientific_name'])]
+        print(f"species_names ({label}の本文): {len(source) - len(wrong)}/{len(source)} 一致")
+        if wrong:
+            problems.append(f"{label}の本文から和名・学名を取り出せないドキュメント: {wrong[:5]}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='実データのコーパスに対する確認')
+    parser.add_argument('--input', type=Path, help='コーパス（JSONL またはパック形式）')
+    args = parser.parse_args()
+
+    candidates = (args.input,) if args.input else DEFAULT_INPUTS
+    path = next((path for path in candidates if path.exists()), None)
+    if path is None:
+        print('❌ コーパスが見つかりません。--input を指定してください。')
+        sys.exit(1)
+
+    raw = load_documents(path)
+    documents = [repair_document(doc) for doc in raw]
+    repaired = sum(1 for before, after in zip(raw, documents) if before is not after)
+    print(f"Input: {path} ({len(documents)} documents, フィールドを修正 {repaired}件)")
+
+    problems = (check_fields(documents) + check_lookup(raw, documents) + check_filters(documents)
+                + check_species_names(raw, documents))
+
+    if problems:
+        print('\n❌ 確認に失敗しました:')
+        for problem in problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print('\n✅ すべての確認に成功しました')
+
+
+if __name__ == '__main__':
+    main()
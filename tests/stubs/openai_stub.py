@@ -0,0 +1,290 @@
+"""
+Azure OpenAI スタブサーバー（ローカル検証用）
+
+ネットワークに接続せずに、チャット補完（通常・ストリーミング）と埋め込みのREST APIを模擬します。
+最初のトークンまでの遅延・ジッター・生成速度（tokens/sec）を設定できます。
+
+埋め込みは文字バイグラムを次元数にハッシュした決定的なベクトルを返します
+（文字の重なりが多いテキストほどコサイン類似度が高くなるため、ハイブリッド検索の検証に使える）。
+
+使い方:
+    python tests/stubs/openai_stub.py --port 8082 --latency-ms 300 --jitter-ms 100 --tokens-per-second 50
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import random
+import struct
+import unicodedata
+import weakref
+import time
+
+from aiohttp import web
+
+# 応答として返す固定の文章（生成トークン数に合わせて切り詰める）
+STUB_ANSWER = (
+    "提供されたコンテキストによると、この種は環境省のレッドリストにおいて"
+    "絶滅危惧種に分類されています。生息地の減少が主な要因とされています。"
+    "出典: https://data.e-gov.go.jp/data/dataset/env_20140904_0456"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    日本語を含む文字列のおおよそのトークン数（1トークン≒2文字として概算）
+    """
+    return max(1, len(text) // 2)
+
+
+def stub_embedding(text: str, dimensions: int) -> list:
+    """
+    文字バイグラムを符号付きで次元にハッシュし、L2正規化したベクトル
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    vector = [0.0] * dimensions
+    for i in range(max(1, len(text) - 1)):
+        digest = hashlib.md5(text[i:i + 2].encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class OpenAIStub:
+    """
+    チャット補完APIを模擬する
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 tokens_per_second: float = 0.0, error_rate: float = 0.0,
+                 connect_latency_ms: float = 0.0, rpm_limit: float = 0.0, tpm_limit: float = 0.0,
+                 embedding_dimensions: int = 1536):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.connect_latency_ms = connect_latency_ms
+        self.embedding_dimensions = embedding_dimensions
+        # Azure OpenAIと同様に、1分あたりの上限を10秒単位の枠（上限の1/6）で判定する
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self._window_start = 0.0
+        self._window_requests = 0
+        self._window_tokens = 0
+        self.throttled = 0
+        # 接続済みのトランスポート（新規接続の最初のリクエストだけ接続遅延を加える）
+        self._connections = weakref.WeakSet()
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.embedding_requests = 0
+        self.embedded_inputs = 0
+
+    async def delay(self, request: web.Request) -> None:
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if self.connect_latency_ms > 0 and request.transport not in self._connections:
+            # TCP/TLSハンドシェイク相当の遅延を模擬
+            self._connections.add(request.transport)
+            latency += self.connect_latency_ms
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+    def answer_pieces(self, max_tokens: int) -> list:
+        """
+        応答文をトークン相当（2文字）の断片に分割する
+        """
+        text = STUB_ANSWER[:max(1, max_tokens) * 2]
+        return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+    def error_response(self):
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response(
+                {'error': {'code': '429', 'message': 'Stub rate limit'}},
+                status=429, headers={'Retry-After': '1'}
+            )
+        return None
+
+    def quota_response(self, tokens: int):
+        """
+        RPM / TPM の上限を超えた場合に429を返す
+        """
+        if not self.rpm_limit and not self.tpm_limit:
+            return None
+        now = time.monotonic()
+        if now - self._window_start >= 10:
+            self._window_start = now
+            self._window_requests = 0
+            self._window_tokens = 0
+        over_rpm = self.rpm_limit and self._window_requests + 1 > self.rpm_limit / 6
+        over_tpm = self.tpm_limit and self._window_tokens + tokens > self.tpm_limit / 6
+        if over_rpm or over_tpm:
+            self.throttled += 1
+            retry_after = 10 - (now - self._window_start)
+            return web.json_response(
+                {'error': {'code': '429', 'message': 'Requests to the deployment have exceeded the rate limit'}},
+                status=429,
+                headers={'Retry-After': str(max(1, int(retry_after + 0.999))),
+                         'retry-after-ms': str(int(retry_after * 1000))}
+            )
+        self._window_requests += 1
+        self._window_tokens += tokens
+        return None
+
+    async def handle_chat(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body = await request.json()
+        error = self.error_response()
+        if error is not None:
+            return error
+
+        prompt = ''.join(message.get('content') or '' for message in body.get('messages', []))
+        prompt_tokens = estimate_tokens(prompt)
+        error = self.quota_response(prompt_tokens + (body.get('max_tokens') or 0))
+        if error is not None:
+            return error
+        pieces = self.answer_pieces(body.get('max_tokens') or 800)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += len(pieces)
+
+        created = int(time.time())
+        model = request.match_info['deployment']
+        token_interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+        await self.delay(request)
+
+        if not body.get('stream'):
+            # 生成時間を模擬（トークン数 / 生成速度）
+            if token_interval:
+                await asyncio.sleep(token_interval * len(pieces))
+            return web.json_response({
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(pieces)},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': len(pieces),
+                    'total_tokens': prompt_tokens + len(pieces),
+                },
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+
+        async def send(payload) -> None:
+            await response.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+        def chunk(delta: dict, finish_reason=None) -> dict:
+            return {
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }
+
+        # Azure OpenAIと同様に、先頭はchoicesが空のチャンク（フィルタ結果）
+        await send({'id': '', 'object': '', 'created': 0, 'model': '', 'choices': []})
+        await send(chunk({'role': 'assistant', 'content': ''}))
+        for piece in pieces:
+            if token_interval:
+                await asyncio.sleep(token_interval)
+            await send(chunk({'content': piece}))
+        await send(chunk({}, 'stop'))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def handle_embeddings(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.embedding_requests += 1
+        body = await request.json()
+        inputs = body.get('input') or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        tokens = sum(estimate_tokens(text) for text in inputs)
+        error = self.error_response() or self.quota_response(tokens)
+        if error is not None:
+            return error
+        await self.delay(request)
+
+        dimensions = int(body.get('dimensions') or self.embedding_dimensions)
+        data = []
+        for index, text in enumerate(inputs):
+            vector = stub_embedding(text, dimensions)
+            if body.get('encoding_format') == 'base64':
+                # openai SDK は numpy がある場合 base64（float32 リトルエンディアン）で要求する
+                embedding = base64.b64encode(struct.pack(f'<{dimensions}f', *vector)).decode('ascii')
+            else:
+                embedding = vector
+            data.append({'object': 'embedding', 'index': index, 'embedding': embedding})
+        self.embedded_inputs += len(inputs)
+        self.prompt_tokens += tokens
+        return web.json_response({
+            'object': 'list',
+            'data': data,
+            'model': request.match_info['deployment'],
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        })
+
+    async def handle_models(self, request: web.Request) -> web.Response:
+        await self.delay(request)
+        return web.json_response({'object': 'list', 'data': [{'id': 'gpt-4', 'object': 'model'}]})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'requests': self.requests,
+            'errors': self.errors,
+            'throttled': self.throttled,
+            'embedding_requests': self.embedding_requests,
+            'embedded_inputs': self.embedded_inputs,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+        })
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/openai/deployments/{deployment}/chat/completions', self.handle_chat)
+        app.router.add_post('/openai/deployments/{deployment}/embeddings', self.handle_embeddings)
+        app.router.add_get('/openai/models', self.handle_models)
+        app.router.add_get('/_stub/stats', self.handle_stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Azure OpenAI スタブサーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='最初のトークンまでの遅延')
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--tokens-per-second', type=float, default=0.0,
+                        help='生成速度（0の場合は待機なし）')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='429（Retry-After付き）を返す割合（0〜1）')
+    parser.add_argument('--connect-latency-ms', type=float, default=0.0,
+                        help='新規接続の最初のリクエストに加える遅延（TLSハンドシェイク相当）')
+    parser.add_argument('--rpm-limit', type=float, default=0.0, help='1分あたりのリクエスト数の上限')
+    parser.add_argument('--tpm-limit', type=float, default=0.0,
+                        help='1分あたりのトークン数の上限（プロンプト + max_tokens）')
+    parser.add_argument('--embedding-dimensions', type=int, default=1536,
+                        help='埋め込みの次元数（リクエストで dimensions を指定しない場合）')
+    args = parser.parse_args()
+
+    stub = OpenAIStub(args.latency_ms, args.jitter_ms, args.tokens_per_second, args.error_rate,
+                      args.connect_latency_ms, args.rpm_limit, args.tpm_limit, args.embedding_dimensions)
+    print(f"OpenAI stub: http://{args.host}:{args.port}")
+    web.run_app(stub.build_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""
+Azure AI Search スタブサーバー（ローカル検証用）
+
+ネットワークに接続せずに、インデックス登録（docs/search.index）と
+検索（docs/search.post.search）のREST APIを模擬します。
+遅延・ジッター・スロットリングを設定でき、アップロードやベンチマークの検証に使用します。
+vectorQueries を指定した場合は登録済みのベクトルとのコサイン類似度で順位を付け、
+検索語がある場合は AI Search のハイブリッド検索と同様に RRF で統合します。
+
+使い方:
+    python tests/stubs/search_stub.py --port 8081 --corpus data/processed/redlist-documents.jsonl
+    python tests/stubs/search_stub.py --port 8081 --latency-ms 80 --jitter-ms 40 --throttle-rate 0.1
+    python tests/stubs/search_stub.py --port 8081 --latency-ms 50 --slow-rate 0.02 --slow-ms 2000
+"""
+import argparse
+import asyncio
+import random
+import re
+import weakref
+import sys
+from pathlib import Path
+
+import numpy as np
+from aiohttp import web
+
+# リポジトリルートの rag パッケージを読み込めるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from rag.corpus import load_documents
+from rag.local_search import LocalSearchIndex
+from rag.multi_query import RRF_K
+from rag.redlist import repair_document
+
+
+# filter で扱う式（and で連結した eq と search.in のみ）
+_EQ_RE = re.compile(r"^(\w+) eq '((?:[^']|'')*)'$")
+_IN_RE = re.compile(r"^search\.in\((\w+), '((?:[^']|'')*)'(?:, '([^']*)')?\)$")
+
+
+def parse_filter(expression: str):
+    """
+    OData の filter 式を (フィールド, 許容する値の集合) のリストに変換
+    """
+    conditions = []
+    for clause in expression.split(' and '):
+        clause = clause.strip()
+        match = _EQ_RE.match(clause)
+        if match:
+            conditions.append((match.group(1), {match.group(2).replace("''", "'")}))
+            continue
+        match = _IN_RE.match(clause)
+        if match:
+            delimiter = match.group(3) or ' ,'
+            values = re.split('|'.join(re.escape(ch) for ch in delimiter), match.group(2).replace("''", "'"))
+            conditions.append((match.group(1), {value for value in values if value}))
+            continue
+        raise ValueError(f'Unsupported filter clause: {clause}')
+    return conditions
+
+
+class SearchStub:
+    """
+    インメモリのドキュメントストアとローカル検索で AI Search を模擬する
+    """
+
+    def __init__(self, documents: list = None, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 throttle_rate: float = 0.0, connect_latency_ms: float = 0.0,
+                 slow_rate: float = 0.0, slow_ms: float = 0.0):
+        # upload-index.py で登録した場合と同じく、フィールドのずれたドキュメントは本来の形に戻す
+        self.documents = {str(doc['id']): repair_document(doc) for doc in (documents or [])}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.connect_latency_ms = connect_latency_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        # 接続済みのトランスポート（新規接続の最初のリクエストだけ接続遅延を加える）
+        self._connections = weakref.WeakSet()
+        self.requests = 0
+        self.throttled = 0
+        self.slow = 0
+        self._index = None
+        # ベクトルフィールド -> (ドキュメントのリスト, 正規化済みの行列)
+        self._vectors = {}
+
+    async def delay(self, request: web.Request) -> None:
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if self.connect_latency_ms > 0 and request.transport not in self._connections:
+            # TCP/TLSハンドシェイク相当の遅延を模擬
+            self._connections.add(request.transport)
+            latency += self.connect_latency_ms
+        if self.slow_rate > 0 and random.random() < self.slow_rate:
+            # まれに大きく遅れる応答（テールレイテンシ）を模擬
+            self.slow += 1
+            latency += self.slow_ms
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+    def throttle(self) -> bool:
+        if self.throttle_rate > 0 and random.random() < self.throttle_rate:
+            self.throttled += 1
+            return True
+        return False
+
+    def search_index(self) -> LocalSearchIndex:
+        # ドキュメントが更新されたら次回検索時にインデックスを作り直す
+        if self._index is None:
+            self._index = LocalSearchIndex.from_documents(list(self.documents.values()))
+        return self._index
+
+    def vector_ranking(self, vector_query: dict, conditions: list) -> list:
+        """
+        ベクトルクエリに近い順の (コサイン類似度, ドキュメント) のリスト
+        """
+        field = vector_query.get('fields', '').split(',')[0].strip()
+        if field not in self._vectors:
+            docs = [doc for doc in self.documents.values() if doc.get(field)]
+            matrix = np.asarray([doc[field] for doc in docs], dtype=np.float32).reshape(len(docs), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._vectors[field] = (docs, matrix / np.where(norms > 0, norms, 1))
+        docs, matrix = self._vectors[field]
+        if not docs:
+            return []
+
+        vector = np.asarray(vector_query.get('vector') or [], dtype=np.float32)
+        if vector.shape != (matrix.shape[1],):
+            raise ValueError(f"Vector has {vector.size} dimensions (expected {matrix.shape[1]})")
+        similarities = matrix @ (vector / (np.linalg.norm(vector) or 1))
+        ranked = []
+        for doc_index in np.argsort(-similarities, kind='stable'):
+            doc = docs[doc_index]
+            if all(str(doc.get(field)) in values for field, values in conditions):
+                ranked.append((float(similarities[doc_index]), doc))
+                if len(ranked) >= (vector_query.get('k') or 50):
+                    break
+        return ranked
+
+    async def handle_index(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await self.delay(request)
+        if self.throttle():
+            return web.json_response(
+                {'error': {'code': 'ServiceUnavailable', 'message': 'Stub throttling'}},
+                status=503, headers={'Retry-After': '0.1'}
+            )
+
+        body = await request.json()
+        results = []
+        for action in body.get('value', []):
+            kind = action.pop('@search.action', 'upload')
+            key = str(action.get('id'))
+            if kind == 'delete':
+                self.documents.pop(key, None)
+            elif kind in ('merge', 'mergeOrUpload') and key in self.documents:
+                self.documents[key].update(action)
+            elif kind == 'merge':
+                results.append({'key': key, 'status': False, 'statusCode': 404,
+                                'errorMessage': 'Document not found'})
+                continue
+            else:
+                self.documents[key] = action
+            results.append({'key': key, 'status': True, 'statusCode': 200, 'errorMessage': None})
+
+        self._index = None
+        self._vectors = {}
+        status = 200 if all(result['status'] for result in results) else 207
+        return web.json_response({'value': results}, status=status)
+
+    async def handle_search(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        # 遅延中にクライアントが取り消した場合（期限切れのクエリなど）に備えて、先に本文を読む
+        body = await request.json()
+        await self.delay(request)
+        if self.throttle():
+            return web.json_response(
+                {'error': {'code': 'ServiceUnavailable', 'message': 'Stub throttling'}},
+                status=503, headers={'Retry-After': '0.1'}
+            )
+
+        top = body.get('top')
+        top = 50 if top is None else top
+        select = body.get('select')
+        fields = [field.strip() for field in select.split(',')] if select else None
+        try:
+            conditions = parse_filter(body['filter']) if body.get('filter') else []
+        except ValueError as e:
+            return web.json_response({'error': {'code': 'InvalidRequestParameter', 'message': str(e)}},
+                                     status=400)
+
+        index = self.search_index()
+        query = body.get('search') or ''
+        # search='*' はすべてのドキュメントに一致する（スコアは1）
+        scores = [1.0] * len(index.documents) if query.strip() == '*' else index.score(query)
+
+        matched = []
+        for doc_index in range(len(scores)):
+            if scores[doc_index] <= 0:
+                continue
+            doc = self.documents.get(str(index.documents[doc_index].get('id')), {})
+            if all(str(doc.get(field)) in values for field, values in conditions):
+                matched.append((float(scores[doc_index]), doc))
+        matched.sort(key=lambda item: -item[0])
+
+        vector_queries = body.get('vectorQueries') or []
+        if vector_queries:
+            try:
+                ranked_lists = [self.vector_ranking(vq, conditions) for vq in vector_queries]
+            except ValueError as e:
+                return web.json_response({'error': {'code': 'InvalidRequestParameter', 'message': str(e)}},
+                                         status=400)
+            if query.strip():
+                ranked_lists.insert(0, matched)
+            # テキストとベクトルの結果を順位で統合する（スコアは RRF のスコア）
+            fused = {}
+            for ranked in ranked_lists:
+                for rank, (_, doc) in enumerate(ranked, start=1):
+                    score, _ = fused.get(str(doc.get('id')), (0.0, doc))
+                    fused[str(doc.get('id'))] = (score + 1.0 / (RRF_K + rank), doc)
+            matched = sorted(fused.values(), key=lambda item: -item[0])
+
+        value = []
+        for score, doc in matched[:top]:
+            item = {field: doc.get(field) for field in fields} if fields else dict(doc)
+            item['@search.score'] = score
+            value.append(item)
+
+        response = {'value': value}
+        if body.get('count'):
+            response['@odata.count'] = len(matched)
+        if body.get('facets'):
+            facets = {}
+            for facet in body['facets']:
+                field, _, options = facet.partition(',')
+                limit = int(dict(option.split(':') for option in options.split(',') if ':' in option)
+                            .get('count', 10))
+                counts = {}
+                for _, doc in matched:
+                    counts[doc.get(field)] = counts.get(doc.get(field), 0) + 1
+                ordered = sorted(counts.items(), key=lambda item: -item[1])[:limit]
+                facets[field] = [{'value': v, 'count': c} for v, c in ordered]
+            response['@search.facets'] = facets
+        return web.json_response(response)
+
+    async def handle_count(self, request: web.Request) -> web.Response:
+        await self.delay(request)
+        return web.Response(text=str(len(self.documents)), content_type='text/plain')
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'documents': len(self.documents),
+            'requests': self.requests,
+            'throttled': self.throttled,
+            'slow': self.slow,
+        })
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post(r"/indexes('{index}')/docs/search.index", self.handle_index)
+        app.router.add_post(r"/indexes('{index}')/docs/search.post.search", self.handle_search)
+        app.router.add_get(r"/indexes('{index}')/docs/$count", self.handle_count)
+        app.router.add_get('/_stub/stats', self.handle_stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Azure AI Search スタブサーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--corpus', type=Path, help='起動時に登録するJSONL（パック形式も可）')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='503（Retry-After付き）を返す割合（0〜1）')
+    parser.add_argument('--connect-latency-ms', type=float, default=0.0,
+                        help='新規接続の最初のリクエストに加える遅延（TLSハンドシェイク相当）')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='--slow-ms だけ遅れて応答する割合（0〜1）')
+    parser.add_argument('--slow-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    documents = load_documents(args.corpus) if args.corpus else []
+    stub = SearchStub(documents, args.latency_ms, args.jitter_ms, args.throttle_rate,
+                      args.connect_latency_ms, args.slow_rate, args.slow_ms)
+    print(f"Search stub: http://{args.host}:{args.port} ({len(documents)} documents)")
+    web.run_app(stub.build_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()